@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Results store analysis.
+
+Works on the memory-mapped columns of the runs the dispatcher wrote to the
+results store (results_store.py); every statistic is a NumPy operation over
+whole columns.
+
+Usage:
+  python analyze_results.py runs [--task task_a] [--worker W] [--since 2024-05-01]
+  python analyze_results.py summary latest [--bucket 1.0]
+  python analyze_results.py compare BASE_RUN RUN [--threshold 0.10]
+"""
+import argparse
+import sys
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    print("Error: analyze_results.py needs NumPy: pip install numpy")
+    sys.exit(1)
+
+from results_store import DEFAULT_DIR, STATUSES, ResultsStore
+
+PERCENTILES = (50, 90, 99)
+
+# (phase, from, to), as in timeline.py
+PHASES = [
+    ('queue', 'published_at', 'received_at'),
+    ('reserved', 'received_at', 'started_at'),
+    ('execute', 'started_at', 'finished_at'),
+    ('result', 'finished_at', 'returned_at'),
+]
+
+
+def parse_time(value: str) -> float:
+    """Unix timestamp or ISO date/time -> Unix timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def select(rows, run: dict, task: str = None, worker: str = None, since: float = None, until: float = None):
+    """Boolean mask of the records matching a task / worker / returned_at range."""
+    mask = np.ones(len(rows), dtype=bool)
+    for field, name in (('task', task), ('worker', worker)):
+        if name is not None:
+            code = run[field].index(name) if name in run[field] else -1
+            mask &= rows[field] == code
+    if since is not None:
+        mask &= rows['returned_at'] >= since
+    if until is not None:
+        mask &= rows['returned_at'] <= until
+    return mask
+
+
+def latency_ms(rows):
+    """End-to-end latency per record (publish -> result back), NaN where unknown."""
+    return (rows['returned_at'] - rows['published_at']) * 1000
+
+
+def percentiles(values) -> list:
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return [float('nan')] * len(PERCENTILES)
+    return list(np.percentile(values, PERCENTILES))
+
+
+def throughput(rows) -> float:
+    """Results per second between the first and last result (records with no return time are left out)."""
+    returned = rows['returned_at'][~np.isnan(rows['returned_at'])]
+    if len(returned) < 2:
+        return float('nan')
+    span = np.nanmax(returned) - np.nanmin(returned)
+    return len(returned) / span if span > 0 else float('nan')
+
+
+def task_stats(rows, run: dict) -> dict:
+    """{task: {'count', 'errors', 'p50', 'p90', 'p99', 'throughput'}} over successful results."""
+    stats = {}
+    ok = rows['status'] == STATUSES.index('success')
+    latency = latency_ms(rows)
+    for code, name in enumerate(run['task']):
+        mask = rows['task'] == code
+        if not mask.any():
+            continue
+        p50, p90, p99 = percentiles(latency[mask & ok])
+        stats[name] = {'count': int(mask.sum()), 'errors': int((mask & ~ok).sum()),
+                       'p50': p50, 'p90': p90, 'p99': p99, 'throughput': throughput(rows[mask])}
+    return stats
+
+
+def print_runs(store: ResultsStore, args):
+    runs = store.runs(task=args.task, worker=args.worker, since=args.since, until=args.until)
+    if not runs:
+        print(f"No matching runs in {store.directory}")
+        return
+    print(f"{'run':<24} {'started':<19} {'results':>8} {'errors':>7} {'tasks/s':>9} {'p50':>9} {'p99':>9}  (ms)")
+    for run in runs:
+        rows = store.rows(run)
+        rows = rows[select(rows, run, args.task, args.worker)]
+        ok = rows['status'] == STATUSES.index('success')
+        p50, _, p99 = percentiles(latency_ms(rows[ok]))
+        started = datetime.fromtimestamp(run['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{run['run_id']:<24} {started:<19} {len(rows):>8} {int((~ok).sum()):>7} "
+              f"{throughput(rows):>9.1f} {p50:>9.1f} {p99:>9.1f}")
+
+
+def print_summary(store: ResultsStore, args):
+    run, rows = store.load(args.run_id)
+    rows = rows[select(rows, run, args.task, args.worker, args.since, args.until)]
+    print(f"Run {run['run_id']}: {len(rows)} results "
+          f"({', '.join(f'{key}={value}' for key, value in run.get('metadata', {}).items())})")
+    if not len(rows):
+        return
+
+    print(f"\n  {'task':<12} {'count':>7} {'errors':>7} {'tasks/s':>9} {'p50':>9} {'p90':>9} {'p99':>9}  (latency, ms)")
+    for name, s in task_stats(rows, run).items():
+        print(f"  {name:<12} {s['count']:>7} {s['errors']:>7} {s['throughput']:>9.1f} "
+              f"{s['p50']:>9.1f} {s['p90']:>9.1f} {s['p99']:>9.1f}")
+
+    ok = rows[rows['status'] == STATUSES.index('success')]
+    print(f"\n  {'phase':<12} {'p50':>9} {'p90':>9} {'p99':>9}  (ms)")
+    for phase, start, end in PHASES:
+        # Clock skew between hosts can make a cross-host phase slightly negative
+        p50, p90, p99 = percentiles(np.maximum(ok[end] - ok[start], 0) * 1000)
+        print(f"  {phase:<12} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f}")
+
+    workers = np.bincount(rows['worker'], minlength=len(run['worker']))
+    print(f"\n  {'worker':<40} {'results':>8}")
+    for code in np.flatnonzero(workers):
+        print(f"  {run['worker'][code]:<40} {workers[code]:>8}")
+
+    returned = rows['returned_at'] - run['started_at']
+    returned = returned[~np.isnan(returned)]
+    if not len(returned):
+        return
+    edges = np.arange(0, np.nanmax(returned) + args.bucket, args.bucket)
+    counts, _ = np.histogram(returned, bins=edges) if len(edges) > 1 else (np.array([len(returned)]), None)
+    print(f"\n  Throughput over time ({args.bucket:g}s buckets from run start):")
+    scale = 50 / max(counts.max(), 1)
+    for i, count in enumerate(counts):
+        print(f"  {edges[i]:>8.1f}s {count / args.bucket:>9.1f}/s {'█' * int(count * scale)}")
+
+
+def compare_runs(store: ResultsStore, args) -> bool:
+    """Print per-task changes from BASE to RUN; True if any task regressed beyond the threshold."""
+    base_run, base_rows = store.load(args.base_run_id)
+    run, rows = store.load(args.run_id)
+    base_stats, stats = task_stats(base_rows, base_run), task_stats(rows, run)
+    print(f"Comparing {run['run_id']} against {base_run['run_id']} (threshold {args.threshold:.0%})")
+    print(f"  {'task':<12} {'metric':<11} {'base':>10} {'run':>10} {'change':>8}")
+
+    regressed = False
+    for name in sorted(set(base_stats) & set(stats)):
+        # (metric, higher is worse)
+        for metric, higher_is_worse in (('p50', True), ('p99', True), ('throughput', False)):
+            before, after = base_stats[name][metric], stats[name][metric]
+            if np.isnan(before) or np.isnan(after) or before == 0:
+                continue
+            change = after / before - 1
+            worse = change > args.threshold if higher_is_worse else change < -args.threshold
+            regressed |= worse
+            print(f"  {name:<12} {metric:<11} {before:>10.1f} {after:>10.1f} {change:>+8.1%}"
+                  f"{'  REGRESSION' if worse else ''}")
+    for name in sorted(set(base_stats) ^ set(stats)):
+        print(f"  {name:<12} only in {'base' if name in base_stats else 'run'}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze runs in the dispatcher results store')
+    parser.add_argument('--dir', default=DEFAULT_DIR,
+                        help=f'Results store directory (default: {DEFAULT_DIR}, or RESULTS_DIR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('--task', help='Only this task (e.g. task_a)')
+    filters.add_argument('--worker', help='Only results from this worker hostname')
+    filters.add_argument('--since', type=parse_time, help='Unix time or ISO date/time')
+    filters.add_argument('--until', type=parse_time, help='Unix time or ISO date/time')
+
+    commands.add_parser('runs', parents=[filters], help='List runs with throughput and latency')
+    summary = commands.add_parser('summary', parents=[filters],
+                                  help='Percentiles, phases, workers and throughput over time for one run')
+    summary.add_argument('run_id', help="Run ID, or 'latest'")
+    summary.add_argument('--bucket', type=float, default=1.0,
+                         help='Throughput-over-time bucket in seconds (default: 1)')
+    compare = commands.add_parser('compare', help='Per-task regressions of one run against a baseline run')
+    compare.add_argument('base_run_id', help='Baseline run ID')
+    compare.add_argument('run_id', help="Run ID to check, or 'latest'")
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help='Relative change counted as a regression (default: 0.10 = 10%%)')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.dir)
+    try:
+        if args.command == 'runs':
+            print_runs(store, args)
+        elif args.command == 'summary':
+            print_summary(store, args)
+        elif compare_runs(store, args):
+            sys.exit(1)
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+asyncio bridge for task results.
+
+The rpc backend delivers every reply for this process on one queue and one
+connection. AsyncResultConsumer registers that connection's socket with the
+event loop, drains it whenever it is readable and resolves one future per
+task, so any number of results can be awaited from a single thread.
+"""
+import asyncio
+import socket
+
+
+class AsyncResultConsumer:
+    """Await Celery results as asyncio futures without a thread per task."""
+
+    def __init__(self, app, loop: asyncio.AbstractEventLoop = None, poll_interval: float = 0.05):
+        self.app = app
+        self.loop = loop or asyncio.get_running_loop()
+        self.poll_interval = poll_interval
+        self._futures = {}  # task_id -> Future
+        self._fd = None
+        self._poll_handle = None
+
+    def __len__(self):
+        """Number of results still awaited."""
+        return len(self._futures)
+
+    def wait_for(self, async_result) -> asyncio.Future:
+        """Return a future resolved with the AsyncResult once the task is ready."""
+        future = self.loop.create_future()
+        self._futures[async_result.id] = future
+        async_result.then(self._on_ready)
+        self._watch()
+        return future
+
+    def _on_ready(self, async_result):
+        future = self._futures.pop(async_result.id, None)
+        if future is not None and not future.done():
+            future.set_result(async_result)
+
+    def _consumer_fileno(self):
+        # The rpc result consumer opens its connection on the first consume_from()
+        connection = getattr(self.app.backend.result_consumer, '_connection', None)
+        try:
+            return connection.connection.sock.fileno()
+        except AttributeError:
+            return None  # transport without a socket (memory/filesystem): poll instead
+
+    def _watch(self):
+        if self._fd is not None or self._poll_handle is not None:
+            return
+        fd = self._consumer_fileno()
+        if fd is not None:
+            self._fd = fd
+            self.loop.add_reader(fd, self._drain)
+            self._drain()  # replies may already be buffered
+        else:
+            self._poll_handle = self.loop.call_later(self.poll_interval, self._poll)
+
+    def _drain(self):
+        try:
+            while self._futures:
+                self.app.backend.result_consumer.drain_events(timeout=0)
+        except socket.timeout:
+            pass
+        except Exception as exc:
+            self._fail_all(exc)
+
+    def _poll(self):
+        self._poll_handle = None
+        self._drain()
+        if self._futures:
+            self._poll_handle = self.loop.call_later(self.poll_interval, self._poll)
+
+    def _fail_all(self, exc: Exception):
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def close(self):
+        """Stop watching the reply connection."""
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self._fd = None
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Per-task logging overhead micro-benchmark.
+
+Emits the same log lines a task does (start + completion with task metadata)
+under each logging mode and reports the time spent on the task's own thread
+per task, plus the total time until every line has been written.
+"""
+import argparse
+import logging
+import os
+import time
+import uuid
+
+import celery_app
+from celery_app import setup_logging, should_log_task, teardown_logging
+
+logger = logging.getLogger('celery_app.bench')
+
+MODES = [
+    ('sync', {'mode': 'sync'}),
+    ('async', {'mode': 'async'}),
+    ('async, sample 1/10', {'mode': 'async', 'sample_success': 10}),
+    ('async, sample 1/100', {'mode': 'async', 'sample_success': 100}),
+]
+
+def log_like_a_task():
+    """The logging a task body does for one successful run."""
+    task_id = str(uuid.uuid4())
+    log_task = should_log_task()
+    if log_task:
+        logger.info(
+            "Starting task_a execution",
+            extra={'task_id': task_id, 'task_name': 'task_a', 'worker_id': 'worker-a',
+                   'queue': 'queue_a', 'retry_count': 0}
+        )
+        logger.info(
+            "Completed task_a execution",
+            extra={'task_id': task_id, 'task_name': 'task_a', 'execution_time': 0.5012}
+        )
+
+def run_benchmark(tasks: int):
+    with open(os.devnull, 'w') as devnull:
+        # Baseline: the task-side work without any handler attached
+        teardown_logging()
+        start = time.perf_counter()
+        for _ in range(tasks):
+            str(uuid.uuid4())
+        baseline = (time.perf_counter() - start) / tasks * 1e6
+
+        print(f"Per-task logging overhead over {tasks} tasks (output to {os.devnull})")
+        print(f"  {'mode':<22} {'task thread us/task':>20} {'until written us/task':>22}")
+        for label, options in MODES:
+            setup_logging(stream=devnull, **options)
+            start = time.perf_counter()
+            for _ in range(tasks):
+                log_like_a_task()
+            caller = time.perf_counter() - start
+            teardown_logging()  # waits for the listener to write everything queued
+            total = time.perf_counter() - start
+            print(f"  {label:<22} {caller / tasks * 1e6 - baseline:>20.2f} {total / tasks * 1e6 - baseline:>22.2f}")
+
+    # Restore the configured logging for anything that runs after us
+    logging_config = celery_app.config.get('logging') or {}
+    setup_logging(
+        mode=logging_config.get('mode', 'async'),
+        level=logging_config.get('level', 'INFO'),
+        sample_success=logging_config.get('sample_success', 1),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-task logging overhead')
+    parser.add_argument('--tasks', '-t', type=int, default=20000,
+                        help='Number of simulated tasks per mode (default: 20000)')
+    args = parser.parse_args()
+    run_benchmark(args.tasks)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark.
+
+Times the commands CI launches over and over -- the dispatcher's --help,
+importing celery_app with a warm and a cold config cache -- as fresh
+interpreters, and lists the slowest imports from `python -X importtime`.
+
+With --save-baseline the results are written to a baseline file; later runs
+compare against it and exit non-zero when any command is slower than the
+baseline by more than --tolerance, so the check can gate a CI job.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_BASELINE = 'startup_baseline.json'
+
+# name -> (command arguments, needs a cold config cache)
+COMMANDS = {
+    'dispatch --help': (['dispatch.py', '--help'], False),
+    'dispatch --workers': (['dispatch.py', '--workers'], False),
+    'import celery_app (cached config)': (['-c', 'import celery_app'], False),
+    'import celery_app (cold config)': (['-c', 'import celery_app'], True),
+}
+
+def time_command(args: list, runs: int, cold_cache: bool) -> dict:
+    """Wall time of `python <args>` over several runs, in ms."""
+    samples = []
+    for _ in range(runs):
+        env = dict(os.environ)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            if cold_cache:
+                env['CONFIG_CACHE_DIR'] = cache_dir
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable] + args, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            samples.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+            raise RuntimeError(f"python {' '.join(args)} failed: {completed.stderr.decode()[-500:]}")
+    return {'min_ms': min(samples), 'median_ms': statistics.median(samples)}
+
+def slowest_imports(module: str, top: int) -> list:
+    """(cumulative ms, self ms, module) for the slowest imports of `module`."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Only top-level and second-level imports: deeper ones are inside these
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            imports.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+def run_benchmark(runs: int, top: int) -> dict:
+    print(f"Startup time, {runs} runs each (python alone: ", end='')
+    baseline_python = time_command(['-c', 'pass'], runs, False)
+    print(f"{baseline_python['min_ms']:.0f}ms)")
+    print(f"  {'command':<36} {'min':>8} {'median':>8}  (ms)")
+    results = {}
+    for name, (args, cold_cache) in COMMANDS.items():
+        results[name] = time_command(args, runs, cold_cache)
+        print(f"  {name:<36} {results[name]['min_ms']:>8.0f} {results[name]['median_ms']:>8.0f}")
+
+    print(f"\nSlowest imports of celery_app (python -X importtime):")
+    print(f"  {'cumulative':>10} {'self':>8}  module")
+    for cumulative, self_time, name in slowest_imports('celery_app', top):
+        print(f"  {cumulative:>10.1f} {self_time:>8.1f}  {name}")
+    return results
+
+def check_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Commands whose median is more than `tolerance` slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name]['median_ms'] * (1 + tolerance)
+        if result['median_ms'] > limit:
+            regressions.append(f"{name}: {result['median_ms']:.0f}ms > {limit:.0f}ms "
+                               f"(baseline {baseline[name]['median_ms']:.0f}ms + {tolerance:.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure dispatcher and celery_app startup time')
+    parser.add_argument('--runs', '-r', type=int, default=10,
+                        help='Runs per command (default: 10)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest imports to list (default: 10)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f'Baseline file to compare against (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write these results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown over the baseline median (default: 0.25 = 25%%)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.runs, args.top)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline, 'r') as f:
+        regressions = check_regressions(results, json.load(f), args.tolerance)
+    if regressions:
+        print("\nStartup regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo startup regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == '__main__':
+    main()
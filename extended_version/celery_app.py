@@ -3,36 +3,204 @@ Celery application with distributed task routing and structured logging.
 """
 import os
 import time
+import atexit
+import itertools
 import logging
 import json
+import queue
 from datetime import datetime, timezone
-from celery import Celery
+from logging.handlers import QueueHandler, QueueListener
+from celery import Celery, signals
 from celery.utils.log import get_task_logger
+from kombu import compression
 from pythonjsonlogger import jsonlogger
 
+from config_cache import load_yaml
+
+CONFIG_FILE = os.getenv('TEST_CONFIG', 'test-config.yml')
+
+def load_config():
+    """Load optional overrides from test-config.yml (defaults apply if it is missing)."""
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+    try:
+        return load_yaml(CONFIG_FILE) or {}
+    except Exception as e:
+        raise RuntimeError(f"Failed to load {CONFIG_FILE}: {e}")
+
+def register_lz4():
+    """Register lz4 frame compression with kombu (optional dependency)."""
+    try:
+        import lz4.frame
+    except ImportError:
+        raise RuntimeError("lz4 compression is configured in test-config.yml but the lz4 package is not installed")
+    compression.register(lz4.frame.compress, lz4.frame.decompress, 'application/x-lz4', aliases=['lz4'])
+
+# Profile keys in test-config.yml -> Celery settings
+TUNING_SETTINGS = {
+    'prefetch_multiplier': 'worker_prefetch_multiplier',
+    'acks_late': 'task_acks_late',
+    'max_tasks_per_child': 'worker_max_tasks_per_child',
+    'concurrency': 'worker_concurrency',
+}
+
+def tuning_settings(config):
+    """
+    Build worker settings from the active profile in the `worker_tuning` section.
+    The profile is named by the WORKER_PROFILE environment variable, falling back
+    to `worker_tuning.profile`; settings a profile leaves out keep their defaults.
+    """
+    tuning = config.get('worker_tuning') or {}
+    name = os.getenv('WORKER_PROFILE') or tuning.get('profile')
+    if not name:
+        return {}
+    profiles = tuning.get('profiles') or {}
+    if name not in profiles:
+        raise RuntimeError(f"Worker tuning profile '{name}' not found in worker_tuning.profiles")
+    profile = profiles[name] or {}
+    return {setting: profile[key] for key, setting in TUNING_SETTINGS.items() if key in profile}
+
+def serialization_settings(config):
+    """
+    Build Celery settings from the `serialization` section of test-config.yml.
+    Per-route serializer/compression is applied to task messages through task
+    annotations; results share one serializer for all tasks. The rpc://
+    result backend publishes results uncompressed, so a results compression
+    is rejected rather than silently ignored.
+    """
+    serialization = config.get('serialization') or {}
+    results = serialization.get('results') or {}
+    if results.get('compression'):
+        raise RuntimeError("serialization.results.compression is not supported: the rpc:// result backend "
+                           "does not compress results (compress task messages per route instead)")
+    result_serializer = results.get('serializer', 'json')
+    annotations = {}
+    serializers = {'json', result_serializer}
+    compressions = set()
+    for task, options in (serialization.get('routes') or {}).items():
+        options = {key: options[key] for key in ('serializer', 'compression') if options.get(key)}
+        if options:
+            annotations[f'celery_app.{task}'] = options
+            serializers.add(options.get('serializer', 'json'))
+            compressions.add(options.get('compression'))
+    if 'lz4' in compressions:
+        register_lz4()
+    return {
+        'task_annotations': annotations,
+        'accept_content': sorted(serializers),
+        'result_serializer': result_serializer,
+    }
+
 # Configure structured logging
-def setup_logging():
-    """Set up structured JSON logging for Celery tasks."""
-    logger = logging.getLogger()
-    handler = logging.StreamHandler()
-    
-    # Custom JSON formatter with additional fields
-    class CustomJsonFormatter(jsonlogger.JsonFormatter):
-        def add_fields(self, log_record, record, message_dict):
-            super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
-            log_record['timestamp'] = datetime.now(timezone.utc).isoformat()
-            log_record['service'] = 'celery-worker'
-            log_record['worker_id'] = os.getenv('WORKER_ID', 'unknown')
-            
-    formatter = CustomJsonFormatter(
+class CustomJsonFormatter(jsonlogger.JsonFormatter):
+    """JSON formatter with service metadata; static fields are resolved once per process."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.static_fields = {
+            'service': 'celery-worker',
+            'worker_id': os.getenv('WORKER_ID', 'unknown'),
+        }
+    
+    def add_fields(self, log_record, record, message_dict):
+        super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
+        # Time of the logging call, not of formatting (which may happen later on the listener thread)
+        log_record['timestamp'] = datetime.fromtimestamp(record.created, timezone.utc).isoformat()
+        log_record.update(self.static_fields)
+
+class LocalQueueHandler(QueueHandler):
+    """Queue handler for an in-process listener: records are enqueued as-is, formatting happens on the listener thread."""
+    
+    def prepare(self, record):
+        return record
+
+class TaskSuccessSampler(logging.Filter):
+    """Keep 1 in N of Celery's per-task 'succeeded' lines, which repeat the full result."""
+    
+    def __init__(self):
+        super().__init__()
+        self.counter = itertools.count()
+    
+    def filter(self, record):
+        if record.name != 'celery.app.trace' or record.levelno != logging.INFO:
+            return True
+        return LOG_SAMPLE_SUCCESS == 1 or next(self.counter) % LOG_SAMPLE_SUCCESS == 0
+
+_log_handler = None
+_log_listener = None
+_task_log_counter = itertools.count()
+LOG_SAMPLE_SUCCESS = 1
+
+def setup_logging(mode: str = 'async', level='INFO', sample_success: int = 1, stream=None):
+    """
+    Set up structured JSON logging for Celery tasks.
+    
+    mode 'sync' formats and writes on the logging thread; mode 'async' only
+    enqueues the record and a background listener thread formats and writes
+    it. sample_success=N keeps the info lines of 1 in N tasks; failures and
+    retries are always logged.
+    """
+    global _log_handler, _log_listener, LOG_SAMPLE_SUCCESS
+    teardown_logging()
+    
+    output = logging.StreamHandler(stream)
+    output.setFormatter(CustomJsonFormatter(
         '%(timestamp)s %(service)s %(worker_id)s %(levelname)s %(name)s %(message)s'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+    ))
+    if mode == 'async':
+        _log_handler = LocalQueueHandler(queue.SimpleQueue())
+        _log_listener = QueueListener(_log_handler.queue, output, respect_handler_level=True)
+        _log_listener.start()
+    else:
+        _log_handler = output
+    _log_handler.addFilter(TaskSuccessSampler())
+    
+    logger = logging.getLogger()
+    logger.addHandler(_log_handler)
+    logger.setLevel(level)
+    LOG_SAMPLE_SUCCESS = max(int(sample_success), 1)
+
+def teardown_logging():
+    """Remove the structured log handler, flushing queued records first."""
+    global _log_handler, _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    if _log_handler is not None:
+        logging.getLogger().removeHandler(_log_handler)
+        _log_handler = None
+
+def _restart_log_listener():
+    """Give a forked child (prefork pool process) its own queue and listener thread."""
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_handler.queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_log_handler.queue, *_log_listener.handlers, respect_handler_level=True)
+    _log_listener.start()
+
+os.register_at_fork(after_in_child=_restart_log_listener)
+atexit.register(teardown_logging)
+
+def should_log_task() -> bool:
+    """Sampling decision for a task's info lines (1 in LOG_SAMPLE_SUCCESS tasks)."""
+    return LOG_SAMPLE_SUCCESS == 1 or next(_task_log_counter) % LOG_SAMPLE_SUCCESS == 0
+
+@signals.setup_logging.connect
+def keep_structured_logging(loglevel=None, **kwargs):
+    """Stop the worker from replacing the structured log handler with its own."""
+    if loglevel:
+        logging.getLogger().setLevel(loglevel)
+
+config = load_config()
 
 # Set up logging
-setup_logging()
+logging_config = config.get('logging') or {}
+setup_logging(
+    mode=logging_config.get('mode', 'async'),
+    level=logging_config.get('level', 'INFO'),
+    sample_success=logging_config.get('sample_success', 1),
+)
 
 # Celery configuration
 BROKER_URL = os.getenv('BROKER_URL', 'pyamqp://guest@localhost//')
@@ -44,8 +212,6 @@ app.conf.update(
     broker_url=BROKER_URL,
     result_backend='rpc://',
     task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
     timezone='UTC',
     enable_utc=True,
     
@@ -59,7 +225,7 @@ app.conf.update(
     task_default_retry_delay=60,
     task_max_retries=3,
     
-    # Worker configuration
+    # Worker configuration (defaults; the active worker_tuning profile overrides them)
     worker_prefetch_multiplier=1,
     task_acks_late=True,
     worker_max_tasks_per_child=1000,
@@ -67,11 +233,40 @@ app.conf.update(
     # Monitoring
     task_track_started=True,
     task_send_sent_event=True,
+    worker_send_task_events=(config.get('monitoring') or {}).get('task_events', False),
+    
+    # Per-route message serialization from test-config.yml
+    **serialization_settings(config),
 )
+app.conf.update(tuning_settings(config))
+
+if (config.get('metrics') or {}).get('enabled'):
+    import metrics
+    metrics.install(config['metrics'])
 
 # Get task logger for structured logging
 logger = get_task_logger(__name__)
 
+@signals.before_task_publish.connect
+def stamp_publish_time(headers=None, **kwargs):
+    """Stamp every task message with its publish time (wall clock)."""
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+@signals.task_received.connect
+def stamp_receive_time(request=None, **kwargs):
+    """Record when the worker received the message; travels with the request to the pool."""
+    request.request_dict['received_at'] = time.time()
+
+def task_timeline(request, started_at: float) -> dict:
+    """Wall-clock publish/receive/start/finish times, returned with the task's result."""
+    return {
+        'published_at': getattr(request, 'published_at', None),
+        'received_at': getattr(request, 'received_at', None),
+        'started_at': started_at,
+        'finished_at': time.time(),
+    }
+
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60})
 def task_a(self):
     """
@@ -81,16 +276,18 @@ def task_a(self):
     start_time = time.time()
     worker_id = os.getenv('WORKER_ID', 'worker-a')
     
-    logger.info(
-        "Starting task_a execution",
-        extra={
-            'task_id': self.request.id,
-            'task_name': 'task_a',
-            'worker_id': worker_id,
-            'queue': 'queue_a',
-            'retry_count': self.request.retries
-        }
-    )
+    log_task = should_log_task()
+    if log_task:
+        logger.info(
+            "Starting task_a execution",
+            extra={
+                'task_id': self.request.id,
+                'task_name': 'task_a',
+                'worker_id': worker_id,
+                'queue': 'queue_a',
+                'retry_count': self.request.retries
+            }
+        )
     
     # Simulate some work
     time.sleep(0.5)
@@ -102,17 +299,19 @@ def task_a(self):
         'worker_id': worker_id,
         'execution_time': round(execution_time, 3),
         'timestamp': datetime.now(timezone.utc).isoformat(),
-        'queue': 'queue_a'
+        'queue': 'queue_a',
+        'timeline': task_timeline(self.request, start_time)
     }
     
-    logger.info(
-        "Completed task_a execution",
-        extra={
-            'task_id': self.request.id,
-            'execution_time': execution_time,
-            'result': result
-        }
-    )
+    if log_task:
+        logger.info(
+            "Completed task_a execution",
+            extra={
+                'task_id': self.request.id,
+                'task_name': 'task_a',
+                'execution_time': execution_time
+            }
+        )
     
     return result
 
@@ -125,16 +324,18 @@ def task_b(self):
     start_time = time.time()
     worker_id = os.getenv('WORKER_ID', 'worker-b')
     
-    logger.info(
-        "Starting task_b execution",
-        extra={
-            'task_id': self.request.id,
-            'task_name': 'task_b',
-            'worker_id': worker_id,
-            'queue': 'queue_b',
-            'retry_count': self.request.retries
-        }
-    )
+    log_task = should_log_task()
+    if log_task:
+        logger.info(
+            "Starting task_b execution",
+            extra={
+                'task_id': self.request.id,
+                'task_name': 'task_b',
+                'worker_id': worker_id,
+                'queue': 'queue_b',
+                'retry_count': self.request.retries
+            }
+        )
     
     # Simulate some work
     time.sleep(0.7)
@@ -146,19 +347,46 @@ def task_b(self):
         'worker_id': worker_id,
         'execution_time': round(execution_time, 3),
         'timestamp': datetime.now(timezone.utc).isoformat(),
-        'queue': 'queue_b'
+        'queue': 'queue_b',
+        'timeline': task_timeline(self.request, start_time)
     }
     
-    logger.info(
-        "Completed task_b execution",
+    if log_task:
+        logger.info(
+            "Completed task_b execution",
+            extra={
+                'task_id': self.request.id,
+                'task_name': 'task_b',
+                'execution_time': execution_time
+            }
+        )
+    
+    return result
+
+@signals.task_failure.connect
+def log_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    """Failures are always logged, regardless of sampling."""
+    logger.error(
+        f"Task {sender.name} failed",
         extra={
-            'task_id': self.request.id,
-            'execution_time': execution_time,
-            'result': result
+            'task_id': task_id,
+            'task_name': sender.name,
+            'error': f"{type(exception).__name__}: {exception}"
+        }
+    )
+
+@signals.task_retry.connect
+def log_task_retry(sender=None, request=None, reason=None, **kwargs):
+    """Retries are always logged, regardless of sampling."""
+    logger.warning(
+        f"Task {sender.name} retrying",
+        extra={
+            'task_id': request.id,
+            'task_name': sender.name,
+            'retry_count': request.retries,
+            'reason': str(reason)
         }
     )
-    
-    return result
 
 if __name__ == '__main__':
     app.start()
@@ -0,0 +1,84 @@
+"""
+Completion-order result collection.
+
+Instead of blocking on each AsyncResult.get() in turn, every in-flight result
+registers a callback on the rpc backend's single reply-queue consumer. One
+drain loop over that connection then hands back results in the order the
+workers finished them, no matter how many are outstanding.
+"""
+import socket
+import time
+from collections import deque, namedtuple
+
+# status is 'success', 'error' or 'timeout'; label is whatever the caller passed to add()
+Completed = namedtuple('Completed', 'task_id label status result error sent_at received_at')
+
+
+class ResultCollector:
+    """Collect results from many in-flight tasks in completion order."""
+
+    def __init__(self, app):
+        self.app = app
+        self._pending = {}  # task_id -> (label, sent_at)
+        self._ready = deque()
+
+    def __len__(self):
+        """Number of tasks still in flight."""
+        return len(self._pending)
+
+    def add(self, async_result, label=None, sent_at=None):
+        """Start tracking a sent task. The AsyncResult itself is not retained."""
+        self._pending[async_result.id] = (label, sent_at if sent_at is not None else time.perf_counter())
+        async_result.then(self._on_ready)
+        return async_result
+
+    def _on_ready(self, async_result):
+        received_at = time.perf_counter()
+        entry = self._pending.pop(async_result.id, None)
+        if entry is None:
+            return  # already reported as timed out
+        label, sent_at = entry
+        if async_result.successful():
+            completed = Completed(async_result.id, label, 'success', async_result.result, None, sent_at, received_at)
+        else:
+            completed = Completed(async_result.id, label, 'error', None, str(async_result.result), sent_at, received_at)
+        self._ready.append(completed)
+
+    def _drain_events(self, timeout: float):
+        try:
+            self.app.backend.result_consumer.drain_events(timeout=max(timeout, 0.0))
+        except socket.timeout:
+            pass
+
+    def drain(self, timeout: float = 0.0):
+        """Wait up to `timeout` seconds for replies and return every result that completed."""
+        if not self._ready and self._pending:
+            self._drain_events(timeout)
+        completed = list(self._ready)
+        self._ready.clear()
+        return completed
+
+    def iter_completed(self, timeout: float = None):
+        """
+        Yield results in completion order until nothing is left in flight.
+
+        If `timeout` seconds pass first, the remaining tasks are yielded with
+        status 'timeout' and any late replies for them are ignored.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self._ready or self._pending:
+            while self._ready:
+                yield self._ready.popleft()
+            if not self._pending:
+                break
+            wait = 1.0
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    now = time.perf_counter()
+                    for task_id, (label, sent_at) in list(self._pending.items()):
+                        del self._pending[task_id]
+                        yield Completed(task_id, label, 'timeout', None, f'No result after {timeout}s', sent_at, now)
+                    break
+                wait = min(wait, remaining)
+            self._drain_events(wait)
@@ -0,0 +1,60 @@
+"""
+Compiled config cache.
+
+Parsing test-config.yml with PyYAML (and importing PyYAML at all) is one of the
+larger costs of importing celery_app, which every dispatcher run and worker
+start pays. load_yaml() keeps the parsed config in a marshal file keyed by the
+YAML file's path, mtime and size: while the file is unchanged the config is
+read back without importing yaml, and any edit to the file is picked up on the
+next start.
+"""
+import hashlib
+import marshal
+import os
+
+CACHE_DIR = os.getenv('CONFIG_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'distributed-test-system'))
+
+
+def cache_path(path: str) -> str:
+    """Cache file for a config file (one per absolute path)."""
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f'{os.path.basename(path)}.{key}.marshal')
+
+
+def load_yaml(path: str):
+    """Parsed contents of a YAML file, from the cache while the file is unchanged."""
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = cache_path(path)
+    try:
+        with open(cached, 'rb') as f:
+            cached_stamp, data = marshal.load(f)
+        if tuple(cached_stamp) == stamp:
+            return data
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    import yaml
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f)
+    save(cached, stamp, data)
+    return data
+
+
+def save(cached: str, stamp: tuple, data):
+    """Write the cache atomically; caching is best-effort, so failures are ignored."""
+    try:
+        payload = marshal.dumps((stamp, data))
+    except ValueError:
+        return  # e.g. YAML timestamps: not marshallable, parse every time
+    temp_path = f'{cached}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, cached)
+    except OSError:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
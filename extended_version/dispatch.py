@@ -5,38 +5,73 @@ Distributed Task Dispatcher
 This script sends tasks concurrently to different Celery workers and displays
 results with enhanced visualization and structured logging.
 """
+from __future__ import annotations
+
 import os
 import sys
 import time
 import json
+import argparse
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, List, Tuple
 
-try:
-    from colorama import Fore, Back, Style, init
-    from celery import Celery
-    init(autoreset=True)  # Initialize colorama for cross-platform colored output
-except ImportError as e:
-    print(f"Error: Missing required dependency: {e}")
-    print("Please install requirements: pip install -r requirements.txt")
-    sys.exit(1)
+from timeline import PhaseHistograms, wall_clock
+from results_store import RunWriter
+from worker_registry import WorkerRegistry
+
+# Colorama, asyncio, Celery and the app are imported by load_dependencies() once
+# the command line is parsed, so --help and --workers start without them
+Fore = asyncio = None
+app = task_a = task_b = None
+AsyncResultConsumer = ResultCollector = dispatch_many = pooled_producer = None
 
-# Import our Celery app
-try:
-    from celery_app import app, task_a, task_b
-except ImportError:
-    print("Error: Could not import celery_app. Make sure celery_app.py is in the current directory.")
-    sys.exit(1)
+def load_dependencies(celery_app: bool = True):
+    """Import the output and (unless only the registry is needed) the Celery dependencies."""
+    global Fore, asyncio, app, task_a, task_b, AsyncResultConsumer, ResultCollector, dispatch_many, pooled_producer
+    try:
+        from colorama import Fore, init
+        init(autoreset=True)  # Initialize colorama for cross-platform colored output
+        if celery_app:
+            import celery  # noqa: F401
+    except ImportError as e:
+        print(f"Error: Missing required dependency: {e}")
+        print("Please install requirements: pip install -r requirements.txt")
+        sys.exit(1)
+    
+    if not celery_app:
+        return
+    import asyncio
+    # Import our Celery app
+    try:
+        from celery_app import app, task_a, task_b
+        from async_collector import AsyncResultConsumer
+        from collector import ResultCollector
+        from publisher import dispatch_many, pooled_producer
+    except ImportError:
+        print("Error: Could not import celery_app. Make sure celery_app.py is in the current directory.")
+        sys.exit(1)
+
+# Above this many tasks only failures are listed individually
+MAX_DETAILED_RESULTS = 20
 
 class TaskDispatcher:
     """Enhanced task dispatcher with visualization and monitoring."""
     
-    def __init__(self):
+    def __init__(self, tasks_per_type: int = 1, quiet: bool = False, timeout: float = 30,
+                 inspect: bool = False, save_json: bool = False):
         self.app = app
         self.results = []
         self.start_time = None
         self.total_time = None
+        self.run_started = None
+        self.time_to_first_publish = None
+        self.inspect = inspect
+        self.save_json = save_json
+        self.writer = None  # RunWriter streaming this run's results to the results store
+        self.registry = WorkerRegistry()
+        self.tasks_per_type = tasks_per_type
+        self.quiet = quiet
+        self.timeout = timeout
         
     def print_header(self):
         """Print a styled header for the dispatcher."""
@@ -57,40 +92,79 @@ class TaskDispatcher:
             'RETRY': Fore.MAGENTA
         }
         
+        if self.quiet and status != 'FAILURE':
+            return
+        
         color = status_colors.get(status, Fore.WHITE)
         timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
         print(f"{Fore.WHITE}[{timestamp}] {color}{status:<8} {Fore.CYAN}{task_name:<10} {details}")
     
-    def execute_task(self, task_func, task_name: str) -> Tuple[str, Dict[Any, Any]]:
-        """Execute a single task and return results."""
-        try:
-            self.print_task_status(task_name, 'SENT', 'Dispatching task...')
-            
-            # Send task asynchronously
-            async_result = task_func.delay()
-            task_id = async_result.id
-            
-            self.print_task_status(task_name, 'PENDING', f'Task ID: {task_id}')
-            
-            # Wait for result with timeout
-            result = async_result.get(timeout=30)
-            
+    def task_label(self, task_name: str, index: int) -> str:
+        """Name used for a task in status lines and results."""
+        return task_name if self.tasks_per_type == 1 else f'{task_name}#{index}'
+    
+    def mark_published(self):
+        """Record the time from run() to the first task publish (once)."""
+        if self.time_to_first_publish is None and self.run_started is not None:
+            self.time_to_first_publish = time.perf_counter() - self.run_started
+    
+    def send_task(self, task_func, task_name: str, collector: ResultCollector):
+        """Send a task over a pooled producer and register it with the result collector."""
+        sent = 0
+        
+        def on_sent(async_result):
+            nonlocal sent
+            self.mark_published()
+            label = self.task_label(task_name, sent)
+            sent += 1
+            collector.add(async_result, label=label)
+            self.print_task_status(label, 'PENDING', f'Task ID: {async_result.id}')
+        
+        self.print_task_status(task_name, 'SENT', 'Dispatching task...')
+        
+        # Send task asynchronously
+        dispatch_many(task_func, ((),) * self.tasks_per_type, on_sent=on_sent)
+    
+    def build_result(self, task_name: str, task_id: str, status: str, result=None, error: str = None,
+                     returned_at: float = None) -> Dict[str, Any]:
+        """Print the final status of a task, append it to the results store and return its result entry."""
+        if status == 'success':
             self.print_task_status(task_name, 'SUCCESS', f'Completed in {result.get("execution_time", "N/A")}s')
-            
-            return task_name, {
+            entry = {
                 'status': 'success',
                 'result': result,
                 'task_id': task_id,
-                'async_result': async_result
+                'returned_at': returned_at or time.time()
             }
-            
-        except Exception as e:
-            self.print_task_status(task_name, 'FAILURE', f'Error: {str(e)}')
-            return task_name, {
+        else:
+            self.print_task_status(task_name, 'FAILURE', f'Error: {error}')
+            entry = {
                 'status': 'error',
-                'error': str(e),
-                'task_id': getattr(async_result, 'id', 'unknown') if 'async_result' in locals() else 'unknown'
+                'error': error,
+                'task_id': task_id,
+                'returned_at': returned_at or time.time()
             }
+        if self.writer is not None:
+            self.writer.append(task_name, entry)
+        return entry
+    
+    def collect_results(self, collector: ResultCollector) -> Dict[str, Dict]:
+        """Collect results in the order tasks finish over a single reply consumer."""
+        results = {}
+        for completed in collector.iter_completed(timeout=self.timeout):
+            results[completed.label] = self.build_result(
+                completed.label, completed.task_id, completed.status, completed.result, completed.error,
+                returned_at=wall_clock(completed.received_at)
+            )
+        return results
+    
+    def dispatch(self, tasks: List[Tuple[Any, str]]) -> Dict[str, Dict]:
+        """Send every task up front, then drain results as they complete."""
+        collector = ResultCollector(self.app)
+        for task_func, task_name in tasks:
+            self.send_task(task_func, task_name, collector)
+        
+        return self.collect_results(collector)
     
     def display_results(self, results: Dict[str, Dict]):
         """Display formatted results with visualization."""
@@ -103,6 +177,8 @@ class TaskDispatcher:
         failed_tasks = len(results) - successful_tasks
         
         print(f"{Fore.WHITE}Total Execution Time: {Fore.GREEN}{self.total_time:.3f}s")
+        if self.time_to_first_publish is not None:
+            print(f"{Fore.WHITE}Time to First Publish: {Fore.GREEN}{self.time_to_first_publish * 1000:.1f}ms")
         print(f"{Fore.WHITE}Successful Tasks: {Fore.GREEN}{successful_tasks}")
         print(f"{Fore.WHITE}Failed Tasks: {Fore.RED if failed_tasks > 0 else Fore.GREEN}{failed_tasks}")
         
@@ -110,7 +186,13 @@ class TaskDispatcher:
         print(f"{Fore.YELLOW}DETAILED RESULTS")
         print(f"{Fore.YELLOW}{'─'*60}")
         
+        detailed = len(results) <= MAX_DETAILED_RESULTS
+        if not detailed:
+            print(f"{Fore.WHITE}Showing failures only ({len(results)} tasks; full results are in the results store)")
+        
         for task_name, task_result in results.items():
+            if task_result['status'] == 'success' and not detailed:
+                continue
             if task_result['status'] == 'success':
                 result_data = task_result['result']
                 print(f"\n{Fore.GREEN}✅ {task_name.upper()}")
@@ -144,31 +226,57 @@ class TaskDispatcher:
                 print(f"{Fore.WHITE}Average Task Time: {Fore.GREEN}{avg_time:.3f}s")
                 print(f"{Fore.WHITE}Fastest Task: {Fore.GREEN}{min_time:.3f}s")
                 print(f"{Fore.WHITE}Slowest Task: {Fore.YELLOW}{max_time:.3f}s")
+            
+            # Where the time went: publish -> receive -> start -> finish -> result, per queue
+            phases = PhaseHistograms()
+            for r in results.values():
+                if r['status'] == 'success':
+                    phases.record(r['result'].get('queue', 'N/A'), r['result'], r.get('returned_at'))
+            if phases.histograms:
+                print(f"\n{Fore.YELLOW}{'─'*60}")
+                print(f"{Fore.YELLOW}LATENCY BREAKDOWN")
+                print(f"{Fore.YELLOW}{'─'*60}")
+                phases.print_table("Per-phase latency (queue: publish->receive, reserved: receive->start,"
+                                   " execute, result: finish->dispatcher)", indent="")
         
         print(f"\n{Fore.CYAN}{'='*60}")
     
     def check_broker_connection(self):
-        """Check if the broker is accessible."""
+        """Check if the broker is accessible and show the known workers."""
         try:
-            # Try to get broker info
-            inspect = self.app.control.inspect()
-            stats = inspect.stats()
-            if stats:
-                print(f"{Fore.GREEN}✅ Broker connection successful")
-                print(f"{Fore.WHITE}Active workers: {len(stats)}")
-                for worker, worker_stats in stats.items():
-                    print(f"   {Fore.CYAN}• {worker}")
-                return True
-            else:
-                print(f"{Fore.YELLOW}⚠️  No active workers found")
-                return True  # Broker is accessible but no workers
+            # Open a pooled broker connection: fails fast if the broker is down and
+            # leaves the connection in the pool for the first publish
+            with self.app.pool.acquire(block=True) as connection:
+                connection.ensure_connection(max_retries=1)
+            print(f"{Fore.GREEN}✅ Broker connection successful")
         except Exception as e:
             print(f"{Fore.RED}❌ Broker connection failed: {e}")
             print(f"{Fore.YELLOW}💡 Make sure RabbitMQ is running and workers are started")
             return False
+        
+        # Worker discovery is a broadcast that waits out its reply timeout, so it
+        # only runs on --inspect; otherwise the cached registry is shown
+        if self.inspect:
+            self.registry.refresh(self.app)
+        self.print_workers()
+        return True
+    
+    def print_workers(self):
+        """Show which workers serve which queues, from the worker registry."""
+        if self.registry.age is None:
+            print(f"{Fore.YELLOW}💡 No worker registry yet; run with --inspect to discover workers")
+            return
+        stale = '' if self.registry.is_fresh() else f' {Fore.YELLOW}(stale; refresh with --inspect)'
+        print(f"{Fore.WHITE}Known workers: {len(self.registry.workers)}, "
+              f"updated {self.registry.age:.0f}s ago{stale}")
+        if not self.registry.workers:
+            print(f"{Fore.YELLOW}⚠️  No active workers found")
+        for queue, workers in sorted(self.registry.queues().items()):
+            print(f"   {Fore.CYAN}• {queue}: {Fore.WHITE}{', '.join(workers)}")
     
     def run(self):
         """Main execution method."""
+        self.run_started = time.perf_counter()
         self.print_header()
         
         # Check broker connection
@@ -187,28 +295,25 @@ class TaskDispatcher:
             (task_b, 'task_b')
         ]
         
-        results = {}
-        
-        # Execute tasks concurrently using ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
-            # Submit all tasks
-            future_to_task = {
-                executor.submit(self.execute_task, task_func, task_name): task_name
-                for task_func, task_name in tasks
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_task):
-                task_name, result = future.result()
-                results[task_name] = result
+        # Stream results to the append-only results store as they arrive
+        self.writer = RunWriter(metadata={
+            'broker_url': self.app.conf.broker_url,
+            'dispatcher': type(self).__name__,
+            'tasks_per_type': self.tasks_per_type,
+        })
+        try:
+            results = self.dispatch(tasks)
+        finally:
+            self.writer.close()
         
         self.total_time = time.time() - self.start_time
         
         # Display results
         self.display_results(results)
         
-        # Save results to JSON file for further analysis
-        self.save_results_to_file(results)
+        print(f"{Fore.BLUE}📦 Results stored as run {self.writer.run_id} (python analyze_results.py summary {self.writer.run_id})")
+        if self.save_json:
+            self.save_results_to_file(results)
         
         print(f"{Fore.GREEN}🎉 Dispatch completed successfully!\n")
     
@@ -217,6 +322,7 @@ class TaskDispatcher:
         output_data = {
             'timestamp': datetime.now().isoformat(),
             'total_execution_time': self.total_time,
+            'time_to_first_publish': self.time_to_first_publish,
             'broker_url': self.app.conf.broker_url,
             'results': results
         }
@@ -234,9 +340,88 @@ class TaskDispatcher:
         except Exception as e:
             print(f"{Fore.YELLOW}⚠️  Could not save results to file: {e}")
 
+class AsyncTaskDispatcher(TaskDispatcher):
+    """
+    asyncio dispatcher for large numbers of concurrent tasks.
+    
+    Results are awaited as futures fed by a single consumer on the rpc reply
+    queue, so thousands of tasks can be in flight with a constant thread count.
+    """
+    
+    def __init__(self, concurrency: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.concurrency = concurrency
+    
+    async def run_task(self, task_func, task_label: str, producer, consumer: AsyncResultConsumer,
+                       slots: asyncio.Semaphore) -> Tuple[str, Dict[str, Any]]:
+        """Send one task once a concurrency slot is free and await its result."""
+        async with slots:
+            self.print_task_status(task_label, 'SENT', 'Dispatching task...')
+            async_result = task_func.apply_async(producer=producer)
+            self.mark_published()
+            self.print_task_status(task_label, 'PENDING', f'Task ID: {async_result.id}')
+            try:
+                async_result = await asyncio.wait_for(consumer.wait_for(async_result), self.timeout)
+            except asyncio.TimeoutError:
+                return task_label, self.build_result(task_label, async_result.id, 'timeout',
+                                                     error=f'No result after {self.timeout}s')
+            if async_result.successful():
+                return task_label, self.build_result(task_label, async_result.id, 'success', async_result.result)
+            return task_label, self.build_result(task_label, async_result.id, 'error', error=str(async_result.result))
+    
+    async def dispatch_async(self, tasks: List[Tuple[Any, str]]) -> Dict[str, Dict]:
+        consumer = AsyncResultConsumer(self.app)
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            with pooled_producer(self.app) as (producer, _):
+                outcomes = await asyncio.gather(*(
+                    self.run_task(task_func, self.task_label(task_name, index), producer, consumer, slots)
+                    for task_func, task_name in tasks
+                    for index in range(self.tasks_per_type)
+                ))
+        finally:
+            consumer.close()
+        return dict(outcomes)
+    
+    def dispatch(self, tasks: List[Tuple[Any, str]]) -> Dict[str, Dict]:
+        return asyncio.run(self.dispatch_async(tasks))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Dispatch tasks to the distributed test workers')
+    parser.add_argument('--tasks', '-t', type=int, default=1,
+                        help='Number of tasks of each type to send (default: 1)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Use the asyncio dispatcher (one thread regardless of in-flight tasks)')
+    parser.add_argument('--concurrency', '-c', type=int, default=1000,
+                        help='Async mode: maximum tasks in flight at once (default: 1000)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Seconds to wait for each task result (default: 30)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Only print per-task status lines for failures')
+    parser.add_argument('--json', dest='save_json', action='store_true',
+                        help='Also save the run as one dispatch_results_<timestamp>.json file')
+    parser.add_argument('--inspect', action='store_true',
+                        help='Broadcast to the workers and refresh the worker registry before dispatching')
+    parser.add_argument('--workers', action='store_true',
+                        help='Show the cached worker registry (refreshed with --inspect) and exit')
+    return parser.parse_args()
+
 def main():
     """Main entry point."""
-    dispatcher = TaskDispatcher()
+    args = parse_args()
+    options = {'tasks_per_type': args.tasks, 'quiet': args.quiet, 'timeout': args.timeout,
+               'inspect': args.inspect, 'save_json': args.save_json}
+    load_dependencies(celery_app=args.inspect or not args.workers)
+    if args.workers:
+        dispatcher = TaskDispatcher(**options)
+        if args.inspect:
+            dispatcher.registry.refresh(dispatcher.app)
+        dispatcher.print_workers()
+        return
+    if args.use_async:
+        dispatcher = AsyncTaskDispatcher(concurrency=args.concurrency, **options)
+    else:
+        dispatcher = TaskDispatcher(**options)
     try:
         dispatcher.run()
     except KeyboardInterrupt:
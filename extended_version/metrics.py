@@ -0,0 +1,380 @@
+"""
+In-worker task metrics, exported in Prometheus text format.
+
+Each worker process (the main process and every prefork child) writes its
+values to its own memory-mapped file, named by PID and start time so a
+recycled child that reuses a dead one's PID starts a file of its own. The
+hot path is an uncontended in-place float add with no IPC. The main process
+serves /metrics over HTTP and sums the files of all processes, so counters
+survive child recycling: a scrape folds the counters of processes that have
+exited into one aggregate file and removes their files, and drops their
+gauges.
+
+Metrics:
+  celery_task_runtime_seconds  histogram  {task, queue}
+  celery_tasks_total           counter    {task, queue, state=success|failure|retry|...}
+  celery_worker_busy_slots     gauge      tasks executing right now
+  celery_worker_pool_size      gauge      pool concurrency
+  celery_worker_pool_utilisation gauge    busy_slots / pool_size
+
+Hooked in through task_prerun / task_postrun / task_retry; install() is
+called by celery_app when `metrics.enabled` is set in test-config.yml.
+"""
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery import signals
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_DIR_ENV = 'CELERY_METRICS_DIR'
+
+# File layout: fixed-size entries of an 8-byte float value followed by a NUL-padded key
+ENTRY_SIZE = 128
+KEY_SIZE = ENTRY_SIZE - 8
+VALUE_STRIDE = ENTRY_SIZE // 8
+
+AGGREGATE_FILE = 'exited.db'  # counters of processes that have exited, folded in by collect()
+
+GAUGES = {'celery_worker_busy_slots', 'celery_worker_pool_size'}
+HELP = {
+    'celery_task_runtime_seconds': ('histogram', 'Task runtime in seconds'),
+    'celery_tasks_total': ('counter', 'Finished task executions by final state'),
+    'celery_worker_busy_slots': ('gauge', 'Tasks executing right now'),
+    'celery_worker_pool_size': ('gauge', 'Worker pool concurrency'),
+    'celery_worker_pool_utilisation': ('gauge', 'Busy slots divided by pool size'),
+}
+
+
+class MetricsFile:
+    """One process's metric values in a memory-mapped file (single writer process)."""
+
+    def __init__(self, path: str, size: int = 256 * 1024):
+        # A new file every time: an old one's counters are still summed by collect()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.values = memoryview(self.mmap).cast('d')
+        self.capacity = size // ENTRY_SIZE
+        self.slots = {}  # key -> value index
+        self.lock = threading.Lock()  # threads pool: several writers in one process
+        self.dropped = 0
+
+    def _slot(self, key: str):
+        index = self.slots.get(key)
+        if index is None:
+            if len(self.slots) >= self.capacity:
+                self.dropped += 1
+                return None
+            encoded = key.encode()[:KEY_SIZE]
+            offset = len(self.slots) * ENTRY_SIZE
+            # Zero the value and the whole key field before the key is written
+            self.mmap[offset:offset + ENTRY_SIZE] = bytes(ENTRY_SIZE)
+            self.mmap[offset + 8:offset + 8 + len(encoded)] = encoded
+            index = self.slots[key] = len(self.slots) * VALUE_STRIDE
+        return index
+
+    def add(self, key: str, amount: float = 1.0):
+        with self.lock:
+            index = self._slot(key)
+            if index is not None:
+                self.values[index] += amount
+
+    def set(self, key: str, value: float):
+        with self.lock:
+            index = self._slot(key)
+            if index is not None:
+                self.values[index] = value
+
+
+def read_metrics_file(path: str):
+    """Yield (key, value) for every entry written to a metrics file."""
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return  # an empty file cannot be mapped
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for offset in range(0, len(data), ENTRY_SIZE):
+            key = data[offset + 8:offset + ENTRY_SIZE].rstrip(b'\0')
+            if not key:
+                break
+            yield key.decode(errors='replace'), struct.unpack_from('d', data, offset)[0]
+    finally:
+        data.close()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _series(name: str, labels: dict) -> str:
+    """Key for one series: name and labels, tab-separated (tabs can't appear in task/queue names)."""
+    return '\t'.join([name] + [f'{key}={value}' for key, value in labels.items()])
+
+
+def _render_series(key: str):
+    name, *labels = key.split('\t')
+    if not labels:
+        return name
+    rendered = ','.join('{}="{}"'.format(*label.split('=', 1)) for label in labels)
+    return f'{name}{{{rendered}}}'
+
+
+class TaskMetrics:
+    """Signal handlers and the per-process metrics file."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.file = None
+        self.pid = None
+        self.started = {}  # task_id -> perf_counter at prerun
+        self.keys = {}  # (task, queue) -> value indices in this process's file
+        self.busy = None
+
+    def _file(self):
+        if self.pid != os.getpid():
+            # First use in this process (or a forked child): open its own file. The
+            # start time keeps a recycled child that reuses a dead one's PID off its file.
+            directory = os.getenv(METRICS_DIR_ENV)
+            self.pid = os.getpid()
+            filename = f'{self.pid}-{time.time_ns()}.db'
+            self.file = MetricsFile(os.path.join(directory, filename)) if directory else None
+            self.keys = {}
+            self.busy = self.file._slot('celery_worker_busy_slots') if self.file else None
+        return self.file
+
+    def _task_slots(self, task_name: str, queue: str):
+        """Value indices for one (task, queue), resolved once per process."""
+        slots = self.keys.get((task_name, queue))
+        if slots is None:
+            labels = {'task': task_name, 'queue': queue}
+            slot = self.file._slot
+            slots = self.keys[(task_name, queue)] = {
+                'buckets': [slot(_series('celery_task_runtime_seconds_bucket', {**labels, 'le': le}))
+                            for le in [str(b) for b in self.buckets] + ['+Inf']],
+                'sum': slot(_series('celery_task_runtime_seconds_sum', labels)),
+                'count': slot(_series('celery_task_runtime_seconds_count', labels)),
+                'states': {},
+                'labels': labels,
+            }
+            if None in slots['buckets'] or None in (slots['sum'], slots['count']):
+                slots = self.keys[(task_name, queue)] = None  # file full: this series is dropped
+        return slots
+
+    def _state_slot(self, slots: dict, state: str):
+        index = slots['states'].get(state)
+        if index is None:
+            index = slots['states'][state] = self.file._slot(
+                _series('celery_tasks_total', {**slots['labels'], 'state': state}))
+        return index
+
+    @staticmethod
+    def _queue(request) -> str:
+        delivery_info = getattr(request, 'delivery_info', None) or {}
+        return delivery_info.get('routing_key') or 'unknown'
+
+    def on_prerun(self, task_id=None, **kwargs):
+        metrics_file = self._file()
+        if metrics_file is None:
+            return
+        self.started[task_id] = time.perf_counter()
+        with metrics_file.lock:
+            metrics_file.values[self.busy] += 1
+
+    def on_postrun(self, task_id=None, task=None, state=None, **kwargs):
+        started = self.started.pop(task_id, None)
+        metrics_file = self.file
+        if started is None or metrics_file is None:
+            return
+        runtime = time.perf_counter() - started
+        with metrics_file.lock:
+            values = metrics_file.values
+            values[self.busy] -= 1
+            slots = self._task_slots(task.name, self._queue(task.request))
+            if slots is None:
+                return
+            # Retries are counted by on_retry
+            state_slot = self._state_slot(slots, (state or 'unknown').lower()) if state != 'RETRY' else None
+            values[slots['buckets'][bisect_left(self.buckets, runtime)]] += 1
+            values[slots['sum']] += runtime
+            values[slots['count']] += 1
+            if state_slot is not None:
+                values[state_slot] += 1
+
+    def on_retry(self, sender=None, request=None, **kwargs):
+        metrics_file = self._file()
+        if metrics_file is None:
+            return
+        with metrics_file.lock:
+            slots = self._task_slots(sender.name, self._queue(request))
+            slot = self._state_slot(slots, 'retry') if slots else None
+            if slot is not None:
+                metrics_file.values[slot] += 1
+
+
+def write_metrics_file(path: str, totals: dict):
+    """Write {key: value} in the metrics file layout, atomically (temp file + rename)."""
+    data = bytearray(len(totals) * ENTRY_SIZE)
+    for index, (key, value) in enumerate(totals.items()):
+        offset = index * ENTRY_SIZE
+        struct.pack_into('d', data, offset, value)
+        encoded = key.encode()[:KEY_SIZE]
+        data[offset + 8:offset + 8 + len(encoded)] = encoded
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+_collect_lock = threading.Lock()  # scrapes run on ThreadingHTTPServer threads
+
+
+def collect(directory: str) -> dict:
+    """
+    Sum every process's values: {series key: value}.
+
+    The counters and histogram values of processes that have exited are
+    folded into AGGREGATE_FILE and their files removed, so recycled prefork
+    children do not leave a file behind per recycle for every scrape to
+    re-read. Their gauges are dropped.
+    """
+    with _collect_lock:
+        latest = {}  # pid -> start of its newest file, the only one a live process can be writing
+        filenames = [filename for filename in os.listdir(directory)
+                     if filename.endswith('.db') and filename != AGGREGATE_FILE]
+        for filename in filenames:
+            pid, start_ns = map(int, filename[:-3].split('-'))  # {pid}-{start_ns}.db
+            latest[pid] = max(latest.get(pid, 0), start_ns)
+
+        aggregate_path = os.path.join(directory, AGGREGATE_FILE)
+        aggregate = dict(read_metrics_file(aggregate_path)) if os.path.exists(aggregate_path) else {}
+        totals = dict(aggregate)
+        dead = []
+        for filename in filenames:
+            pid, start_ns = map(int, filename[:-3].split('-'))
+            alive = start_ns == latest[pid] and _pid_alive(pid)
+            if not alive:
+                dead.append(filename)
+            for key, value in read_metrics_file(os.path.join(directory, filename)):
+                if key.split('\t', 1)[0] in GAUGES:
+                    if not alive:
+                        continue
+                elif not alive:
+                    aggregate[key] = aggregate.get(key, 0.0) + value
+                totals[key] = totals.get(key, 0.0) + value
+        if dead:
+            write_metrics_file(aggregate_path, aggregate)
+            for filename in dead:
+                os.unlink(os.path.join(directory, filename))
+        return totals
+
+
+def render(totals: dict) -> str:
+    """Prometheus text exposition of collected totals (histogram buckets made cumulative)."""
+    busy = totals.get('celery_worker_busy_slots', 0.0)
+    pool_size = totals.get('celery_worker_pool_size', 0.0)
+    totals = {**totals, 'celery_worker_pool_utilisation': busy / pool_size if pool_size else 0.0}
+
+    families = {}
+    for key, value in totals.items():
+        name = key.split('\t', 1)[0]
+        family = name.rsplit('_', 1)[0] if name.startswith('celery_task_runtime_seconds_') else name
+        families.setdefault(family, []).append((key, value))
+
+    lines = []
+    for family, samples in sorted(families.items()):
+        kind, description = HELP.get(family, ('untyped', family))
+        lines += [f'# HELP {family} {description}', f'# TYPE {family} {kind}']
+        if kind == 'histogram':
+            cumulative = {}
+            for key, value in sorted(samples, key=lambda sample: _bucket_order(sample[0])):
+                if key.startswith(family + '_bucket'):
+                    series = key.rsplit('\t', 1)[0]
+                    value = cumulative[series] = cumulative.get(series, 0.0) + value
+                lines.append(f'{_render_series(key)} {value:g}')
+        else:
+            lines += [f'{_render_series(key)} {value:g}' for key, value in sorted(samples)]
+    return '\n'.join(lines) + '\n'
+
+
+def _bucket_order(key: str):
+    series, _, last = key.rpartition('\t')
+    if not last.startswith('le='):
+        return (key, 0.0)
+    le = last[3:]
+    return (series, float('inf') if le == '+Inf' else float(le))
+
+
+def serve(directory: str, port: int):
+    """Serve /metrics from the main worker process."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render(collect(directory)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install(settings: dict):
+    """Connect the metrics signal handlers (called by celery_app when metrics are enabled)."""
+    metrics = TaskMetrics(settings.get('buckets') or DEFAULT_BUCKETS)
+    base_dir = settings.get('dir', '/tmp/celery-metrics')
+    port = int(os.getenv('METRICS_PORT', settings.get('port', 9808)))
+
+    @signals.worker_init.connect(weak=False)
+    def create_metrics_dir(**kwargs):
+        # One directory per worker, inherited by its pool processes
+        directory = os.path.join(base_dir, str(os.getpid()))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        os.environ[METRICS_DIR_ENV] = directory
+
+    @signals.worker_ready.connect(weak=False)
+    def start_exporter(sender=None, **kwargs):
+        directory = os.environ[METRICS_DIR_ENV]
+        metrics._file().set('celery_worker_pool_size', sender.controller.concurrency)
+        try:
+            serve(directory, port)
+            logger.info(f"Serving metrics on port {port}")
+        except OSError as e:
+            logger.warning(f"Metrics exporter not started on port {port}: {e}")
+
+    @signals.worker_shutdown.connect(weak=False)
+    def remove_metrics_dir(**kwargs):
+        directory = os.environ.get(METRICS_DIR_ENV)
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    signals.task_prerun.connect(metrics.on_prerun, weak=False)
+    signals.task_postrun.connect(metrics.on_postrun, weak=False)
+    signals.task_retry.connect(metrics.on_retry, weak=False)
+    return metrics
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Live task monitor.
+
+Consumes the Celery event stream and keeps rolling-window statistics per queue
+and per worker: sent/started/succeeded/failed rates, tasks in flight and
+runtime percentiles. State is O(1) per in-flight task (its queue and worker)
+and is dropped as soon as the task finishes; everything else is fixed-size
+ring buffers, so memory stays flat however long the monitor runs.
+
+Workers must send task events (`monitoring.task_events` in test-config.yml,
+or `celery worker -E`).
+
+Usage:
+  python monitor.py                    # refreshing table
+  python monitor.py --json             # one JSON snapshot per interval
+  python monitor.py --http 8001        # also serve / (text) and /json
+  python monitor.py --bench 200000     # measure event processing rate offline
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from histogram import LatencyHistogram
+
+COUNTED_EVENTS = ('sent', 'started', 'succeeded', 'failed')
+FINAL_EVENTS = {'task-succeeded', 'task-failed', 'task-rejected', 'task-revoked'}
+UNKNOWN = 'unknown'
+
+
+class RollingCounter:
+    """Event count over the last `window` seconds, in `buckets` ring slots."""
+
+    __slots__ = ('width', 'counts', 'epochs')
+
+    def __init__(self, window: float, buckets: int):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.epochs = [-1] * buckets
+
+    def add(self, now: float, count: int = 1):
+        epoch = int(now / self.width)
+        slot = epoch % len(self.counts)
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+        self.counts[slot] += count
+
+    def rate(self, now: float) -> float:
+        oldest = int(now / self.width) - len(self.counts) + 1
+        total = sum(count for count, epoch in zip(self.counts, self.epochs) if epoch >= oldest)
+        return total / (self.width * len(self.counts))
+
+
+class RollingHistogram:
+    """Runtime histogram over the last `window` seconds, as a ring of coarser histograms."""
+
+    __slots__ = ('width', 'histograms', 'epochs')
+
+    def __init__(self, window: float, buckets: int):
+        self.width = window / buckets
+        self.histograms = [None] * buckets
+        self.epochs = [-1] * buckets
+
+    def record(self, now: float, value_us: int):
+        epoch = int(now / self.width)
+        slot = epoch % len(self.histograms)
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.histograms[slot] = LatencyHistogram(significant_digits=2)
+        self.histograms[slot].record(value_us)
+
+    def merged(self, now: float) -> LatencyHistogram:
+        oldest = int(now / self.width) - len(self.histograms) + 1
+        merged = LatencyHistogram(significant_digits=2)
+        for histogram, epoch in zip(self.histograms, self.epochs):
+            if histogram is not None and epoch >= oldest:
+                merged.merge(histogram)
+        return merged
+
+
+class GroupStats:
+    """Rolling counters, in-flight count and runtimes for one queue or worker."""
+
+    __slots__ = ('counters', 'runtimes', 'in_flight')
+
+    def __init__(self, window: float, buckets: int):
+        self.counters = {name: RollingCounter(window, buckets) for name in COUNTED_EVENTS}
+        self.runtimes = RollingHistogram(window, max(1, buckets // 10))
+        self.in_flight = 0
+
+    def snapshot(self, now: float) -> dict:
+        runtime = self.runtimes.merged(now).summary()
+        return {
+            **{f'{name}_per_sec': round(counter.rate(now), 2) for name, counter in self.counters.items()},
+            'in_flight': self.in_flight,
+            'runtime_p50_ms': runtime['p50_ms'],
+            'runtime_p90_ms': runtime['p90_ms'],
+            'runtime_p99_ms': runtime['p99_ms'],
+            'runtime_count': runtime['count'],
+        }
+
+
+class MonitorState:
+    """
+    Aggregate task events into per-queue and per-worker statistics.
+
+    Per task only [queue, worker, last_seen] is kept, from task-sent until its
+    final event. Entries whose final event never arrives (monitor started mid
+    run, lost events) are evicted after `max_task_age` seconds.
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60, max_task_age: float = 3600.0):
+        self.window = window
+        self.buckets = buckets
+        self.max_task_age = max_task_age
+        self.queues = {}
+        self.workers = {}
+        self.tasks = {}  # task_id -> [queue, worker, last_seen]
+        self.events_processed = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self._next_sweep = time.time() + max_task_age
+
+    def _group(self, groups: dict, key: str) -> GroupStats:
+        stats = groups.get(key)
+        if stats is None:
+            stats = groups[key] = GroupStats(self.window, self.buckets)
+        return stats
+
+    def on_event(self, event: dict, now: float = None):
+        now = now or time.time()
+        kind = event['type']
+        if not kind.startswith('task-'):
+            return
+        task_id = event.get('uuid')
+        with self.lock:
+            self.events_processed += 1
+            entry = self.tasks.get(task_id)
+
+            if kind == 'task-sent':
+                queue = event.get('queue') or event.get('routing_key') or UNKNOWN
+                stats = self._group(self.queues, queue)
+                stats.counters['sent'].add(now)
+                if entry is None:
+                    self.tasks[task_id] = [queue, None, now]
+                    stats.in_flight += 1
+                else:
+                    entry[2] = now  # re-sent on retry: still the same in-flight task
+                return
+
+            if entry is None:
+                # First sight of this task (its task-sent was missed): track it from here
+                entry = self.tasks[task_id] = [UNKNOWN, None, now]
+                self._group(self.queues, UNKNOWN).in_flight += 1
+            queue, worker, _ = entry
+            entry[2] = now
+            hostname = event.get('hostname')
+
+            if kind in ('task-received', 'task-started') and worker is None and hostname:
+                entry[1] = worker = hostname
+                self._group(self.workers, worker).in_flight += 1
+            if kind == 'task-started':
+                self._group(self.queues, queue).counters['started'].add(now)
+                if worker:
+                    self._group(self.workers, worker).counters['started'].add(now)
+            elif kind == 'task-retried':
+                if worker:
+                    self._group(self.workers, worker).in_flight -= 1
+                    entry[1] = None
+            elif kind in FINAL_EVENTS:
+                del self.tasks[task_id]
+                counter = 'succeeded' if kind == 'task-succeeded' else 'failed'
+                groups = [self._group(self.queues, queue)]
+                if worker:
+                    groups.append(self._group(self.workers, worker))
+                runtime = event.get('runtime')
+                for stats in groups:
+                    stats.in_flight -= 1
+                    stats.counters[counter].add(now)
+                    if runtime is not None:
+                        stats.runtimes.record(now, int(runtime * 1e6))
+
+            if now >= self._next_sweep:
+                self._evict_stale(now)
+
+    def _evict_stale(self, now: float):
+        cutoff = now - self.max_task_age
+        for task_id, (queue, worker, last_seen) in list(self.tasks.items()):
+            if last_seen < cutoff:
+                del self.tasks[task_id]
+                self.queues[queue].in_flight -= 1
+                if worker:
+                    self.workers[worker].in_flight -= 1
+                self.evicted += 1
+        self._next_sweep = now + min(self.max_task_age, 60.0)
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self.lock:
+            return {
+                'timestamp': now,
+                'window_s': self.window,
+                'events_processed': self.events_processed,
+                'tracked_tasks': len(self.tasks),
+                'evicted_tasks': self.evicted,
+                'queues': {queue: stats.snapshot(now) for queue, stats in sorted(self.queues.items())},
+                'workers': {worker: stats.snapshot(now) for worker, stats in sorted(self.workers.items())},
+            }
+
+
+def format_snapshot(snapshot: dict) -> str:
+    """Render a snapshot as a plain-text table."""
+    lines = [
+        f"Task monitor - {time.strftime('%H:%M:%S', time.localtime(snapshot['timestamp']))}  "
+        f"(rates over {snapshot['window_s']:g}s, {snapshot['events_processed']} events, "
+        f"{snapshot['tracked_tasks']} tracked tasks)",
+    ]
+    header = (f"  {'':<28} {'sent/s':>8} {'start/s':>8} {'ok/s':>8} {'fail/s':>8} {'in-flight':>9} "
+              f"{'p50':>8} {'p90':>8} {'p99':>8}  (runtime ms)")
+    for title, groups in (('QUEUE', snapshot['queues']), ('WORKER', snapshot['workers'])):
+        lines += ['', f"  {title}", header]
+        for name, s in groups.items():
+            lines.append(f"  {name[:28]:<28} {s['sent_per_sec']:>8.1f} {s['started_per_sec']:>8.1f} "
+                         f"{s['succeeded_per_sec']:>8.1f} {s['failed_per_sec']:>8.1f} {s['in_flight']:>9} "
+                         f"{s['runtime_p50_ms']:>8.1f} {s['runtime_p90_ms']:>8.1f} {s['runtime_p99_ms']:>8.1f}")
+    return '\n'.join(lines)
+
+
+def serve_http(state: MonitorState, port: int):
+    """Serve the latest snapshot as text on / and as JSON on /json."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            snapshot = state.snapshot()
+            if self.path.rstrip('/') == '/json':
+                body, content_type = json.dumps(snapshot).encode(), 'application/json'
+            else:
+                body, content_type = format_snapshot(snapshot).encode(), 'text/plain; charset=utf-8'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def capture_events(app, state: MonitorState):
+    """Consume the event stream forever, reconnecting if the broker goes away."""
+    while True:
+        try:
+            with app.connection_for_read() as connection:
+                receiver = app.events.Receiver(connection, handlers={'*': state.on_event})
+                receiver.capture(limit=None, timeout=None, wakeup=True)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            print(f"Event stream interrupted ({type(e).__name__}: {e}), reconnecting in 2s...", flush=True)
+            time.sleep(2)
+
+
+def run_benchmark(num_tasks: int):
+    """Feed synthetic task lifecycles through MonitorState and report events/sec."""
+    state = MonitorState()
+    queues = ['queue_a', 'queue_b']
+    workers = [f'worker-{n}@host' for n in range(8)]
+    events = []
+    for n in range(num_tasks):
+        task_id = f'task-{n}'
+        worker = workers[n % len(workers)]
+        events += [
+            {'type': 'task-sent', 'uuid': task_id, 'queue': queues[n % 2]},
+            {'type': 'task-received', 'uuid': task_id, 'hostname': worker},
+            {'type': 'task-started', 'uuid': task_id, 'hostname': worker},
+            {'type': 'task-succeeded' if n % 50 else 'task-failed', 'uuid': task_id, 'hostname': worker,
+             'runtime': 0.1 + (n % 7) / 100},
+        ]
+    start = time.perf_counter()
+    for event in events:
+        state.on_event(event)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(events)} events for {num_tasks} tasks in {elapsed:.3f}s: "
+          f"{len(events) / elapsed:,.0f} events/sec ({elapsed / len(events) * 1e6:.2f} us/event)")
+    print(f"Tracked tasks after all finished: {len(state.tasks)}")
+
+    start = time.perf_counter()
+    snapshot = state.snapshot()
+    print(f"Snapshot of {len(snapshot['queues'])} queues and {len(snapshot['workers'])} workers: "
+          f"{(time.perf_counter() - start) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live per-queue and per-worker task statistics from Celery events')
+    parser.add_argument('--interval', '-i', type=float, default=2.0,
+                        help='Seconds between refreshes (default: 2)')
+    parser.add_argument('--window', '-w', type=float, default=60.0,
+                        help='Rolling window for rates and percentiles in seconds (default: 60)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print one JSON snapshot per line instead of a table')
+    parser.add_argument('--http', type=int, metavar='PORT', default=None,
+                        help='Also serve the snapshot on this port (/ text, /json JSON)')
+    parser.add_argument('--bench', type=int, metavar='TASKS', default=None,
+                        help='Measure event processing rate with synthetic events and exit')
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+
+    from celery_app import app
+
+    state = MonitorState(window=args.window)
+    if args.http:
+        serve_http(state, args.http)
+        print(f"Serving on http://localhost:{args.http}/ and /json", flush=True)
+    threading.Thread(target=capture_events, args=(app, state), daemon=True).start()
+
+    try:
+        while True:
+            time.sleep(args.interval)
+            snapshot = state.snapshot()
+            if args.json:
+                print(json.dumps(snapshot), flush=True)
+            else:
+                print('\033[2J\033[H' + format_snapshot(snapshot), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Bulk task publishing.
+
+task.delay() acquires a producer from the pool, re-declares the rpc reply
+queue and publishes, once per message. dispatch_many() holds one pooled
+connection and channel for the whole run, declares the reply queue once, and
+publishes in batches, optionally waiting for publisher confirms once per
+batch instead of once per message.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from kombu.common import maybe_declare
+
+
+def _batches(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Per thread: id of each channel whose reply queue is declared for a run -> nesting depth
+_declared = threading.local()
+_install_lock = threading.Lock()
+
+
+def _skip_declared(on_task_call):
+    """Wrap the backend's per-send reply-queue declare to skip channels in a run of this thread."""
+    def wrapper(producer, task_id):
+        if id(producer.channel) not in getattr(_declared, 'channels', {}):
+            on_task_call(producer, task_id)
+    wrapper.skips_declared = True
+    return wrapper
+
+
+@contextmanager
+def _reply_queue_declared_once(app, channel):
+    """
+    Declare the rpc reply queue once for a run of publishes on `channel`.
+
+    The rpc backend's reply queue is never cached as declared, so every
+    send_task() otherwise performs a synchronous queue.declare round trip.
+    The backend's hook is wrapped once and left in place; it only skips
+    the declare for channels registered here by the calling thread, so
+    other threads and other channels keep declaring, and runs can nest.
+    """
+    backend = app.backend
+    if not hasattr(backend, 'binding'):
+        yield
+        return
+    maybe_declare(backend.binding(channel), retry=True)
+    with _install_lock:
+        if not getattr(backend.on_task_call, 'skips_declared', False):
+            backend.on_task_call = _skip_declared(backend.on_task_call)
+    channels = _declared.__dict__.setdefault('channels', {})
+    channels[id(channel)] = channels.get(id(channel), 0) + 1
+    try:
+        yield
+    finally:
+        channels[id(channel)] -= 1
+        if not channels[id(channel)]:
+            del channels[id(channel)]
+
+
+class PublisherConfirms:
+    """Track publisher confirms for one channel and wait for them per batch."""
+
+    def __init__(self, channel):
+        if not hasattr(channel, 'confirm_select'):
+            raise ValueError(f"Transport channel {type(channel).__name__} does not support publisher confirms")
+        self.channel = channel
+        self.channel.confirm_select()
+        self.channel.events['basic_ack'].add(self._on_ack)
+        self.channel.events['basic_nack'].add(self._on_nack)
+        self.next_tag = 1
+        self.outstanding = set()
+        self.nacked = 0
+
+    def published(self):
+        self.outstanding.add(self.next_tag)
+        self.next_tag += 1
+
+    def _settle(self, delivery_tag, multiple):
+        if multiple:
+            settled = {tag for tag in self.outstanding if tag <= delivery_tag}
+            self.outstanding -= settled
+            return len(settled)
+        if delivery_tag in self.outstanding:
+            self.outstanding.discard(delivery_tag)
+            return 1
+        return 0
+
+    def _on_ack(self, delivery_tag, multiple):
+        self._settle(delivery_tag, multiple)
+
+    def _on_nack(self, delivery_tag, multiple):
+        self.nacked += self._settle(delivery_tag, multiple)
+
+    def wait(self, connection, timeout: float):
+        """Block until every published message is confirmed (or nacked)."""
+        deadline = time.monotonic() + timeout
+        while self.outstanding:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{len(self.outstanding)} publishes not confirmed after {timeout}s")
+            connection.drain_events(timeout=remaining)
+        if self.nacked:
+            raise RuntimeError(f"Broker rejected {self.nacked} published messages")
+
+
+@contextmanager
+def pooled_producer(app, confirm: bool = False):
+    """
+    Hold one pooled connection and producer for a run of apply_async(producer=...) calls.
+
+    Yields (producer, confirms); `confirms` is a PublisherConfirms tracker on a
+    dedicated confirm-mode channel when `confirm=True`, otherwise None.
+    """
+    with app.pool.acquire(block=True) as connection:
+        channel = connection.channel() if confirm else connection.default_channel
+        try:
+            producer = app.amqp.Producer(channel, auto_declare=False)
+            confirms = PublisherConfirms(channel) if confirm else None
+            with _reply_queue_declared_once(app, channel):
+                yield producer, confirms
+        finally:
+            if confirm:
+                channel.close()
+
+
+def dispatch_many(task, arg_iter, batch_size: int = 500, confirm: bool = False,
+                  confirm_timeout: float = 30.0, on_sent=None, **options):
+    """
+    Publish one `task` message per item of `arg_iter` over a single pooled channel.
+
+    Each item is a tuple of positional args (use () for tasks without
+    arguments). Extra keyword arguments are passed to apply_async().
+    If `on_sent` is given it is called with each AsyncResult as it is
+    published and nothing is accumulated; otherwise the AsyncResults are
+    returned in send order.
+
+    With `confirm=True` a dedicated confirm-mode channel is opened on the
+    pooled connection and the broker's confirms are awaited after every
+    batch, so at most `batch_size` messages are ever unconfirmed.
+    """
+    results = [] if on_sent is None else None
+    with pooled_producer(task.app, confirm=confirm) as (producer, confirms):
+        for batch in _batches(arg_iter, batch_size):
+            for args in batch:
+                async_result = task.apply_async(args=args, producer=producer, **options)
+                if confirms:
+                    confirms.published()
+                if on_sent is None:
+                    results.append(async_result)
+                else:
+                    on_sent(async_result)
+            if confirms:
+                confirms.wait(producer.connection, confirm_timeout)
+    return results
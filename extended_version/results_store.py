@@ -0,0 +1,148 @@
+"""
+Append-only results store.
+
+The dispatcher streams every result into the store as it arrives, instead of
+holding a run in memory and dumping it as one JSON file at the end. Each run
+is one binary segment of fixed-size records (`<run_id>.bin`), so a run can be
+loaded as NumPy columns over a memory map without parsing anything. Task,
+worker and queue names are stored as small integer codes; the code tables
+and the run's time range go into `index.jsonl`, one line per run, which is
+what run lookups by ID, task, worker and time range read.
+
+Writing needs only the standard library; reading the columns needs NumPy.
+"""
+import json
+import math
+import os
+import struct
+import time
+import uuid
+from datetime import datetime
+
+DEFAULT_DIR = os.getenv('RESULTS_DIR', 'results')
+INDEX_FILE = 'index.jsonl'
+
+# One record per task result: task, worker and queue codes, status code, then
+# wall-clock timestamps (NaN when unknown) and the task's own execution time
+RECORD = struct.Struct('<HHHBx6d')
+CODE_FIELDS = ('task', 'worker', 'queue')
+TIME_FIELDS = ('published_at', 'received_at', 'started_at', 'finished_at', 'returned_at', 'execution_time')
+STATUSES = ('success', 'error')
+
+
+def record_dtype():
+    """NumPy dtype matching RECORD."""
+    import numpy as np
+    return np.dtype({
+        'names': list(CODE_FIELDS) + ['status'] + list(TIME_FIELDS),
+        'formats': ['<u2'] * 3 + ['u1'] + ['<f8'] * len(TIME_FIELDS),
+        'offsets': [0, 2, 4, 6] + [8 + 8 * i for i in range(len(TIME_FIELDS))],
+        'itemsize': RECORD.size,
+    })
+
+
+class RunWriter:
+    """Streams one run's results to its segment; the index entry is written on close()."""
+
+    def __init__(self, directory: str = DEFAULT_DIR, run_id: str = None, metadata: dict = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.path = os.path.join(directory, f'{self.run_id}.bin')
+        self.file = open(self.path, 'ab')
+        self.metadata = metadata or {}
+        self.tables = {field: {} for field in CODE_FIELDS}  # field -> {name: code}
+        self.started_at = time.time()
+        self.first_at = self.last_at = None
+        self.count = 0
+
+    def _code(self, field: str, name) -> int:
+        table = self.tables[field]
+        name = str(name) if name is not None else 'unknown'
+        code = table.get(name)
+        if code is None:
+            code = table[name] = len(table)
+        return code
+
+    def append(self, task_name: str, entry: dict):
+        """Append one dispatcher result entry ({'status', 'result', 'returned_at', ...})."""
+        result = entry.get('result') if isinstance(entry.get('result'), dict) else {}
+        timeline = result.get('timeline') or {}
+        times = {**timeline, 'returned_at': entry.get('returned_at'),
+                 'execution_time': result.get('execution_time')}
+        values = [math.nan if times.get(field) is None else float(times[field]) for field in TIME_FIELDS]
+        self.file.write(RECORD.pack(
+            self._code('task', task_name.split('#', 1)[0]),
+            self._code('worker', result.get('worker_id')),
+            self._code('queue', result.get('queue')),
+            STATUSES.index(entry['status']) if entry['status'] in STATUSES else len(STATUSES),
+            *values,
+        ))
+        self.count += 1
+        returned_at = entry.get('returned_at') or time.time()
+        self.first_at = returned_at if self.first_at is None else min(self.first_at, returned_at)
+        self.last_at = returned_at if self.last_at is None else max(self.last_at, returned_at)
+
+    def close(self):
+        self.file.close()
+        entry = {
+            'run_id': self.run_id,
+            'started_at': self.started_at,
+            'finished_at': time.time(),
+            'first_result_at': self.first_at,
+            'last_result_at': self.last_at,
+            'count': self.count,
+            # Code tables: position in each list is the code stored in the records
+            **{field: list(table) for field, table in self.tables.items()},
+            'metadata': self.metadata,
+        }
+        # A single O_APPEND write per run keeps concurrent dispatchers' lines whole
+        with open(os.path.join(self.directory, INDEX_FILE), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class ResultsStore:
+    """Run lookup through the index, and run columns as memory-mapped NumPy arrays."""
+
+    def __init__(self, directory: str = DEFAULT_DIR):
+        self.directory = directory
+
+    def index(self) -> list:
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def runs(self, task: str = None, worker: str = None, since: float = None, until: float = None) -> list:
+        """Index entries of runs that include the task / worker and overlap the time range."""
+        return [
+            run for run in self.index()
+            if (task is None or task in run['task'])
+            and (worker is None or worker in run['worker'])
+            and (since is None or run['finished_at'] >= since)
+            and (until is None or run['started_at'] <= until)
+        ]
+
+    def run(self, run_id: str) -> dict:
+        """Index entry for a run ID ('latest' for the most recent run)."""
+        runs = self.index()
+        if run_id == 'latest' and runs:
+            return runs[-1]
+        for run in runs:
+            if run['run_id'] == run_id:
+                return run
+        raise KeyError(f"Run '{run_id}' not found in {os.path.join(self.directory, INDEX_FILE)}")
+
+    def rows(self, run: dict):
+        """Record array of a run (index entry), memory-mapped from its segment."""
+        import numpy as np
+        path = os.path.join(self.directory, f"{run['run_id']}.bin")
+        if os.path.getsize(path) < RECORD.size:
+            return np.zeros(0, dtype=record_dtype())
+        return np.memmap(path, dtype=record_dtype(), mode='r')
+
+    def load(self, run_id: str):
+        """(index entry, record array) for a run ID."""
+        run = self.run(run_id)
+        return run, self.rows(run)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Scenario runner.
+
+Executes the `test_scenarios` declared in test-config.yml against the running
+workers and checks each one's assertions, so a deployment can be gated on a
+throughput or latency regression. Scenarios run side by side, each in its
+own process, unless marked `exclusive`; those run one at a time afterwards.
+The pass/fail report is written as JSON, the exit status is 1 if any
+scenario failed, and every scenario's results go to the results store
+(analyze_results.py) tagged with the scenario name.
+
+Scenario keys (all optional except `tasks`):
+  tasks             task mix: task names and/or {task: count} entries
+  rate              open loop: tasks/sec, the mix weighted by its counts
+  concurrency       closed loop: tasks in flight at once (default: all)
+  duration          seconds to keep sending (default: send the mix once)
+  ramp              {profile: linear | step, seconds: 10, steps: 4, start: 0.1}
+                    rate or concurrency climbs from `start` x its target
+  timeout           seconds to wait for results after sending (default: 60)
+  expected_workers  minimum workers serving the scenario's queues
+  exclusive         run alone instead of alongside the other scenarios
+  assert            min_throughput (tasks/sec), max_p50_ms, max_p99_ms,
+                    max_error_rate (0.0 - 1.0)
+
+A scenario without tasks (like failure_test, whose `scenarios` need the
+broker or workers taken down by hand) is reported as skipped. One with an
+unknown key, task or assertion is reported as invalid and fails the run.
+
+Usage:
+  python scenario_runner.py [SCENARIO ...] [--report scenario_report.json] [--serial]
+  python scenario_runner.py --list
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from config_cache import load_yaml
+
+CONFIG_FILE = os.getenv('TEST_CONFIG', 'test-config.yml')
+DEFAULT_REPORT = 'scenario_report.json'
+SCENARIO_KEYS = {'description', 'tasks', 'rate', 'concurrency', 'duration', 'ramp', 'timeout',
+                 'expected_workers', 'exclusive', 'assert', 'scenarios'}
+RAMP_PROFILES = ('linear', 'step')
+
+# assertion -> (metric, passes when the metric is ... the limit)
+ASSERTIONS = {
+    'min_throughput': ('throughput', '>='),
+    'max_p50_ms': ('p50_ms', '<='),
+    'max_p99_ms': ('p99_ms', '<='),
+    'max_error_rate': ('error_rate', '<='),
+}
+
+
+def task_mix(tasks) -> dict:
+    """{task: count} from a list of task names and/or {task: count} entries (or one such mapping)."""
+    mix = {}
+    for item in ([tasks] if isinstance(tasks, dict) else tasks or []):
+        for name, count in ({item: 1} if isinstance(item, str) else item).items():
+            mix[name] = mix.get(name, 0) + int(count)
+    return mix
+
+
+def send_order(mix: dict) -> list:
+    """One pass over the mix with each task spread evenly: {a: 2, b: 1} -> [a, b, a]."""
+    slots = [((index + 0.5) / count, name) for name, count in mix.items() for index in range(count)]
+    return [name for _, name in sorted(slots)]
+
+
+def ramp_factor(ramp: dict, elapsed: float) -> float:
+    """Fraction of the target rate / concurrency `elapsed` seconds into the scenario."""
+    if not ramp or elapsed >= ramp.get('seconds', 0):
+        return 1.0
+    start = ramp.get('start', 0.1)
+    progress = elapsed / ramp['seconds']
+    if ramp.get('profile', 'linear') == 'step':
+        steps = ramp.get('steps', 4)
+        progress = math.floor(progress * steps) / steps
+    return start + (1 - start) * progress
+
+
+def validate(settings: dict, task_names) -> list:
+    """Mistakes in a scenario declaration (empty if it is valid)."""
+    problems = [f"unknown key '{key}'" for key in settings if key not in SCENARIO_KEYS]
+    mix = task_mix(settings.get('tasks'))
+    problems += [f"unknown task '{task}'" for task in mix if task not in task_names]
+    problems += [f"unknown assertion '{key}'" for key in settings.get('assert') or {} if key not in ASSERTIONS]
+    ramp = settings.get('ramp') or {}
+    if ramp and (ramp.get('profile', 'linear') not in RAMP_PROFILES or not ramp.get('seconds')):
+        problems.append(f"ramp needs seconds and a profile from {', '.join(RAMP_PROFILES)}")
+    return problems
+
+
+def run_scenario(name: str, settings: dict) -> dict:
+    """Send one scenario's load and measure it (runs in the scenario's own process)."""
+    from celery_app import app
+    from collector import ResultCollector
+    from histogram import LatencyHistogram
+    from publisher import pooled_producer
+    from results_store import RunWriter
+
+    mix = task_mix(settings['tasks'])
+    tasks = {task: app.tasks[f'celery_app.{task}'] for task in mix}
+    rate, duration, ramp = settings.get('rate'), settings.get('duration'), settings.get('ramp')
+    concurrency = settings.get('concurrency') or sum(mix.values())
+    order = itertools.cycle(send_order(mix)) if duration else iter(send_order(mix))
+
+    collector = ResultCollector(app)
+    writer = RunWriter(metadata={'scenario': name})
+    latency = {task: LatencyHistogram() for task in mix}
+    counts = {task: {'sent': 0, 'completed': 0, 'errors': 0} for task in mix}
+    last_received = None
+
+    def record(completed):
+        nonlocal last_received
+        task = completed.label
+        ok = completed.status == 'success'
+        counts[task]['completed' if ok else 'errors'] += 1
+        if ok:
+            latency[task].record((completed.received_at - completed.sent_at) * 1e6)
+            last_received = completed.received_at
+        returned_at = time.time() - (time.perf_counter() - completed.received_at)
+        writer.append(task, {'status': 'success' if ok else 'error', 'result': completed.result,
+                             'returned_at': returned_at})
+
+    start = time.perf_counter()
+    next_send = start
+    try:
+        with pooled_producer(app) as (producer, _):
+            for task in order:
+                while True:
+                    now = time.perf_counter()
+                    if duration and now - start >= duration:
+                        break
+                    factor = ramp_factor(ramp, now - start)
+                    if rate:
+                        wait = next_send - now
+                    else:
+                        wait = 0.1 if len(collector) >= max(1, math.ceil(concurrency * factor)) else 0
+                    if wait <= 0:
+                        break
+                    for completed in collector.drain(timeout=min(wait, 0.1)):
+                        record(completed)
+                if duration and time.perf_counter() - start >= duration:
+                    break
+                collector.add(tasks[task].apply_async(producer=producer), label=task)
+                counts[task]['sent'] += 1
+                if rate:
+                    next_send = max(next_send, time.perf_counter() - 1.0) + 1.0 / (rate * factor)
+        for completed in collector.iter_completed(timeout=settings.get('timeout', 60)):
+            record(completed)
+    finally:
+        writer.close()
+
+    total = LatencyHistogram()
+    for histogram in latency.values():
+        total.merge(histogram)
+    summary = total.summary()
+    sent = sum(c['sent'] for c in counts.values())
+    completed = sum(c['completed'] for c in counts.values())
+    elapsed = (last_received or time.perf_counter()) - start
+    return {
+        'sent': sent,
+        'completed': completed,
+        'errors': sent - completed,
+        'error_rate': (sent - completed) / sent if sent else 0.0,
+        'throughput': completed / elapsed if completed and elapsed > 0 else 0.0,
+        'p50_ms': summary['p50_ms'],
+        'p99_ms': summary['p99_ms'],
+        'elapsed': time.perf_counter() - start,
+        'per_task': {task: {**counts[task], 'p50_ms': latency[task].summary()['p50_ms'],
+                            'p99_ms': latency[task].summary()['p99_ms']} for task in mix},
+        'run_id': writer.run_id,
+    }
+
+
+def check(settings: dict, metrics: dict, workers: int = None) -> list:
+    """Evaluate a scenario's assertions (and expected_workers) against its metrics."""
+    checks = []
+    for key, limit in (settings.get('assert') or {}).items():
+        metric, op = ASSERTIONS[key]
+        actual = metrics[metric]
+        passed = actual >= limit if op == '>=' else actual <= limit
+        checks.append({'check': key, 'limit': limit, 'actual': actual, 'passed': passed})
+    if settings.get('expected_workers') is not None and workers is not None:
+        checks.append({'check': 'expected_workers', 'limit': settings['expected_workers'], 'actual': workers,
+                       'passed': workers >= settings['expected_workers']})
+    return checks
+
+
+def scenario_queues(app, settings: dict) -> set:
+    routes = app.conf.task_routes or {}
+    return {(routes.get(f'celery_app.{task}') or {}).get('queue', task) for task in task_mix(settings['tasks'])}
+
+
+def run_scenarios(scenarios: dict, serial: bool = False) -> list:
+    """Run the runnable scenarios (parallel group, then exclusive ones) and return their report entries."""
+    from celery_app import app
+    from worker_registry import WorkerRegistry
+
+    task_names = {task.split('.', 1)[1] for task in app.tasks if task.startswith('celery_app.')}
+    entries, runnable = {}, {}
+    for name, settings in scenarios.items():
+        settings = settings or {}
+        problems = validate(settings, task_names)
+        entry = {'name': name, 'description': settings.get('description', '')}
+        if problems:
+            entry.update(status='invalid', reason='; '.join(problems))
+        elif not settings.get('tasks'):
+            entry.update(status='skipped', reason='no tasks declared')
+        else:
+            runnable[name] = settings
+        entries[name] = entry
+
+    registry = WorkerRegistry()
+    if any(settings.get('expected_workers') is not None for settings in runnable.values()):
+        registry.refresh(app)
+
+    parallel = [] if serial else [name for name, settings in runnable.items() if not settings.get('exclusive')]
+    batches = [parallel] if parallel else []
+    batches += [[name] for name in runnable if name not in parallel]
+    # Each scenario gets a fresh interpreter: the rpc result consumer is not shared between threads
+    context = multiprocessing.get_context('spawn')
+    for batch in batches:
+        print(f"Running {', '.join(batch)}...", flush=True)
+        with ProcessPoolExecutor(max_workers=len(batch), mp_context=context) as executor:
+            futures = {name: executor.submit(run_scenario, name, runnable[name]) for name in batch}
+            for name, future in futures.items():
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    entries[name].update(status='error', reason=f"{type(e).__name__}: {e}")
+                    continue
+                workers = {worker for queue in scenario_queues(app, runnable[name])
+                           for worker in registry.workers_for(queue)}
+                checks = check(runnable[name], metrics, len(workers))
+                entries[name].update(status='passed' if all(c['passed'] for c in checks) else 'failed',
+                                     metrics=metrics, checks=checks)
+    return list(entries.values())
+
+
+def print_report(entries: list):
+    print("-" * 60)
+    print(f"{'scenario':<16} {'status':<8} {'sent':>6} {'tasks/s':>8} {'p50':>8} {'p99':>8} {'errors':>7}")
+    for entry in entries:
+        metrics = entry.get('metrics')
+        if not metrics:
+            print(f"{entry['name']:<16} {entry['status']:<8} ({entry.get('reason', '')})")
+            continue
+        print(f"{entry['name']:<16} {entry['status']:<8} {metrics['sent']:>6} {metrics['throughput']:>8.1f} "
+              f"{metrics['p50_ms']:>8.0f} {metrics['p99_ms']:>8.0f} {metrics['errors']:>7}")
+        for c in entry['checks']:
+            if not c['passed']:
+                print(f"  ✗ {c['check']}: {c['actual']:.3g} (limit {c['limit']})")
+
+
+def write_report(path: str, entries: list, started_at: float):
+    report = {
+        'started_at': datetime.fromtimestamp(started_at).isoformat(),
+        'finished_at': datetime.now().isoformat(),
+        'passed': all(entry['status'] in ('passed', 'skipped') for entry in entries),
+        'scenarios': entries,
+    }
+    # Write to a temp file and rename, so a CI step never reads a partial report
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(temp_path, path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the test_scenarios in test-config.yml and check their assertions')
+    parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+    parser.add_argument('--report', default=DEFAULT_REPORT,
+                        help=f'JSON pass/fail report path (default: {DEFAULT_REPORT})')
+    parser.add_argument('--serial', action='store_true',
+                        help='Run scenarios one at a time')
+    parser.add_argument('--list', action='store_true',
+                        help='List the declared scenarios and exit')
+    args = parser.parse_args()
+
+    declared = (load_yaml(CONFIG_FILE) or {}).get('test_scenarios') or {}
+    if args.list:
+        for name, settings in declared.items():
+            print(f"{name:<16} {(settings or {}).get('description', '')}")
+        return
+    unknown = [name for name in args.scenarios if name not in declared]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)} (declared: {', '.join(declared)})")
+
+    started_at = time.time()
+    entries = run_scenarios({name: declared[name] for name in args.scenarios or declared}, args.serial)
+    print_report(entries)
+    report = write_report(args.report, entries, started_at)
+    print(f"\n{'PASSED' if report['passed'] else 'FAILED'} - report written to {args.report}")
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
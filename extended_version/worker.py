@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Worker launcher.
+Starts a Celery worker for the given queue(s) with the pool type and
+concurrency declared in the `workers` section of test-config.yml.
+
+Usage:
+  python worker.py queue_a [--pool threads] [--concurrency 50] [celery worker options...]
+
+Options not recognised here (e.g. --loglevel, --hostname) are passed to
+`celery worker` unchanged. The launcher execs celery, so the worker keeps
+this process's PID and receives signals directly.
+"""
+import argparse
+import os
+import sys
+
+from config_cache import load_yaml
+
+POOLS = ['prefork', 'threads', 'gevent', 'eventlet', 'solo']
+
+def load_workers_config(config_file: str = None) -> dict:
+    """Return the `workers` section of test-config.yml ({} if absent)."""
+    config_file = config_file or os.getenv('TEST_CONFIG', 'test-config.yml')
+    if not os.path.exists(config_file):
+        return {}
+    return (load_yaml(config_file) or {}).get('workers') or {}
+
+def pool_settings(queues: list, workers_config: dict) -> dict:
+    """
+    Resolve pool and concurrency for a worker consuming `queues`.
+
+    Each queue falls back to `workers.default`. A single worker has one pool,
+    so every queue it consumes must resolve to the same settings.
+    """
+    default = workers_config.get('default') or {}
+    resolved = {}
+    for queue in queues:
+        settings = {**default, **(workers_config.get(queue) or {})}
+        resolved[queue] = (settings.get('pool', 'prefork'), settings.get('concurrency'))
+    if len(set(resolved.values())) > 1:
+        raise ValueError(f"Queues consumed by one worker need the same pool settings, got {resolved}")
+    pool, concurrency = next(iter(resolved.values()))
+    if pool not in POOLS:
+        raise ValueError(f"Unknown pool '{pool}' for {', '.join(queues)} (choose from {', '.join(POOLS)})")
+    return {'pool': pool, 'concurrency': concurrency}
+
+def worker_command(queues: list, pool: str, concurrency: int = None, app: str = 'celery_app', extra_args=()) -> list:
+    """Build the `celery worker` command line."""
+    command = ['celery', '-A', app, 'worker', '-Q', ','.join(queues), '--pool', pool]
+    if concurrency:
+        command += ['--concurrency', str(concurrency)]
+    return command + list(extra_args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Start a Celery worker with the pool configured for its queues')
+    parser.add_argument('queues', help='Comma-separated queues to consume (e.g. queue_a)')
+    parser.add_argument('--pool', '-P', choices=POOLS, default=None,
+                        help='Override the configured pool type')
+    parser.add_argument('--concurrency', '-c', type=int, default=None,
+                        help='Override the configured concurrency')
+    parser.add_argument('--app', '-A', default='celery_app',
+                        help='Celery app module (default: celery_app)')
+    args, extra_args = parser.parse_known_args()
+
+    queues = args.queues.split(',')
+    try:
+        settings = pool_settings(queues, load_workers_config())
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    pool = args.pool or settings['pool']
+    concurrency = args.concurrency or settings['concurrency']
+
+    command = worker_command(queues, pool, concurrency, args.app, extra_args)
+    print(f"Starting worker: {' '.join(command)}", flush=True)
+    os.execvp(command[0], command)
+
+if __name__ == '__main__':
+    main()
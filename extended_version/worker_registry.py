@@ -0,0 +1,70 @@
+"""
+Cached worker registry.
+
+`inspect().active_queues()` is a broadcast that waits out its whole reply
+timeout, so asking it on every dispatcher run adds about a second before the
+first task is sent. WorkerRegistry keeps the last answer in a local JSON file
+with a TTL: reading it takes milliseconds, and the broadcast only runs when a
+refresh is explicitly requested (`dispatch.py --inspect`).
+"""
+import json
+import os
+import time
+
+DEFAULT_PATH = os.getenv('WORKER_REGISTRY', '.worker_registry.json')
+
+
+class WorkerRegistry:
+    """Which workers serve which queues, cached on disk with a TTL."""
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = 300.0):
+        self.path = path
+        self.ttl = ttl
+        self.updated_at = None
+        self.workers = {}  # hostname -> [queue names]
+        self.load()
+
+    def load(self) -> bool:
+        """Read the cache file; returns False if there is none (or it is unreadable)."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.updated_at = data.get('updated_at')
+        self.workers = data.get('workers') or {}
+        return True
+
+    @property
+    def age(self):
+        """Seconds since the last refresh, or None if never refreshed."""
+        return None if self.updated_at is None else time.time() - self.updated_at
+
+    def is_fresh(self) -> bool:
+        return self.age is not None and self.age <= self.ttl
+
+    def queues(self) -> dict:
+        """{queue: [hostnames]} from the cached worker -> queues map."""
+        by_queue = {}
+        for worker, queues in sorted(self.workers.items()):
+            for queue in queues:
+                by_queue.setdefault(queue, []).append(worker)
+        return by_queue
+
+    def workers_for(self, queue: str) -> list:
+        return self.queues().get(queue, [])
+
+    def refresh(self, app, timeout: float = 1.0) -> dict:
+        """Broadcast inspect().active_queues(), then cache and return the worker -> queues map."""
+        replies = app.control.inspect(timeout=timeout).active_queues() or {}
+        self.workers = {worker: sorted(queue['name'] for queue in queues) for worker, queues in replies.items()}
+        self.updated_at = time.time()
+        self.save()
+        return self.workers
+
+    def save(self):
+        # Write to a temp file and rename, so a concurrent reader never sees a partial file
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'updated_at': self.updated_at, 'workers': self.workers}, f, indent=2)
+        os.replace(temp_path, self.path)
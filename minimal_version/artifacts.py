@@ -0,0 +1,151 @@
+"""
+Claim-check artifact store for large task inputs and outputs.
+
+Task messages and rpc:// results are JSON bodies that go through RabbitMQ, so
+a firmware image or a long test log would be pushed through the broker (as
+base64, a third larger) on every call. Instead, a payload over
+`inline_max_bytes` is written once to a content-addressed directory shared by
+the dispatcher and the workers, and only its reference travels in the message:
+
+  {"sha256": "<hex digest>", "size": <bytes>}   claim check, data in the store
+  {"inline": "<base64>"}                        small payload, in the message
+
+Files are named by the SHA-256 of their content. An artifact that is already
+stored is not written again, so repeated images cost one hash and no copy.
+Readers get a read-only memory map of the file: hashing it or slicing it
+touches the page cache directly instead of copying the payload into the
+process. Files are written to a temp file and renamed, so a reader never
+sees a partial artifact.
+
+Settings come from the `artifacts` section of test-config.yml; ARTIFACT_DIR
+overrides the directory (docker-compose.yml mounts the same one into every
+worker).
+"""
+import base64
+import hashlib
+import mmap
+import os
+import time
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def is_reference(value) -> bool:
+    return isinstance(value, dict) and 'sha256' in value
+
+
+class ArtifactStore:
+    """Content-addressed files under `root`, read through memory maps."""
+
+    def __init__(self, root: str, inline_max_bytes: int = 64 * 1024):
+        self.root = root
+        self.inline_max_bytes = inline_max_bytes
+        self.writes = 0
+        self.dedup_hits = 0
+        self.bytes_written = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _commit(self, temp_path: str, digest: str, size: int) -> dict:
+        """Move a fully written temp file into place, unless the artifact is already stored."""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+            self._reuse(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, path)
+            self.writes += 1
+            self.bytes_written += size
+        return {'sha256': digest, 'size': size}
+
+    def _reuse(self, path: str):
+        self.dedup_hits += 1
+        try:
+            os.utime(path)  # still in use: keep it from prune()
+        except OSError:
+            pass
+
+    def _temp_path(self) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        return os.path.join(self.root, f'.{os.getpid()}.{time.monotonic_ns()}.tmp')
+
+    def put(self, data) -> dict:
+        """Store bytes (or any buffer) and return their reference."""
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path(digest)):
+            self._reuse(self.path(digest))
+            return {'sha256': digest, 'size': len(data)}
+        temp_path = self._temp_path()
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return self._commit(temp_path, digest, len(data))
+
+    def put_file(self, source: str) -> dict:
+        """Store a file, hashing it while it is copied in chunks; returns its reference."""
+        temp_path = self._temp_path()
+        digest = hashlib.sha256()
+        size = 0
+        with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+        return self._commit(temp_path, digest.hexdigest(), size)
+
+    def pack(self, data) -> dict:
+        """Message value for a payload: inline if small, otherwise stored and claim-checked."""
+        if len(data) <= self.inline_max_bytes:
+            return {'inline': base64.b64encode(data).decode('ascii')}
+        return self.put(data)
+
+    @contextmanager
+    def open(self, value):
+        """
+        The payload of a message value as a read-only buffer: a memory map of
+        the stored artifact (no copy), or the decoded bytes of an inline one.
+        Valid only inside the with block: copy what has to outlive it.
+        """
+        if not is_reference(value):
+            yield memoryview(base64.b64decode(value['inline']))
+            return
+        path = self.path(value['sha256'])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Artifact {value['sha256']} not found in {self.root}")
+        if value['size'] == 0:
+            yield memoryview(b'')  # an empty file cannot be mapped
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def prune(self, max_age: float) -> int:
+        """Remove artifacts not modified for `max_age` seconds; returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - max_age
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass  # removed by another process meanwhile
+        return removed
+
+
+def from_config(config: dict) -> ArtifactStore:
+    """The store configured in the `artifacts` section (directory overridden by ARTIFACT_DIR)."""
+    settings = config.get('artifacts') or {}
+    root = os.getenv('ARTIFACT_DIR') or settings.get('dir', 'artifacts')
+    return ArtifactStore(root, settings.get('inline_max_bytes', 64 * 1024))
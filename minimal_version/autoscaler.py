@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Queue-depth autoscaler.
+
+Replaces manual `make scale`: every `interval` seconds it samples the depth
+and consumer count of each configured queue, estimates how fast the backlog
+is draining, and adds or removes workers within per-queue bounds. Hysteresis
+comes from three knobs per queue: a threshold must hold for several
+consecutive checks, scale-up and scale-down thresholds are far apart, and
+no further change is made during a cooldown after each one.
+
+Probes:   passive    - passive queue.declare (message and consumer counts)
+          management - RabbitMQ management API (also reports the ack rate)
+Backends: local      - worker.py subprocesses on this host (no Docker needed)
+          docker-compose - `docker-compose up --scale <service>=N`
+
+Settings live in the `autoscaler` section of test-config.yml.
+"""
+import argparse
+import base64
+import json
+import logging
+import signal
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from celery_app import app, config
+from priorities import expand_lanes
+from sharding import shard_names
+
+logger = logging.getLogger('autoscaler')
+
+# depth: ready messages; ack_rate: broker-reported acks/sec, or None if the probe can't tell
+QueueSample = namedtuple('QueueSample', 'queue depth consumers ack_rate timestamp')
+
+# Decision.action is 'up', 'down' or 'hold'
+Decision = namedtuple('Decision', 'queue action workers target depth drain_rate reason')
+
+
+class PassiveDeclareProbe:
+    """Read queue depth and consumer count with a passive queue.declare."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def sample(self, queue: str) -> QueueSample:
+        with self.app.connection_for_read() as connection:
+            _, depth, consumers = connection.default_channel.queue_declare(queue=queue, passive=True)
+        return QueueSample(queue, depth, consumers, None, time.monotonic())
+
+
+class ManagementApiProbe:
+    """Read queue depth, consumers and ack rate from the RabbitMQ management API."""
+
+    def __init__(self, host: str, port: int, username: str, password: str, vhost: str = '/'):
+        self.base_url = f"http://{host}:{port}/api/queues/{quote(vhost, safe='')}"
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.headers = {'Authorization': f'Basic {token}'}
+
+    def sample(self, queue: str) -> QueueSample:
+        request = Request(f"{self.base_url}/{quote(queue, safe='')}", headers=self.headers)
+        with urlopen(request, timeout=5) as response:
+            data = json.load(response)
+        ack_rate = data.get('message_stats', {}).get('ack_details', {}).get('rate')
+        return QueueSample(queue, data.get('messages_ready', 0), data.get('consumers', 0),
+                           ack_rate, time.monotonic())
+
+
+class SplitQueueProbe:
+    """
+    Sample a queue split into shards (see sharding.py) or priority lanes
+    (see priorities.py) as the sum of its parts.
+    """
+
+    def __init__(self, probe, sharding_config: dict, priorities_config: dict):
+        self.probe = probe
+        self.sharding_config = sharding_config
+        self.priorities_config = priorities_config
+
+    def sample(self, queue: str) -> QueueSample:
+        parts = shard_names(queue, (self.sharding_config.get(queue) or {}).get('shards', 1))
+        parts = expand_lanes(parts, self.priorities_config)
+        samples = [self.probe.sample(part) for part in parts]
+        if len(samples) == 1:
+            return samples[0]
+        ack_rates = [sample.ack_rate for sample in samples if sample.ack_rate is not None]
+        # Every worker of the queue consumes each of its parts
+        return QueueSample(queue, sum(sample.depth for sample in samples),
+                           max(sample.consumers for sample in samples),
+                           sum(ack_rates) if ack_rates else None, time.monotonic())
+
+
+class LocalProcessBackend:
+    """Run workers as local `python worker.py <queue>` subprocesses."""
+
+    def __init__(self, worker_args=('--loglevel=warning',)):
+        self.worker_args = list(worker_args)
+        self.processes = {}  # queue -> [Popen], oldest first
+
+    def _alive(self, queue: str) -> list:
+        processes = [p for p in self.processes.get(queue, []) if p.poll() is None]
+        self.processes[queue] = processes
+        return processes
+
+    def count(self, queue: str) -> int:
+        return len(self._alive(queue))
+
+    def scale(self, queue: str, workers: int):
+        processes = self._alive(queue)
+        while len(processes) < workers:
+            hostname = f'--hostname=autoscaled-{queue}-{len(processes) + 1}@%h'
+            processes.append(subprocess.Popen(
+                [sys.executable, 'worker.py', queue, hostname] + self.worker_args,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+        while len(processes) > workers:
+            # Newest first; SIGTERM is a warm shutdown, so running tasks finish
+            processes.pop().terminate()
+
+    def shutdown(self):
+        for queue in list(self.processes):
+            for process in self._alive(queue):
+                process.terminate()
+            for process in self.processes[queue]:
+                try:
+                    process.wait(30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+class DockerComposeBackend:
+    """Scale docker-compose services (one service per queue)."""
+
+    def __init__(self, services: dict):
+        self.services = services  # queue -> service name
+
+    def count(self, queue: str) -> int:
+        result = subprocess.run(['docker-compose', 'ps', '-q', self.services[queue]],
+                                capture_output=True, text=True, check=True)
+        return len(result.stdout.split())
+
+    def scale(self, queue: str, workers: int):
+        service = self.services[queue]
+        subprocess.run(['docker-compose', 'up', '-d', '--no-recreate', '--scale', f'{service}={workers}', service],
+                       capture_output=True, check=True)
+
+    def shutdown(self):
+        pass  # containers outlive the controller
+
+
+class QueuePolicy:
+    """Per-queue bounds, thresholds and hysteresis state."""
+
+    def __init__(self, queue: str, settings: dict):
+        self.queue = queue
+        self.min_workers = settings.get('min_workers', 1)
+        self.max_workers = settings.get('max_workers', 5)
+        # Backlog per worker above which a worker is added / below which one is removed
+        self.scale_up_backlog = settings.get('scale_up_backlog', 20)
+        self.scale_down_backlog = settings.get('scale_down_backlog', 2)
+        # Don't add workers if the current ones will drain the backlog within this time
+        self.target_drain_seconds = settings.get('target_drain_seconds', 30)
+        self.scale_up_after = settings.get('scale_up_after', 2)
+        self.scale_down_after = settings.get('scale_down_after', 6)
+        self.cooldown = settings.get('cooldown', 30)
+        self.above = 0  # consecutive checks over the scale-up threshold
+        self.below = 0  # consecutive checks under the scale-down threshold
+        self.last_change = None
+        self.last_sample = None
+        self.drain_rate = None  # smoothed messages leaving the queue per second
+
+
+class Autoscaler:
+    """Sample queues, decide and apply scaling, one queue at a time."""
+
+    def __init__(self, probe, backend, policies: dict, smoothing: float = 0.5):
+        self.probe = probe
+        self.backend = backend
+        self.policies = policies
+        self.smoothing = smoothing
+
+    def _update_drain_rate(self, policy: QueuePolicy, sample: QueueSample):
+        """
+        Messages leaving the queue per second.
+
+        The management API reports acks/sec directly. With a passive declare
+        only the depth is known, so the rate is the depth drop between samples:
+        net of new arrivals, and negative while the backlog is growing.
+        """
+        if sample.ack_rate is not None:
+            rate = sample.ack_rate
+        elif policy.last_sample is not None and sample.timestamp > policy.last_sample.timestamp:
+            rate = (policy.last_sample.depth - sample.depth) / (sample.timestamp - policy.last_sample.timestamp)
+        else:
+            rate = None
+        policy.last_sample = sample
+        if rate is not None:
+            policy.drain_rate = rate if policy.drain_rate is None else (
+                self.smoothing * rate + (1 - self.smoothing) * policy.drain_rate)
+
+    def decide(self, policy: QueuePolicy, sample: QueueSample, workers: int) -> Decision:
+        self._update_drain_rate(policy, sample)
+        depth, rate = sample.depth, policy.drain_rate
+
+        def decision(action, target, reason):
+            return Decision(policy.queue, action, workers, target, depth, rate, reason)
+
+        if workers < policy.min_workers:
+            return decision('up', policy.min_workers, f"below min_workers={policy.min_workers}")
+        if workers > policy.max_workers:
+            return decision('down', policy.max_workers, f"above max_workers={policy.max_workers}")
+
+        per_worker = depth / max(workers, 1)
+        draining_in_time = rate is not None and rate > 0 and depth / rate <= policy.target_drain_seconds
+        policy.above = policy.above + 1 if per_worker > policy.scale_up_backlog and not draining_in_time else 0
+        policy.below = policy.below + 1 if per_worker < policy.scale_down_backlog else 0
+
+        if policy.last_change is not None and sample.timestamp - policy.last_change < policy.cooldown:
+            return decision('hold', workers, 'cooldown')
+        if policy.above >= policy.scale_up_after and workers < policy.max_workers:
+            eta = 'not draining' if not rate or rate <= 0 else f"drains in {depth / rate:.0f}s"
+            return decision('up', workers + 1,
+                            f"{per_worker:.0f} msgs/worker > {policy.scale_up_backlog} for {policy.above} checks ({eta})")
+        if policy.below >= policy.scale_down_after and workers > policy.min_workers:
+            return decision('down', workers - 1,
+                            f"{per_worker:.1f} msgs/worker < {policy.scale_down_backlog} for {policy.below} checks")
+        return decision('hold', workers, 'within thresholds')
+
+    def check(self):
+        """Run one sampling and scaling pass over every queue."""
+        decisions = []
+        for queue, policy in self.policies.items():
+            try:
+                sample = self.probe.sample(queue)
+            except Exception as e:
+                logger.warning("%s: could not sample queue (%s: %s)", queue, type(e).__name__, e)
+                continue
+            workers = self.backend.count(queue)
+            decision = self.decide(policy, sample, workers)
+            rate = 'n/a' if decision.drain_rate is None else f"{decision.drain_rate:.1f} msgs/s"
+            if decision.action == 'hold':
+                logger.debug("%s: hold at %d workers, depth=%d, drain rate=%s (%s)",
+                             queue, workers, decision.depth, rate, decision.reason)
+            else:
+                logger.info("%s: scale %s %d -> %d workers, depth=%d, consumers=%d, drain rate=%s (%s)",
+                            queue, decision.action, workers, decision.target, decision.depth,
+                            sample.consumers, rate, decision.reason)
+                self.backend.scale(queue, decision.target)
+                policy.last_change = sample.timestamp
+                policy.above = policy.below = 0
+            decisions.append(decision)
+        return decisions
+
+    def run(self, interval: float):
+        running = True
+
+        def stop(signum, frame):
+            nonlocal running
+            running = False
+
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while running:
+                started = time.monotonic()
+                self.check()
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("Stopping autoscaler")
+            self.backend.shutdown()
+
+
+def build_autoscaler(settings: dict, probe_name: str = None, backend_name: str = None) -> Autoscaler:
+    """Create an Autoscaler from the `autoscaler` section of test-config.yml."""
+    queues = settings.get('queues') or {}
+    policies = {queue: QueuePolicy(queue, queue_settings or {}) for queue, queue_settings in queues.items()}
+
+    probe_name = probe_name or settings.get('probe', 'passive')
+    if probe_name == 'management':
+        rabbitmq = config['rabbitmq']
+        probe = ManagementApiProbe(rabbitmq['host'], rabbitmq.get('management_port', 15672),
+                                   rabbitmq['username'], rabbitmq['password'], rabbitmq.get('vhost', '/'))
+    else:
+        probe = PassiveDeclareProbe(app)
+    if config.get('sharding') or config.get('priorities'):
+        probe = SplitQueueProbe(probe, config.get('sharding') or {}, config.get('priorities') or {})
+
+    backend_name = backend_name or settings.get('backend', 'local')
+    if backend_name == 'docker-compose':
+        backend = DockerComposeBackend({queue: (queues[queue] or {}).get('service', queue) for queue in queues})
+    else:
+        backend = LocalProcessBackend()
+    return Autoscaler(probe, backend, policies)
+
+def main():
+    parser = argparse.ArgumentParser(description='Scale workers from queue depth')
+    parser.add_argument('--backend', '-b', choices=['local', 'docker-compose'], default=None,
+                        help='Worker backend (default: autoscaler.backend in test-config.yml)')
+    parser.add_argument('--probe', '-p', choices=['passive', 'management'], default=None,
+                        help='Queue depth source (default: autoscaler.probe in test-config.yml)')
+    parser.add_argument('--interval', '-i', type=float, default=None,
+                        help='Seconds between checks (default: autoscaler.interval in test-config.yml)')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Also log hold decisions')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    settings = config.get('autoscaler') or {}
+    if not settings.get('queues'):
+        sys.exit("❌ No queues configured under autoscaler.queues in test-config.yml")
+
+    autoscaler = build_autoscaler(settings, args.probe, args.backend)
+    interval = args.interval or settings.get('interval', 5)
+    logger.info("Autoscaling %s every %gs", ', '.join(autoscaler.policies), interval)
+    autoscaler.run(interval)
+
+if __name__ == '__main__':
+    main()
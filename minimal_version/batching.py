@@ -0,0 +1,115 @@
+"""
+Micro-task batching for short tasks.
+
+For 0.1-0.2s tasks the broker round trip, ack and result message are a large
+share of the total cost. BatchDispatcher packs many invocations of the same
+task into one `run_batch` message per route and unpacks the compact result
+array back into per-invocation results, so callers still see one result per
+submit(). Batch size and max linger time come from the `batching` section of
+test-config.yml.
+"""
+import time
+from collections import defaultdict
+
+from celery_app import app, config, lane_router, run_batch, shard_router
+from collector import ResultCollector
+
+
+class Invocation:
+    """One logical task call. Filled in when the message carrying it completes."""
+
+    __slots__ = ('task_name', 'args', 'status', 'result', 'error', 'submitted_at', 'received_at')
+
+    def __init__(self, task_name: str, args: tuple):
+        self.task_name = task_name
+        self.args = args
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.received_at = None
+
+
+class BatchDispatcher:
+    """Buffer invocations per route and send them as batched messages."""
+
+    def __init__(self, enabled: bool = None, batching_config: dict = None):
+        batching_config = batching_config if batching_config is not None else config.get('batching', {})
+        self.enabled = batching_config.get('enabled', False) if enabled is None else enabled
+        self.routes = batching_config.get('routes', {})
+        self.collector = ResultCollector(app)
+        self._buffers = defaultdict(list)  # short task name -> [Invocation]
+        self.messages_sent = 0
+
+    def _route_settings(self, name: str):
+        route = self.routes.get(name)
+        if not self.enabled or not route:
+            return 1, 0.0
+        return max(int(route.get('batch_size', 1)), 1), route.get('max_linger_ms', 0) / 1000.0
+
+    def submit(self, task, args: tuple = ()) -> Invocation:
+        """Queue one invocation of `task`; it is sent once its route's batch is full or lingered."""
+        name = task.name.rsplit('.', 1)[-1]
+        invocation = Invocation(name, tuple(args))
+        buffer = self._buffers[name]
+        buffer.append(invocation)
+        batch_size, max_linger = self._route_settings(name)
+        if len(buffer) >= batch_size or invocation.submitted_at - buffer[0].submitted_at >= max_linger:
+            self._send(name)
+        return invocation
+
+    def _send(self, name: str):
+        invocations = self._buffers.pop(name, None)
+        if not invocations:
+            return
+        queue = shard_router.queue_for(lane_router.queue_for(config['task_routing'][name]))
+        task = app.tasks[f'celery_app.{name}']
+        if len(invocations) == 1 and self._route_settings(name)[0] == 1:
+            async_result = task.apply_async(args=invocations[0].args, queue=queue)
+            self.collector.add(async_result, label=(False, invocations))
+        else:
+            async_result = run_batch.apply_async(args=(task.name, [inv.args for inv in invocations]), queue=queue)
+            self.collector.add(async_result, label=(True, invocations))
+        self.messages_sent += 1
+
+    def flush_expired(self):
+        """Send every buffered batch whose oldest invocation has waited longer than its linger time."""
+        now = time.perf_counter()
+        for name, buffer in list(self._buffers.items()):
+            if buffer and now - buffer[0].submitted_at >= self._route_settings(name)[1]:
+                self._send(name)
+
+    def flush(self):
+        """Send every buffered batch regardless of size or age."""
+        for name in list(self._buffers):
+            self._send(name)
+
+    @staticmethod
+    def _unpack(completed):
+        batched, invocations = completed.label
+        for index, invocation in enumerate(invocations):
+            invocation.received_at = completed.received_at
+            if completed.status != 'success':
+                invocation.status, invocation.error = completed.status, completed.error
+            elif not batched:
+                invocation.status, invocation.result = 'success', completed.result
+            else:
+                invocation.status, invocation.result = 'success', completed.result['results'][index]
+        if batched and completed.status == 'success':
+            for index, error in completed.result['errors']:
+                invocations[index].status, invocations[index].error = 'error', error
+        return invocations
+
+    def drain(self, timeout: float = 0.0):
+        """Send lingering batches, wait up to `timeout` for replies, return finished invocations."""
+        self.flush_expired()
+        finished = []
+        for completed in self.collector.drain(timeout):
+            finished.extend(self._unpack(completed))
+        return finished
+
+    def iter_completed(self, timeout: float = None):
+        """Flush everything and yield invocations as their messages complete."""
+        self.flush()
+        for completed in self.collector.iter_completed(timeout=timeout):
+            yield from self._unpack(completed)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Claim-check benchmark: inline vs claim-checked task payloads.
+
+Sends `--tasks` flash_firmware tasks per payload size to a local worker, the
+same random image each time, and collects their results. Runs once per mode:
+
+  inline       the image travels base64-encoded in the JSON message body
+  claim_check  the image is put in a content-addressed store (written once,
+               then deduplicated by hash) and only its reference is sent;
+               the worker reads it through a memory map
+
+Reports message size, dispatcher time to pack and publish, send -> result
+time per task and payload throughput. Inline payloads above the broker's
+maximum message size (RabbitMQ's max_message_size) fail and are counted as
+errors. The worker and the dispatcher share a temporary store directory.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from artifacts import ArtifactStore
+from bench_pools import start_worker, stop_worker
+from celery_app import app, flash_firmware
+from collector import ResultCollector
+
+BENCH_QUEUE = 'bench_artifacts'
+MODES = ('inline', 'claim_check')
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'B': 1}
+
+def parse_size(value: str) -> int:
+    """'1KB' / '50MB' / '4096' -> bytes"""
+    value = value.strip().upper()
+    for unit, factor in UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+def format_size(size: int) -> str:
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= UNITS[unit]:
+            return f'{size / UNITS[unit]:g}{unit}'
+    return f'{size}B'
+
+def run_mode(mode: str, image: bytes, store: ArtifactStore, args) -> dict:
+    """Pack and send the image `args.tasks` times, then collect and check every result."""
+    expected = hashlib.sha256(image).hexdigest()
+    collector = ResultCollector(app)
+    errors = 0
+    message_bytes = 0
+    start_time = time.perf_counter()
+    for _ in range(args.tasks):
+        if mode == 'inline':
+            payload = {'inline': base64.b64encode(image).decode('ascii')}
+        else:
+            payload = store.put(image)
+        message_bytes = len(json.dumps(payload))
+        try:
+            collector.add(flash_firmware.apply_async((payload,), queue=BENCH_QUEUE))
+        except Exception as e:
+            errors += 1
+            print(f"    {mode}: publish failed ({type(e).__name__}: {e})")
+    publish_time = time.perf_counter() - start_time
+
+    completed = 0
+    for result in collector.iter_completed(timeout=args.timeout):
+        if result.status != 'success' or result.result['sha256'] != expected:
+            errors += 1
+        else:
+            completed += 1
+    elapsed = time.perf_counter() - start_time
+    return {
+        'message_bytes': message_bytes,
+        'publish_ms': publish_time / args.tasks * 1000,
+        'task_ms': elapsed / args.tasks * 1000,
+        'mb_per_second': completed * len(image) / UNITS['MB'] / elapsed,
+        'errors': errors,
+    }
+
+def run_benchmark(args) -> dict:
+    print(f"Claim-check benchmark: {args.tasks} flash_firmware tasks per size "
+          f"({', '.join(format_size(size) for size in args.sizes)}), inline vs claim check")
+    print(f"  One {args.pool} worker x {args.concurrency}")
+    print("-" * 50)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = ArtifactStore(store_dir)
+        try:
+            process = start_worker([BENCH_QUEUE], args.pool, args.concurrency, env={'ARTIFACT_DIR': store_dir},
+                                   probe=lambda queue: flash_firmware.apply_async(({'inline': ''},), queue=queue),
+                                   hostname='bench-artifacts')
+        except Exception as e:
+            sys.exit(f"❌ Worker did not start ({type(e).__name__}: {e})")
+        try:
+            for size in args.sizes:
+                image = os.urandom(size)
+                for mode in MODES:
+                    results[(size, mode)] = run_mode(mode, image, store, args)
+                    print(f"  {format_size(size)} {mode}: {results[(size, mode)]['task_ms']:.1f}ms per task")
+        finally:
+            stop_worker(process)
+        print(f"  Store: {store.writes} artifacts written ({format_size(store.bytes_written)}), "
+              f"{store.dedup_hits} puts deduplicated")
+
+    print("-" * 50)
+    print(f"  {'size':>6} {'mode':<12} {'msg bytes':>10} {'publish ms':>11} {'ms/task':>9} {'MB/s':>8} {'errors':>7}")
+    for (size, mode), result in results.items():
+        print(f"  {format_size(size):>6} {mode:<12} {result['message_bytes']:>10} {result['publish_ms']:>11.1f} "
+              f"{result['task_ms']:>9.1f} {result['mb_per_second']:>8.1f} {result['errors']:>7}")
+    print("  (publish ms: pack + publish per task; ms/task: wall time of the run / tasks)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inline and claim-check task payloads')
+    parser.add_argument('--sizes', type=lambda value: [parse_size(size) for size in value.split(',')],
+                        default=[parse_size(size) for size in ('1KB', '1MB', '50MB')],
+                        help='Comma-separated payload sizes (default: 1KB,1MB,50MB)')
+    parser.add_argument('--tasks', '-n', type=int, default=10,
+                        help='Tasks per size and mode (default: 10)')
+    parser.add_argument('--pool', '-P', default='threads',
+                        help='Worker pool (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4,
+                        help='Worker concurrency (default: 4)')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds to wait for each run to complete (default: 300)')
+    run_benchmark(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
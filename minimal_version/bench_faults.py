@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Fault-injection benchmark: throughput recovery after a dependency outage.
+
+Sends task_a to a local worker at a fixed rate while fault injection
+(`fault_injection`, outage mode) makes every attempt fail for a stretch of
+the run, and measures how long after the outage ends new tasks again
+succeed with their pre-outage latency, next to successes per second over
+the whole run. Runs once per mode:
+
+  unprotected  autoretry only: every failed attempt is retried through the
+               broker and the retries pile up behind new work
+  fail         circuit breaker failing tasks fast while open
+  park         circuit breaker parking tasks while open
+
+The protected modes use the circuit breaker and the queue_a rate limit from
+the `protection` section. Each worker loads its settings from a temporary
+copy of test-config.yml, through the same path the real workers use.
+Before the runs, a simulated-clock check confirms that half-open trial
+tasks which never report do not keep the circuit shut.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import yaml
+
+from bench_pools import start_worker, stop_worker
+from celery_app import app, config, task_a
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from protection import HALF_OPEN, CircuitBreaker
+
+BENCH_QUEUE = 'bench_faults'
+MODES = ('unprotected', 'fail', 'park')
+BARS = ' ▁▂▃▄▅▆▇█'
+
+def write_mode_config(directory: str, mode: str, outage_file: str) -> str:
+    """Write a copy of the loaded config with outage fault injection and the mode's protection."""
+    protection_config = config.get('protection') or {}
+    queue_settings = (protection_config.get('queues') or {}).get(config['task_routing']['task_a']) or {}
+    mode_config = {
+        **config,
+        'fault_injection': {'enabled': True, 'mode': 'outage', 'tasks': ['task_a'], 'outage_file': outage_file},
+        'protection': {
+            'enabled': mode != 'unprotected',
+            'circuit_breaker': {**(protection_config.get('circuit_breaker') or {}), 'when_open': mode},
+            'queues': {BENCH_QUEUE: queue_settings},
+        },
+    }
+    path = os.path.join(directory, 'test-config.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(mode_config, f, sort_keys=False)
+    return path
+
+def run_mode(outage_file: str, args) -> dict:
+    """Send at a fixed rate with the outage in the middle; per-second successes and recovery time."""
+    collector = ResultCollector(app)
+    completed = []
+    interval = 1.0 / args.rate
+    start_time = time.perf_counter()
+    sent = 0
+    try:
+        while True:
+            now = time.perf_counter() - start_time
+            if now >= args.duration:
+                break
+            outage = args.outage_start <= now < args.outage_end
+            if outage != os.path.exists(outage_file):
+                if outage:
+                    open(outage_file, 'w').close()
+                else:
+                    os.remove(outage_file)
+            scheduled = sent * interval
+            if now < scheduled:
+                completed += collector.drain(timeout=min(scheduled - now, 0.1))
+                continue
+            collector.add(task_a.apply_async(queue=BENCH_QUEUE), label=scheduled)
+            sent += 1
+    finally:
+        if os.path.exists(outage_file):
+            os.remove(outage_file)
+    completed += collector.iter_completed(timeout=args.timeout)
+
+    per_second = [0] * int(max([args.duration] + [c.received_at - start_time for c in completed]) + 1)
+    before_latency, after_latency = LatencyHistogram(), LatencyHistogram()
+    worst_after = {}  # send second after the outage -> worst latency (inf for a failed task)
+    errors = retries = 0
+    for result in completed:
+        latency = result.received_at - result.sent_at
+        if result.label >= args.outage_end:
+            second = int(result.label)
+            worst_after[second] = max(worst_after.get(second, 0), latency if result.status == 'success' else float('inf'))
+        if result.status != 'success':
+            errors += 1
+            continue
+        per_second[int(result.received_at - start_time)] += 1
+        retries += result.result.get('retry_count', 0)
+        if result.label < args.outage_start and not result.result.get('retry_count'):
+            before_latency.record(latency * 1e6)
+        elif result.label >= args.outage_end:
+            after_latency.record(latency * 1e6)
+
+    # Recovered once every task sent from then on succeeds within twice the pre-outage p99
+    # (of tasks that succeeded first time: those sent just before the outage were retried)
+    threshold = 2 * before_latency.summary()['p99_ms'] / 1000
+    recovered_at = None
+    for second in sorted(worst_after, reverse=True):
+        if worst_after[second] > threshold:
+            break
+        recovered_at = second
+    return {
+        'per_second': per_second,
+        'recovery': None if recovered_at is None else max(recovered_at - args.outage_end, 0),
+        'after_p99_ms': after_latency.summary()['p99_ms'],
+        'errors': errors,
+        'retries': retries,
+    }
+
+def check_stuck_trials() -> bool:
+    """
+    Half-open trials that never report (killed, lost or revoked tasks) must not
+    hold the circuit shut: with a simulated clock, take every trial slot
+    without recording, and expect new trials to be let through again
+    open_seconds later.
+    """
+    settings = dict((config.get('protection') or {}).get('circuit_breaker') or {})
+    settings.pop('when_open', None)
+    settings.pop('park_seconds', None)
+    now = [0.0]
+    breaker = CircuitBreaker(**settings, clock=lambda: now[0])
+    for _ in range(max(breaker.min_calls, 1)):
+        breaker.record(False)
+    now[0] += breaker.open_seconds
+    trials = 0
+    while breaker.allow():
+        trials += 1  # these trial tasks never report
+    stuck = breaker.state == HALF_OPEN and trials == breaker.half_open_calls
+    now[0] += breaker.open_seconds
+    return stuck and breaker.allow()
+
+def sparkline(counts: list, top: float) -> str:
+    return ''.join(BARS[min(int(count / top * (len(BARS) - 1)), len(BARS) - 1)] for count in counts)
+
+def run_benchmark(args) -> dict:
+    capacity = args.concurrency / 0.1
+    print(f"Fault-injection benchmark: task_a at {args.rate:g}/s for {args.duration:g}s, dependency down "
+          f"from {args.outage_start:g}s to {args.outage_end:g}s")
+    print(f"  One {args.pool} worker x {args.concurrency} (~{capacity:.0f} task_a/s)")
+    print("-" * 50)
+    if check_stuck_trials():
+        print("  ✅ Half-open trials that never report are started over after open_seconds")
+    else:
+        print("  ❌ Half-open trials that never report keep the circuit shut")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        outage_file = os.path.join(directory, 'outage')
+        for mode in args.modes:
+            try:
+                process = start_worker([BENCH_QUEUE], args.pool, args.concurrency, hostname='bench-faults',
+                                       env={'TEST_CONFIG': write_mode_config(directory, mode, outage_file)})
+            except Exception as e:
+                print(f"  {mode}: worker did not start ({type(e).__name__}: {e})")
+                continue
+            try:
+                results[mode] = run_mode(outage_file, args)
+            finally:
+                stop_worker(process)
+            recovery = results[mode]['recovery']
+            print(f"  {mode}: {'not recovered' if recovery is None else f'recovered {recovery:.0f}s after the outage'}")
+
+    print("-" * 50)
+    print(f"  {'mode':<12} {'recovery':>9} {'p99 after':>10} {'retries':>8} {'errors':>7}  successes/sec")
+    top = max((max(r['per_second']) for r in results.values()), default=1) or 1
+    for mode, result in results.items():
+        recovery = '-' if result['recovery'] is None else f"{result['recovery']:.0f}s"
+        print(f"  {mode:<12} {recovery:>9} {result['after_p99_ms']:>10.0f} {result['retries']:>8} "
+              f"{result['errors']:>7}  {sparkline(result['per_second'], top)}")
+    print(f"  (recovery: seconds after the outage until every task sent succeeds within 2x the pre-outage p99;"
+          f" p99 after: send -> result ms of tasks sent after the outage)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure throughput recovery after a dependency outage')
+    parser.add_argument('--rate', '-r', type=float, default=30.0,
+                        help='task_a sent per second (default: 30)')
+    parser.add_argument('--duration', '-d', type=float, default=40.0,
+                        help='Seconds to keep sending (default: 40)')
+    parser.add_argument('--outage-start', type=float, default=10.0,
+                        help='Seconds into the run the dependency goes down (default: 10)')
+    parser.add_argument('--outage-end', type=float, default=20.0,
+                        help='Seconds into the run it comes back (default: 20)')
+    parser.add_argument('--modes', type=lambda value: value.split(','), default=list(MODES),
+                        help=f"Comma-separated modes to run (default: {','.join(MODES)})")
+    parser.add_argument('--pool', '-P', default='threads',
+                        help='Worker pool (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4,
+                        help='Worker concurrency (default: 4)')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='Seconds to wait for outstanding results after sending (default: 120)')
+    args = parser.parse_args()
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))} (choose from {', '.join(MODES)})")
+    run_benchmark(args)
+
+if __name__ == '__main__':
+    main()
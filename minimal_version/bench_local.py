@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Docker-free benchmark harness.
+
+Starts `--workers` local worker processes on queue_a/queue_b (plus one
+suite_reduce worker for the fan-out workload) against celery_app.app over a
+filesystem broker in a temporary directory (see local_broker.py), or over
+`--broker-url` such as a local RabbitMQ, and runs a fixed set of workloads:
+
+  dispatch       publish cost per task: per-call apply_async vs dispatch_many
+  per_task       no-op tasks end to end: throughput and send -> result latency
+  fan_out        a suite of task_a cases reduced on the workers (suites.py),
+                 against the time the same work would take with no overhead
+  large_payload  flash_firmware with a 1 MB image inline vs claim-checked
+
+The results can be written as a baseline JSON (`--save`) and compared with
+an earlier one (`--compare`): the exit status is 1 if any metric got worse by
+more than `--tolerance`. Only compare baselines from the same host and
+settings; the filesystem broker polls, so its absolute numbers are not those
+of RabbitMQ.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+WORKLOADS = ('dispatch', 'per_task', 'fan_out', 'large_payload')
+TASK_A_SECONDS = 0.1  # task_a's simulated work
+
+# Imported by load_app() once the broker environment is set: celery_app reads it at import
+app = config = simulated_work = flash_firmware = run_suite = suite_config = None
+ResultCollector = LatencyHistogram = dispatch_many = stop_worker = suites = None
+
+def load_app():
+    global app, config, simulated_work, flash_firmware, run_suite, suite_config
+    global ResultCollector, LatencyHistogram, dispatch_many, stop_worker, suites
+    from celery_app import app, config, simulated_work, flash_firmware, run_suite, suite_config
+    from collector import ResultCollector
+    from histogram import LatencyHistogram
+    from publisher import dispatch_many
+    from bench_pools import stop_worker
+    import suites
+
+def start_workers(args) -> list:
+    """Start the queue_a/queue_b workers and the suite_reduce worker, and wait until all answer a ping."""
+    processes = []
+    commands = [[sys.executable, 'worker.py', 'queue_a,queue_b', '--concurrency', str(args.concurrency),
+                 '--loglevel=warning', f'--hostname=local-{index}@%h'] for index in range(args.workers)]
+    commands.append([sys.executable, 'worker.py', suite_config['reduce_queue'],
+                     '--loglevel=warning', '--hostname=local-reduce@%h'])
+    for command in commands:
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    started = set()
+    deadline = time.perf_counter() + args.startup_timeout
+    while time.perf_counter() < deadline:
+        # A broadcast can miss a worker that is still binding its queues: count every reply so far
+        started.update(name for reply in app.control.ping(timeout=1.0) for name in reply)
+        if len(started) >= len(commands):
+            return processes
+        if any(process.poll() is not None for process in processes):
+            break
+    stop_workers(processes)
+    raise RuntimeError(f"{len(commands)} workers did not all start within {args.startup_timeout:g}s")
+
+def stop_workers(processes: list):
+    for process in processes:
+        stop_worker(process)
+
+def collect(collector, timeout: float) -> tuple:
+    """Drain a collector; returns (completed results, errors)."""
+    completed = list(collector.iter_completed(timeout=timeout))
+    return completed, sum(1 for result in completed if result.status != 'success')
+
+def run_dispatch(args) -> dict:
+    """Publish cost per task, one apply_async per call vs bulk over one pooled channel."""
+    collector = ResultCollector(app)
+    start_time = time.perf_counter()
+    for _ in range(args.tasks):
+        collector.add(simulated_work.apply_async((0,), queue='queue_a'))
+    per_call = time.perf_counter() - start_time
+    _, errors = collect(collector, args.timeout)
+
+    start_time = time.perf_counter()
+    dispatch_many(simulated_work, ((0,) for _ in range(args.tasks)), queue='queue_a', on_sent=collector.add)
+    bulk = time.perf_counter() - start_time
+    errors += collect(collector, args.timeout)[1]
+    return {
+        'apply_async_us': per_call / args.tasks * 1e6,
+        'dispatch_many_us': bulk / args.tasks * 1e6,
+        'errors': errors,
+    }
+
+def run_per_task(args) -> dict:
+    """No-op tasks sent up front and collected in completion order."""
+    collector = ResultCollector(app)
+    latency = LatencyHistogram()
+    start_time = time.perf_counter()
+    dispatch_many(simulated_work, ((0,) for _ in range(args.tasks)), queue='queue_a', on_sent=collector.add)
+    completed, errors = collect(collector, args.timeout)
+    elapsed = time.perf_counter() - start_time
+    for result in completed:
+        if result.status == 'success':
+            latency.record((result.received_at - result.sent_at) * 1e6)
+    summary = latency.summary()
+    return {
+        'tasks_per_second': (len(completed) - errors) / elapsed,
+        'ms_per_task': elapsed / args.tasks * 1000,
+        'p50_ms': summary['p50_ms'],
+        'p99_ms': summary['p99_ms'],
+        'errors': errors,
+    }
+
+def run_fan_out(args) -> dict:
+    """A suite of task_a cases, four chunks per worker slot, reduced on the workers."""
+    slots = args.workers * args.concurrency
+    chunk_size = 2
+    cases = [('celery_app.task_a', ())] * (slots * 4 * chunk_size)
+    chunks = suites.plan(cases, chunk_size)
+    fanout = max(suite_config.get('fanout', 8), 2)
+    suites.check_tree(len(chunks), fanout, suites.configured_slots(config.get('workers') or {},
+                                                                   suite_config['reduce_queue']))
+    start_time = time.perf_counter()
+    summary = run_suite.apply_async((chunks, fanout), queue=suite_config['reduce_queue']).get(timeout=args.timeout)
+    elapsed = time.perf_counter() - start_time
+    ideal = len(cases) * TASK_A_SECONDS / slots
+    failed = sum(stats['failed'] for stats in summary['tasks'].values())
+    return {
+        'seconds': elapsed,
+        'overhead_seconds': elapsed - ideal,
+        'errors': failed,
+    }
+
+def run_large_payload(args) -> dict:
+    """flash_firmware with the same 1 MB image, inline (base64) vs claim-checked."""
+    from artifacts import from_config
+    store = from_config(config)
+    image = os.urandom(1024 * 1024)
+    results = {}
+    errors = 0
+    for mode in ('inline', 'claim_check'):
+        collector = ResultCollector(app)
+        start_time = time.perf_counter()
+        for _ in range(args.payload_tasks):
+            if mode == 'inline':
+                payload = {'inline': base64.b64encode(image).decode('ascii')}
+            else:
+                payload = store.put(image)
+            collector.add(flash_firmware.apply_async((payload,), queue='queue_a'))
+        errors += collect(collector, args.timeout)[1]
+        results[f'{mode}_ms_per_task'] = (time.perf_counter() - start_time) / args.payload_tasks * 1000
+    return {**results, 'errors': errors}
+
+RUNNERS = {
+    'dispatch': run_dispatch,
+    'per_task': run_per_task,
+    'fan_out': run_fan_out,
+    'large_payload': run_large_payload,
+}
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith('_per_second')
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """Print every metric against the baseline; returns the regressions beyond `tolerance`."""
+    regressions = []
+    for key in ('host', 'broker', 'settings'):
+        if baseline.get(key) != current[key]:
+            print(f"  ⚠️  Baseline {key} differs ({baseline.get(key)} vs {current[key]}): numbers may not compare")
+    print(f"  {'workload':<14} {'metric':<22} {'baseline':>10} {'now':>10} {'change':>8}")
+    for workload, metrics in current['workloads'].items():
+        for metric, value in metrics.items():
+            before = (baseline.get('workloads', {}).get(workload) or {}).get(metric)
+            if before is None:
+                continue
+            change = (value - before) / before if before else 0.0
+            if metric == 'errors':
+                worse = value > before  # any new failure counts
+            else:
+                worse = (-change if higher_is_better(metric) else change) > tolerance
+            flag = '  ❌' if worse else ''
+            if flag:
+                regressions.append(f'{workload}.{metric}')
+            print(f"  {workload:<14} {metric:<22} {before:>10.2f} {value:>10.2f} {change:>+7.0%}{flag}")
+    return regressions
+
+def save(path: str, results: dict):
+    # Write to a temp file and rename, so an interrupted run never leaves a partial baseline
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    os.replace(temp_path, path)
+
+def run_benchmark(args) -> dict:
+    import celery
+    print(f"Local benchmark: {args.workers} workers x {args.concurrency} over "
+          f"{'a filesystem broker' if not args.broker_url else args.broker_url}")
+    print(f"  Workloads: {', '.join(args.workloads)}")
+    print("-" * 50)
+    processes = start_workers(args)
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'celery': celery.__version__,
+        'broker': 'filesystem' if not args.broker_url else args.broker_url.split('://')[0],
+        'settings': {key: getattr(args, key) for key in ('workers', 'concurrency', 'tasks', 'payload_tasks')},
+        'workloads': {},
+    }
+    try:
+        for workload in args.workloads:
+            metrics = RUNNERS[workload](args)
+            results['workloads'][workload] = metrics
+            print(f"  {workload}: " + ', '.join(f'{name} {value:.2f}' if isinstance(value, float) else f'{name} {value}'
+                                                 for name, value in metrics.items()))
+    finally:
+        stop_workers(processes)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark workloads against local workers, no Docker needed')
+    parser.add_argument('--workers', '-w', type=int, default=2,
+                        help='queue_a/queue_b worker processes (default: 2)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                        help='Concurrency per worker (default: 8)')
+    parser.add_argument('--tasks', '-n', type=int, default=500,
+                        help='Tasks per dispatch / per_task run (default: 500)')
+    parser.add_argument('--payload-tasks', type=int, default=10,
+                        help='Tasks per large_payload mode (default: 10)')
+    parser.add_argument('--workloads', type=lambda value: value.split(','), default=list(WORKLOADS),
+                        help=f"Comma-separated workloads (default: {','.join(WORKLOADS)})")
+    parser.add_argument('--broker-url', default=None,
+                        help='Use this broker (e.g. a local RabbitMQ) instead of a filesystem broker')
+    parser.add_argument('--save', metavar='PATH', default=None,
+                        help='Write the results as a baseline JSON')
+    parser.add_argument('--compare', metavar='PATH', default=None,
+                        help='Compare with a baseline JSON; exit 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed change for the worse before a metric counts as a regression (default: 0.25)')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='Seconds to wait for each run to complete (default: 120)')
+    parser.add_argument('--startup-timeout', type=float, default=60.0,
+                        help='Seconds to wait for the workers to start (default: 60)')
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(sorted(unknown))} (choose from {', '.join(WORKLOADS)})")
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix='bench-local-') as directory:
+        # Workers inherit the environment: one broker and one artifact store for everyone
+        if args.broker_url:
+            os.environ['BROKER_URL'] = args.broker_url
+        else:
+            os.environ['LOCAL_BROKER_DIR'] = os.path.join(directory, 'broker')
+        os.environ['ARTIFACT_DIR'] = os.path.join(directory, 'artifacts')
+        load_app()
+        try:
+            results = run_benchmark(args)
+        except RuntimeError as e:
+            sys.exit(f"❌ {e}")
+
+    if args.save:
+        save(args.save, results)
+        print(f"📄 Baseline written to {args.save}")
+    if baseline is not None:
+        print("-" * 50)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"❌ Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Memoization benchmark: a CI job matrix dispatched by parallel jobs, then rerun.
+
+Starts a local worker, then sends a matrix of `--cases` distinct
+simulated_work calls from `--jobs` dispatcher processes at once (parallel CI
+jobs running the same matrix), and then once more as a rerun. Runs once per
+mode:
+
+  off  every call is sent
+  on   calls go through MemoDispatcher (see memo.py) with an empty store:
+       the parallel jobs share one execution per case (single flight) and
+       the rerun is served from the shared store
+
+Reports per pass the calls made, the broker messages actually sent and the
+cache counters.
+"""
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from bench_pools import noop_probe, start_worker, stop_worker
+from celery_app import app, config, simulated_work
+from memo import MemoDispatcher
+
+BENCH_QUEUE = 'bench_memo'
+MODES = ('off', 'on')
+PASSES = ('first run', 'rerun')
+
+def run_job(memo_config: dict, cases: int, duration: float, start_at: float, timeout: float) -> dict:
+    """One CI job, in its own process: submit the matrix at `start_at` and wait for every result."""
+    memo = MemoDispatcher(app, memo_config)
+    time.sleep(max(start_at - time.time(), 0))  # all jobs start together, like parallel CI jobs
+    start_time = time.perf_counter()
+    for case in range(cases):
+        memo.submit(simulated_work, (duration, f'case-{case}'), queue=BENCH_QUEUE)
+    errors = sum(1 for invocation in memo.iter_completed(timeout=timeout) if invocation.status != 'success')
+    return {
+        'counters': dict(memo.counters),
+        'messages': memo.messages_sent,
+        'errors': errors,
+        'seconds': time.perf_counter() - start_time,
+    }
+
+def run_pass(memo_config: dict, args) -> dict:
+    """Run the matrix from every job at once and add up their counters."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(args.jobs, mp_context=context) as pool:
+        start_at = time.time() + args.startup
+        jobs = [pool.submit(run_job, memo_config, args.cases, args.duration, start_at, args.timeout)
+                for _ in range(args.jobs)]
+        outcomes = [job.result() for job in jobs]
+    counters = Counter()
+    for outcome in outcomes:
+        counters.update(outcome['counters'])
+    return {
+        'counters': counters,
+        'messages': sum(outcome['messages'] for outcome in outcomes),
+        'errors': sum(outcome['errors'] for outcome in outcomes),
+        'seconds': max(outcome['seconds'] for outcome in outcomes),
+    }
+
+def run_benchmark(args) -> dict:
+    calls = args.jobs * args.cases
+    print(f"Memoization benchmark: {args.jobs} parallel jobs x {args.cases} cases of "
+          f"{args.duration * 1000:g}ms, then a rerun")
+    print(f"  One {args.pool} worker x {args.concurrency}; dispatcher LRU of {args.max_entries} entries")
+    print("-" * 50)
+
+    try:
+        process = start_worker([BENCH_QUEUE], args.pool, args.concurrency, probe=noop_probe, hostname='bench-memo')
+    except Exception as e:
+        sys.exit(f"❌ Worker did not start ({type(e).__name__}: {e})")
+    results = {}
+    try:
+        for mode in MODES:
+            with tempfile.TemporaryDirectory() as store_dir:
+                memo_config = {**(config.get('memoization') or {}), 'enabled': mode == 'on',
+                               'store_dir': store_dir, 'max_entries': args.max_entries}
+                for name in PASSES:
+                    results[(mode, name)] = run_pass(memo_config, args)
+                    print(f"  {mode} / {name}: {results[(mode, name)]['messages']} messages for {calls} calls")
+    finally:
+        stop_worker(process)
+
+    print("-" * 50)
+    print(f"  {'mode':<4} {'pass':<10} {'calls':>6} {'messages':>9} {'hits':>6} {'store hits':>11} "
+          f"{'coalesced':>10} {'evictions':>10} {'errors':>7} {'seconds':>8}")
+    for (mode, name), result in results.items():
+        counters = result['counters']
+        print(f"  {mode:<4} {name:<10} {calls:>6} {result['messages']:>9} {counters['hits']:>6} "
+              f"{counters['store_hits']:>11} {counters['coalesced']:>10} "
+              f"{counters['evictions'] + counters['store_evictions']:>10} {result['errors']:>7} "
+              f"{result['seconds']:>8.2f}")
+    print("  (seconds: slowest job from first submit to last result)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure broker and worker load saved by memoizing idempotent tasks')
+    parser.add_argument('--cases', type=int, default=200,
+                        help='Distinct calls in the job matrix (default: 200)')
+    parser.add_argument('--jobs', '-j', type=int, default=3,
+                        help='Parallel dispatcher processes running the matrix (default: 3)')
+    parser.add_argument('--duration', type=float, default=0.05,
+                        help='Seconds of simulated work per call (default: 0.05)')
+    parser.add_argument('--max-entries', type=int, default=10000,
+                        help='Per-dispatcher LRU size (default: 10000)')
+    parser.add_argument('--pool', '-P', default='threads',
+                        help='Worker pool (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                        help='Worker concurrency (default: 8)')
+    parser.add_argument('--startup', type=float, default=3.0,
+                        help='Seconds allowed for the job processes to start before they submit (default: 3)')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds each job waits for its results (default: 300)')
+    run_benchmark(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Worker pool comparison benchmark.
+
+Starts a local worker per pool type (prefork, threads, gevent) through
+worker.py, runs the same task_a workload against each on a dedicated queue
+and reports throughput, send -> result latency percentiles and the resident
+memory of the worker's process tree. The demo tasks wait rather than compute,
+like most real test tasks, which is where the pools differ most.
+
+The workers connect to the broker configured for celery_app (BROKER_URL or
+test-config.yml); any workers already running are unaffected because the
+benchmark uses its own queue.
+"""
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+import time
+from itertools import repeat
+
+from celery_app import app, simulated_work, task_a
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from publisher import dispatch_many
+
+BENCH_QUEUE = 'bench_pools'
+POOLS = ['prefork', 'threads', 'gevent']
+POOL_MODULES = {'gevent': 'gevent', 'eventlet': 'eventlet'}
+
+def pool_available(pool: str) -> bool:
+    module = POOL_MODULES.get(pool)
+    return module is None or importlib.util.find_spec(module) is not None
+
+def process_tree_rss(pid: int):
+    """Return (total RSS in MB, process count) for `pid` and its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields after ')' are fixed
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total_kb = count = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+        count += 1
+        stack.extend(children.get(current, []))
+    return total_kb / 1024, count
+
+class RssSampler(threading.Thread):
+    """Sample a worker's process-tree RSS in the background and keep the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.processes = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss_mb, processes = process_tree_rss(self.pid)
+            if rss_mb > self.peak_mb:
+                self.peak_mb, self.processes = rss_mb, processes
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def noop_probe(queue: str):
+    """Startup probe: a zero-second simulated_work task on `queue`."""
+    return simulated_work.apply_async((0,), queue=queue)
+
+def start_worker(queues, pool: str, concurrency: int, env: dict = None, probe=None, probe_queues=None,
+                 hostname: str = None, startup_timeout: float = 60.0):
+    """
+    Start a worker through worker.py and wait until it has run one task from each probe queue.
+
+    `queues` is a list (or a comma-separated string) passed to worker.py,
+    `env` is added to this process's environment (e.g. TEST_CONFIG), and
+    `probe(queue)` sends one task to a queue and returns its AsyncResult
+    (default: task_a). Probes go to `probe_queues`, default `queues`.
+    """
+    queues = queues.split(',') if isinstance(queues, str) else list(queues)
+    probe = probe or (lambda queue: task_a.apply_async(queue=queue))
+    command = [sys.executable, 'worker.py', ','.join(queues), '--pool', pool, '--concurrency', str(concurrency),
+               '--loglevel=warning', f'--hostname={hostname or f"bench-{pool}"}@%h']
+    process = subprocess.Popen(command, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for queue in probe_queues or queues:
+            probe(queue).get(timeout=startup_timeout)
+    except Exception:
+        stop_worker(process)
+        raise
+    return process
+
+def stop_worker(process, timeout: float = 30.0):
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def run_workload(num_tasks: int, timeout: float):
+    """Send `num_tasks` task_a messages up front and collect them in completion order."""
+    latency = LatencyHistogram()
+    collector = ResultCollector(app)
+    errors = 0
+    start_time = time.perf_counter()
+    dispatch_many(task_a, repeat((), num_tasks), queue=BENCH_QUEUE, on_sent=collector.add)
+    for completed in collector.iter_completed(timeout=timeout):
+        if completed.status == 'success':
+            latency.record((completed.received_at - completed.sent_at) * 1e6)
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - start_time
+    return latency, errors, elapsed
+
+def run_benchmark(pools: list, num_tasks: int, concurrency: int, timeout: float):
+    print(f"Pool benchmark: {num_tasks} task_a tasks per pool, concurrency {concurrency}, queue '{BENCH_QUEUE}'")
+    print("-" * 50)
+    rows = []
+    for pool in pools:
+        if not pool_available(pool):
+            print(f"  {pool}: skipped ({POOL_MODULES[pool]} is not installed)")
+            continue
+        print(f"  {pool}: starting worker...")
+        try:
+            process = start_worker([BENCH_QUEUE], pool, concurrency)
+        except Exception as e:
+            print(f"  {pool}: worker did not start ({type(e).__name__}: {e})")
+            continue
+        sampler = RssSampler(process.pid)
+        sampler.start()
+        try:
+            latency, errors, elapsed = run_workload(num_tasks, timeout)
+        finally:
+            sampler.stop()
+            stop_worker(process)
+        rows.append((pool, latency, errors, elapsed, sampler.peak_mb, sampler.processes))
+
+    print("-" * 50)
+    print(f"  {'pool':<8} {'tasks/sec':>10} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} "
+          f"{'RSS MB':>8} {'procs':>6} {'MB/slot':>8} {'errors':>7}")
+    for pool, latency, errors, elapsed, rss_mb, processes in rows:
+        s = latency.summary()
+        print(f"  {pool:<8} {s['count'] / elapsed:>10.1f} {s['p50_ms']:>8.1f} {s['p90_ms']:>8.1f} "
+              f"{s['p99_ms']:>8.1f} {s['max_ms']:>8.1f} {rss_mb:>8.1f} {processes:>6} "
+              f"{rss_mb / concurrency:>8.2f} {errors:>7}")
+    print("  (latencies in ms, send -> result; RSS is the peak of the worker's whole process tree)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare worker pool types on the same workload')
+    parser.add_argument('--pools', default=','.join(POOLS),
+                        help=f"Comma-separated pools to compare (default: {','.join(POOLS)})")
+    parser.add_argument('--tasks', '-t', type=int, default=400,
+                        help='Tasks to run per pool (default: 400)')
+    parser.add_argument('--concurrency', '-c', type=int, default=20,
+                        help='Worker concurrency for every pool (default: 20)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for each run to complete (default: 60)')
+    args = parser.parse_args()
+    run_benchmark(args.pools.split(','), args.tasks, args.concurrency, args.timeout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Priority lanes benchmark.
+
+Fills a local worker with a saturating backlog of low-priority tasks, then
+sends a steady stream of high-priority tasks while the backlog drains, and
+reports the send -> result latency of the high-priority tasks and the rate
+at which low-priority tasks still complete meanwhile. Runs twice:
+
+  fifo   one plain queue: high tasks wait behind the whole backlog
+  lanes  the queue split into the lanes of the `priorities` section, with
+         the worker's weighted fair scheduling (see priorities.py)
+
+Each worker loads its settings from a temporary copy of test-config.yml,
+through the same path the real workers use.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+from bench_pools import noop_probe, start_worker, stop_worker
+from celery_app import app, config, simulated_work
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from priorities import LaneRouter
+from publisher import dispatch_many, pooled_producer
+
+BENCH_QUEUE = 'bench_priorities'
+MODES = ('fifo', 'lanes')
+
+def write_mode_config(directory: str, priorities_config: dict) -> str:
+    """Write a copy of the loaded config with `priorities_config` as its priorities section."""
+    path = os.path.join(directory, 'test-config.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump({**config, 'priorities': priorities_config}, f, sort_keys=False)
+    return path
+
+def run_mode(router: LaneRouter, lanes: tuple, args) -> dict:
+    """Send the low backlog, then the high stream, and collect everything."""
+    high_lane, low_lane = lanes
+    high_latency = LatencyHistogram()
+    collector = ResultCollector(app)
+    completed = []
+    errors = 0
+
+    dispatch_many(simulated_work, ((args.duration,) for _ in range(args.low)),
+                  queue=router.queue_for(BENCH_QUEUE, low_lane), on_sent=lambda r: collector.add(r, label='low'))
+
+    interval = 1.0 / args.rate
+    high_queue = router.queue_for(BENCH_QUEUE, high_lane)
+    stream_start = time.perf_counter()
+    with pooled_producer(app) as (producer, _):
+        for i in range(args.high):
+            collector.add(simulated_work.apply_async((args.duration,), queue=high_queue, producer=producer),
+                          label='high')
+            # Keep draining replies between sends so receive times are not held back
+            next_send = stream_start + (i + 1) * interval
+            while time.perf_counter() < next_send:
+                completed += collector.drain(timeout=next_send - time.perf_counter())
+    stream_end = time.perf_counter()
+    completed += collector.iter_completed(timeout=args.timeout)
+
+    low_during_stream = 0
+    for result in completed:
+        if result.status != 'success':
+            errors += 1
+        elif result.label == 'high':
+            high_latency.record((result.received_at - result.sent_at) * 1e6)
+        elif stream_start <= result.received_at <= stream_end:
+            low_during_stream += 1
+
+    summary = high_latency.summary()
+    return {
+        'high_p50_ms': summary['p50_ms'],
+        'high_p99_ms': summary['p99_ms'],
+        'low_rate': low_during_stream / (stream_end - stream_start),
+        'errors': errors,
+    }
+
+def run_benchmark(args) -> dict:
+    priorities_config = config.get('priorities') or {}
+    lane_names = list(priorities_config.get('lanes') or {})
+    if len(lane_names) < 2:
+        sys.exit("❌ bench_priorities.py needs at least two lanes in the priorities section of test-config.yml")
+    lanes = (lane_names[0], lane_names[-1])
+    capacity = args.concurrency / args.duration
+    print(f"Priority benchmark: {args.low} x {args.duration * 1000:g}ms '{lanes[1]}' tasks as backlog, then "
+          f"{args.high} '{lanes[0]}' tasks at {args.rate:g}/s")
+    print(f"  One {args.pool} worker x {args.concurrency} (~{capacity:.0f} tasks/s, "
+          f"backlog ~{args.low / capacity:.1f}s of work)")
+    print("-" * 50)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in MODES:
+            mode_config = {**priorities_config, 'queues': [BENCH_QUEUE] if mode == 'lanes' else []}
+            router = LaneRouter({}, mode_config)
+            queues = sorted({router.queue_for(BENCH_QUEUE, lane) for lane in lane_names})
+            try:
+                process = start_worker([BENCH_QUEUE], args.pool, args.concurrency, hostname='bench-priorities',
+                                       env={'TEST_CONFIG': write_mode_config(directory, mode_config)},
+                                       probe=noop_probe, probe_queues=queues)
+            except Exception as e:
+                print(f"  {mode}: worker did not start ({type(e).__name__}: {e})")
+                continue
+            try:
+                results[mode] = run_mode(router, lanes, args)
+            finally:
+                stop_worker(process)
+            print(f"  {mode}: high p99 {results[mode]['high_p99_ms']:.0f}ms")
+
+    print("-" * 50)
+    print(f"  {'mode':<6} {'high p50':>9} {'high p99':>9} {'low tasks/s':>12} {'errors':>7}")
+    for mode, result in results.items():
+        print(f"  {mode:<6} {result['high_p50_ms']:>9.0f} {result['high_p99_ms']:>9.0f} "
+              f"{result['low_rate']:>12.1f} {result['errors']:>7}")
+    print("  (latencies in ms, send -> result; low tasks/s = low-priority completions during the high stream)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure high-priority latency under a low-priority backlog')
+    parser.add_argument('--low', type=int, default=2000,
+                        help='Low-priority backlog size (default: 2000)')
+    parser.add_argument('--high', type=int, default=100,
+                        help='High-priority tasks in the stream (default: 100)')
+    parser.add_argument('--rate', type=float, default=20.0,
+                        help='High-priority tasks sent per second (default: 20)')
+    parser.add_argument('--duration', type=float, default=0.02,
+                        help='Seconds of simulated work per task (default: 0.02)')
+    parser.add_argument('--pool', '-P', default='threads',
+                        help='Worker pool (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                        help='Worker concurrency (default: 8)')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds to wait for each run to complete (default: 300)')
+    run_benchmark(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
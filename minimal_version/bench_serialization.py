@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark for task and result messages.
+Reports bytes per message and encode/decode cost per message for every
+serializer x compression combination available in this environment
+(serializer only for results, which the rpc:// backend never compresses).
+"""
+import time
+import uuid
+from datetime import datetime, timezone
+
+from kombu import compression
+from kombu.serialization import dumps, loads, registry
+
+from celery_app import register_lz4
+
+SERIALIZERS = ['json', 'msgpack']
+COMPRESSIONS = [None, 'zlib', 'bzip2', 'lzma', 'lz4', 'zstd', 'brotli']
+
+def result_meta(result):
+    """Result message body as published by the rpc backend."""
+    return {
+        'task_id': str(uuid.uuid4()),
+        'status': 'SUCCESS',
+        'result': result,
+        'traceback': None,
+        'children': [],
+        'date_done': datetime.now(timezone.utc).isoformat(),
+    }
+
+def extended_result(queue: str = 'queue_a'):
+    """Result returned by the extended version's tasks."""
+    return {
+        'message': 'Hello from Task A',
+        'task_id': str(uuid.uuid4()),
+        'worker_id': 'worker-a',
+        'execution_time': 0.501,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'queue': queue,
+    }
+
+def sample_payloads(batch_size: int):
+    """Representative message bodies, keyed by description."""
+    minimal_result = {"result": "Hello from Task A", "execution_time": 0.1012, "task": "A", "retry_count": 0}
+    return {
+        'task message (no args)': ((), {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}),
+        'minimal result': result_meta(minimal_result),
+        'extended result': result_meta(extended_result()),
+        f'batch result x{batch_size}': result_meta({
+            'results': [extended_result() for _ in range(batch_size)],
+            'errors': [],
+        }),
+    }
+
+def available_compressions():
+    try:
+        register_lz4()
+    except RuntimeError:
+        pass
+    available = []
+    for name in COMPRESSIONS:
+        if name is None:
+            available.append(None)
+            continue
+        try:
+            compression.get_encoder(name)
+        except KeyError:
+            continue
+        available.append(name)
+    return available
+
+def measure(payload, serializer: str, compression_name, iterations: int):
+    """Return (bytes, encode_us, decode_us) for one combination."""
+    def encode():
+        content_type, encoding, body = dumps(payload, serializer=serializer)
+        if compression_name:
+            body, compressed_type = compression.compress(body, compression_name)
+        else:
+            compressed_type = None
+        return content_type, encoding, body, compressed_type
+
+    content_type, encoding, body, compressed_type = encode()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode()
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        data = compression.decompress(body, compressed_type) if compressed_type else body
+        loads(data, content_type, encoding, accept=[content_type])
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    return len(body), encode_us, decode_us
+
+def run_benchmark(iterations: int = 2000, batch_size: int = 20):
+    serializers = [name for name in SERIALIZERS if name in registry._encoders]
+    compressions = available_compressions()
+    print(f"Serializers: {', '.join(serializers)}")
+    print(f"Compression: {', '.join(c or 'none' for c in compressions)}")
+    print(f"Iterations per combination: {iterations}")
+
+    for description, payload in sample_payloads(batch_size).items():
+        baseline = None
+        print(f"\n{description}")
+        print(f"  {'serializer':<10} {'compression':<11} {'bytes':>8} {'vs json':>8} {'encode us':>10} {'decode us':>10}")
+        # Only task messages can be compressed: the rpc:// backend publishes results uncompressed
+        candidates = compressions if description.startswith('task message') else [None]
+        for serializer in serializers:
+            for compression_name in candidates:
+                size, encode_us, decode_us = measure(payload, serializer, compression_name, iterations)
+                baseline = baseline or size
+                print(f"  {serializer:<10} {compression_name or 'none':<11} {size:>8} {size / baseline:>7.0%} "
+                      f"{encode_us:>10.1f} {decode_us:>10.1f}")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Compare message serializers and compression')
+    parser.add_argument('--iterations', '-n', type=int, default=2000,
+                       help='Encode/decode iterations per combination (default: 2000)')
+    parser.add_argument('--batch-size', type=int, default=20,
+                       help='Results in the batch-result sample payload (default: 20)')
+    args = parser.parse_args()
+    run_benchmark(args.iterations, args.batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Queue sharding benchmark.
+
+For each shard count, starts a local worker (through worker.py) consuming
+every shard of a dedicated benchmark queue, publishes no-op tasks through
+ShardRouter with the chosen strategy, and reports publish rate, end-to-end
+completion rate, send -> result latency and how evenly the tasks spread
+over the shards.
+
+The gain from sharding comes from the broker: each RabbitMQ queue is one
+Erlang process, so a single queue saturates one broker core. Run it against
+the real broker (BROKER_URL or test-config.yml) to see that limit; a broker on
+a laptop with a single publisher mostly shows the client's own cost.
+"""
+import argparse
+import time
+from collections import Counter
+
+from bench_pools import noop_probe, start_worker, stop_worker
+from celery_app import app, simulated_work
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from publisher import pooled_producer
+from sharding import STRATEGIES, ShardRouter, shard_names
+
+BENCH_QUEUE = 'bench_sharding'
+
+def run_shard_count(shards: int, strategy: str, num_tasks: int, timeout: float) -> dict:
+    """Publish `num_tasks` tasks over `shards` shards and collect every result."""
+    router = ShardRouter(app, {}, {BENCH_QUEUE: {'shards': shards, 'strategy': strategy}})
+    latency = LatencyHistogram()
+    collector = ResultCollector(app)
+    per_shard = Counter()
+    errors = 0
+
+    start_time = time.perf_counter()
+    with pooled_producer(app) as (producer, _):
+        for i in range(num_tasks):
+            queue = router.queue_for(BENCH_QUEUE, key=f'device-{i % 997}')
+            per_shard[queue] += 1
+            collector.add(simulated_work.apply_async((0,), queue=queue, producer=producer))
+    publish_time = time.perf_counter() - start_time
+
+    for completed in collector.iter_completed(timeout=timeout):
+        if completed.status == 'success':
+            latency.record((completed.received_at - completed.sent_at) * 1e6)
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - start_time
+
+    summary = latency.summary()
+    counts = [per_shard[queue] for queue in shard_names(BENCH_QUEUE, shards)]
+    return {
+        'shards': shards,
+        'publish_rate': num_tasks / publish_time,
+        'throughput': summary['count'] / elapsed,
+        'p50_ms': summary['p50_ms'],
+        'p99_ms': summary['p99_ms'],
+        'spread': max(counts) / min(counts) if min(counts) else float('inf'),
+        'errors': errors,
+    }
+
+def run_benchmark(shard_counts: list, strategy: str, num_tasks: int, pool: str, concurrency: int, timeout: float):
+    print(f"Sharding benchmark: {num_tasks} no-op tasks per run, {strategy} routing, "
+          f"one {pool} worker x {concurrency} consuming every shard")
+    print("-" * 50)
+    results = []
+    for shards in shard_counts:
+        queues = shard_names(BENCH_QUEUE, shards)
+        try:
+            process = start_worker(queues, pool, concurrency, probe=noop_probe,
+                                   hostname=f'bench-sharding-{len(queues)}')
+        except Exception as e:
+            print(f"  {shards} shards: worker did not start ({type(e).__name__}: {e})")
+            continue
+        try:
+            results.append(run_shard_count(shards, strategy, num_tasks, timeout))
+        finally:
+            stop_worker(process)
+        print(f"  {shards} shards: {results[-1]['throughput']:.0f} tasks/sec")
+
+    if not results:
+        return results
+    baseline = results[0]['throughput']
+    print("-" * 50)
+    print(f"  {'shards':>6} {'publish/s':>10} {'tasks/s':>9} {'speedup':>8} {'p50':>8} {'p99':>8} {'spread':>7} {'errors':>7}")
+    for result in results:
+        print(f"  {result['shards']:>6} {result['publish_rate']:>10.0f} {result['throughput']:>9.0f} "
+              f"{result['throughput'] / baseline:>7.2f}x {result['p50_ms']:>8.0f} {result['p99_ms']:>8.0f} "
+              f"{result['spread']:>7.2f} {result['errors']:>7}")
+    print("  (latencies in ms, send -> result; spread = busiest / quietest shard)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure throughput as a queue is split into more shards')
+    parser.add_argument('--shards', '-s', default='1,2,4,8',
+                        help='Comma-separated shard counts to compare (default: 1,2,4,8)')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='round_robin',
+                        help='Shard choice (default: round_robin)')
+    parser.add_argument('--tasks', '-t', type=int, default=2000,
+                        help='Tasks per shard count (default: 2000)')
+    parser.add_argument('--pool', '-P', default='threads',
+                        help='Worker pool (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=16,
+                        help='Worker concurrency (default: 16)')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds to wait for each run to complete (default: 300)')
+    args = parser.parse_args()
+    run_benchmark([int(count) for count in args.shards.split(',')], args.strategy, args.tasks,
+                  args.pool, args.concurrency, args.timeout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Worker tuning sweep.
+
+Runs the workload mix declared in `worker_tuning.sweep` (test-config.yml)
+against a local worker for every combination of prefetch multiplier x
+concurrency x acks_late, and records throughput and send -> result latency
+percentiles per cell. Prints a comparison table and the best cell as a
+profile ready for `worker_tuning.profiles`, and writes the table as CSV and
+JSON.
+
+Each cell's worker loads its settings as a named profile from a temporary
+copy of test-config.yml, through the same path the real workers use.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import yaml
+
+from bench_pools import noop_probe, start_worker, stop_worker
+from celery_app import app, config, simulated_work
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from publisher import dispatch_many
+
+BENCH_QUEUE = 'bench_tuning'
+PROFILE_NAME = 'sweep'
+
+def workload_durations(workload: list, num_tasks: int, seed: int = 0) -> list:
+    """Task durations (seconds) in a fixed shuffled order matching the declared ratios."""
+    total_ratio = sum(item['ratio'] for item in workload)
+    durations = []
+    for item in workload:
+        count = round(num_tasks * item['ratio'] / total_ratio)
+        durations += [item['duration_ms'] / 1000] * count
+    random.Random(seed).shuffle(durations)
+    return durations
+
+def write_cell_config(directory: str, cell: dict) -> str:
+    """Write a copy of the loaded config whose active profile is `cell`."""
+    cell_config = dict(config)
+    tuning = dict(cell_config.get('worker_tuning') or {})
+    tuning['profiles'] = {**(tuning.get('profiles') or {}), PROFILE_NAME: cell}
+    tuning['profile'] = PROFILE_NAME
+    cell_config['worker_tuning'] = tuning
+    path = os.path.join(directory, 'test-config.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(cell_config, f)
+    return path
+
+
+def run_cell(durations: list, timeout: float):
+    """Send the whole workload up front and collect it in completion order."""
+    latency = LatencyHistogram()
+    collector = ResultCollector(app)
+    errors = 0
+    start_time = time.perf_counter()
+    dispatch_many(simulated_work, ((duration,) for duration in durations), queue=BENCH_QUEUE,
+                  on_sent=collector.add)
+    for completed in collector.iter_completed(timeout=timeout):
+        if completed.status == 'success':
+            latency.record((completed.received_at - completed.sent_at) * 1e6)
+        else:
+            errors += 1
+    return latency, errors, time.perf_counter() - start_time
+
+def run_sweep(sweep: dict, num_tasks: int, timeout: float) -> list:
+    pool = sweep.get('pool', 'prefork')
+    durations = workload_durations(sweep['workload'], num_tasks)
+    grid = list(itertools.product(sweep['prefetch_multiplier'], sweep['concurrency'], sweep['acks_late']))
+    mix = ', '.join(f"{item['ratio']:g} x {item['duration_ms']}ms" for item in sweep['workload'])
+    ideal = sum(durations)
+    print(f"Tuning sweep: {len(grid)} cells, {len(durations)} tasks per cell ({mix}), {pool} pool")
+    print(f"  Serial work per cell: {ideal:.1f}s")
+    print("-" * 50)
+
+    cells = []
+    with tempfile.TemporaryDirectory() as directory:
+        for prefetch, concurrency, acks_late in grid:
+            cell = {'prefetch_multiplier': prefetch, 'concurrency': concurrency, 'acks_late': acks_late}
+            label = f"prefetch={prefetch} concurrency={concurrency} acks_late={acks_late}"
+            try:
+                process = start_worker([BENCH_QUEUE], pool, concurrency, hostname='bench-tuning',
+                                       env={'TEST_CONFIG': write_cell_config(directory, cell),
+                                            'WORKER_PROFILE': PROFILE_NAME},
+                                       probe=noop_probe)
+            except Exception as e:
+                print(f"  {label}: worker did not start ({type(e).__name__}: {e})")
+                continue
+            try:
+                latency, errors, elapsed = run_cell(durations, timeout)
+            finally:
+                stop_worker(process)
+            summary = latency.summary()
+            cells.append({
+                **cell,
+                'throughput': summary['count'] / elapsed,
+                'p50_ms': summary['p50_ms'],
+                'p99_ms': summary['p99_ms'],
+                'max_ms': summary['max_ms'],
+                'errors': errors,
+                'elapsed_s': elapsed,
+            })
+            print(f"  {label}: {cells[-1]['throughput']:.1f} tasks/sec, p99 {summary['p99_ms']:.0f}ms")
+    return cells
+
+def best_cell(cells: list, objective: str) -> dict:
+    """Highest throughput (or lowest p99) among cells without errors."""
+    candidates = [cell for cell in cells if not cell['errors']] or cells
+    if objective == 'p99':
+        return min(candidates, key=lambda cell: (cell['p99_ms'], -cell['throughput']))
+    return max(candidates, key=lambda cell: (cell['throughput'], -cell['p99_ms']))
+
+def print_table(cells: list, best: dict):
+    print("-" * 50)
+    print(f"  {'prefetch':>8} {'conc':>5} {'acks_late':>9} {'tasks/sec':>10} {'p50':>8} {'p99':>8} {'max':>8} {'errors':>7}")
+    for cell in cells:
+        marker = '  <- best' if cell is best else ''
+        print(f"  {cell['prefetch_multiplier']:>8} {cell['concurrency']:>5} {str(cell['acks_late']):>9} "
+              f"{cell['throughput']:>10.1f} {cell['p50_ms']:>8.0f} {cell['p99_ms']:>8.0f} {cell['max_ms']:>8.0f} "
+              f"{cell['errors']:>7}{marker}")
+    print("  (latencies in ms, send -> result)")
+
+def write_results(cells: list, best: dict, sweep: dict, output: str):
+    fields = ['prefetch_multiplier', 'concurrency', 'acks_late', 'throughput', 'p50_ms', 'p99_ms',
+              'max_ms', 'errors', 'elapsed_s']
+    with open(f'{output}.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(cells)
+    with open(f'{output}.json', 'w') as f:
+        json.dump({'sweep': sweep, 'cells': cells, 'best': best}, f, indent=2)
+    print(f"📄 Results saved to: {output}.csv, {output}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep prefetch x concurrency x acks_late against a workload mix')
+    parser.add_argument('--tasks', '-t', type=int, default=None,
+                        help='Tasks per cell (default: worker_tuning.sweep.tasks in test-config.yml)')
+    parser.add_argument('--objective', choices=['throughput', 'p99'], default='throughput',
+                        help='How the best cell is chosen (default: throughput)')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds to wait for each cell to complete (default: 300)')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Output path without extension (default: tuning_sweep_<timestamp>)')
+    args = parser.parse_args()
+
+    sweep = (config.get('worker_tuning') or {}).get('sweep')
+    if not sweep:
+        sys.exit("❌ No worker_tuning.sweep section in test-config.yml")
+    cells = run_sweep(sweep, args.tasks or sweep.get('tasks', 200), args.timeout)
+    if not cells:
+        sys.exit("❌ No cell completed")
+
+    best = best_cell(cells, args.objective)
+    print_table(cells, best)
+    print(f"\nBest by {args.objective} - add to worker_tuning.profiles in test-config.yml:")
+    print(yaml.safe_dump({'tuned': {key: best[key] for key in ('prefetch_multiplier', 'concurrency', 'acks_late')}},
+                         default_flow_style=False, sort_keys=False))
+    write_results(cells, best, sweep, args.output or f"tuning_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+if __name__ == '__main__':
+    main()
@@ -3,24 +3,96 @@ Minimal Celery application with two tasks and routing.
 Uses test-config.yml for configuration.
 Includes basic monitoring.
 """
+import hashlib
 import os
-import yaml
 import time
-from celery import Celery
+from celery import Celery, group, signals
 from celery.exceptions import Retry
+from kombu import compression
+
+import artifacts
+from config_cache import load_yaml
+import priorities
+import protection
+import suites
+from sharding import ShardRouter
+
+CONFIG_FILE = os.getenv('TEST_CONFIG', 'test-config.yml')
 
 def load_config():
-    """Load configuration from test-config.yml."""
-    config_file = 'test-config.yml'
+    """Load configuration from test-config.yml (or the file named by TEST_CONFIG), via the config cache."""
+    config_file = CONFIG_FILE
     if not os.path.exists(config_file):
         raise FileNotFoundError(f"Configuration file {config_file} not found. Cannot start application.")
     
     try:
-        with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+        return load_yaml(config_file)
     except Exception as e:
         raise RuntimeError(f"Failed to load {config_file}: {e}")
 
+def register_lz4():
+    """Register lz4 frame compression with kombu (optional dependency)."""
+    try:
+        import lz4.frame
+    except ImportError:
+        raise RuntimeError("lz4 compression is configured in test-config.yml but the lz4 package is not installed")
+    compression.register(lz4.frame.compress, lz4.frame.decompress, 'application/x-lz4', aliases=['lz4'])
+
+def serialization_settings(config):
+    """
+    Build Celery settings from the `serialization` section of test-config.yml.
+    Per-route serializer/compression is applied to task messages through task
+    annotations; results share one serializer for all tasks. The rpc://
+    result backend publishes results uncompressed, so a results compression
+    is rejected rather than silently ignored.
+    """
+    serialization = config.get('serialization') or {}
+    results = serialization.get('results') or {}
+    if results.get('compression'):
+        raise RuntimeError("serialization.results.compression is not supported: the rpc:// result backend "
+                           "does not compress results (compress task messages per route instead)")
+    result_serializer = results.get('serializer', 'json')
+    annotations = {}
+    serializers = {'json', result_serializer}
+    compressions = set()
+    for task, options in (serialization.get('routes') or {}).items():
+        options = {key: options[key] for key in ('serializer', 'compression') if options.get(key)}
+        if options:
+            annotations[f'celery_app.{task}'] = options
+            serializers.add(options.get('serializer', 'json'))
+            compressions.add(options.get('compression'))
+    if 'lz4' in compressions:
+        register_lz4()
+    return {
+        'task_annotations': annotations,
+        'accept_content': sorted(serializers),
+        'result_serializer': result_serializer,
+    }
+
+# Profile keys in test-config.yml -> Celery settings
+TUNING_SETTINGS = {
+    'prefetch_multiplier': 'worker_prefetch_multiplier',
+    'acks_late': 'task_acks_late',
+    'max_tasks_per_child': 'worker_max_tasks_per_child',
+    'concurrency': 'worker_concurrency',
+}
+
+def tuning_settings(config):
+    """
+    Build worker settings from the active profile in the `worker_tuning` section.
+    The profile is named by the WORKER_PROFILE environment variable, falling back
+    to `worker_tuning.profile`; settings a profile leaves out keep their defaults.
+    """
+    tuning = config.get('worker_tuning') or {}
+    name = os.getenv('WORKER_PROFILE') or tuning.get('profile')
+    if not name:
+        return {}
+    profiles = tuning.get('profiles') or {}
+    if name not in profiles:
+        raise RuntimeError(f"Worker tuning profile '{name}' not found in worker_tuning.profiles")
+    profile = profiles[name] or {}
+    return {setting: profile[key] for key, setting in TUNING_SETTINGS.items() if key in profile}
+
 # Load configuration (required)
 config = load_config()
 
@@ -37,6 +109,12 @@ else:
     # Use config for host connections (for dispatch.py running on host)
     broker_url = f"pyamqp://{rabbitmq_config['username']}@{rabbitmq_config['host']}:{rabbitmq_config['port']}//"
 
+broker_settings = {'broker_url': broker_url}
+# Docker-free runs (bench_local.py): a filesystem broker under LOCAL_BROKER_DIR instead
+if os.getenv('LOCAL_BROKER_DIR'):
+    import local_broker
+    broker_settings = local_broker.broker_settings(os.getenv('LOCAL_BROKER_DIR'))
+
 # Build task routes from config
 task_routes = {
     f'celery_app.{task}': {'queue': queue} 
@@ -45,19 +123,66 @@ task_routes = {
 
 # Celery configuration
 app = Celery('minimal_test_system')
+
+# Tasks of laned queues go to the lane in their `lane` option, tasks of
+# sharded queues to one shard; everything else by task_routes
+lane_router = priorities.LaneRouter(config['task_routing'], config.get('priorities'), config.get('sharding'))
+shard_router = ShardRouter(app, config['task_routing'], config.get('sharding'))
+if lane_router.queues:
+    priorities.install(app, config['priorities'])
+
+# Circuit breakers and rate limiters of task_a / task_b, shared by the pool's processes
+if (config.get('protection') or {}).get('enabled'):
+    protection.install(config['protection'], lanes=lane_router.lanes)
+
 app.conf.update(
-    broker_url=broker_url,
+    **broker_settings,
     result_backend='rpc://',
-    task_routes=task_routes,
+    task_routes=(lane_router, shard_router, task_routes),
     # Retry configuration from test-config.yml
     task_default_retry_delay=config['retry_config']['retry_delay'],
     task_max_retries=config['retry_config']['max_retries'],
     task_retry_jitter=config['retry_config']['retry_jitter'],
     task_retry_backoff=config['retry_config']['retry_backoff'],
     task_retry_backoff_max=config['retry_config']['retry_backoff_max'],
+    # Per-route message serialization from test-config.yml
+    **serialization_settings(config),
+    # Prefetch / acks / recycling from the active worker_tuning profile
+    **tuning_settings(config),
 )
 
-@app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': config['retry_config']['max_retries'], 'countdown': 5})
+@signals.before_task_publish.connect
+def stamp_publish_time(headers=None, **kwargs):
+    """Stamp every task message with its publish time (wall clock)."""
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+@signals.task_received.connect
+def stamp_receive_time(request=None, **kwargs):
+    """Record when the worker received the message; travels with the request to the pool."""
+    request.request_dict['received_at'] = time.time()
+
+def task_timeline(request, started_at: float) -> dict:
+    """Wall-clock publish/receive/start/finish times, returned with the task's result."""
+    return {
+        'published_at': getattr(request, 'published_at', None),
+        'received_at': getattr(request, 'received_at', None),
+        'started_at': started_at,
+        'finished_at': time.time(),
+    }
+
+def inject_fault(task_name: str, attempt: int):
+    """Fail like a broken downstream dependency, as set in the `fault_injection` section."""
+    faults = config.get('fault_injection') or {}
+    if not faults.get('enabled') or task_name not in (faults.get('tasks') or []):
+        return
+    if faults.get('mode') == 'outage':
+        if os.path.exists(faults['outage_file']):
+            raise Exception("Simulated dependency outage")
+    elif attempt < faults.get('failed_attempts', 0):
+        raise Exception(f"Simulated failure on attempt {attempt + 1}")
+
+@app.task(bind=True, base=protection.ProtectedTask, autoretry_for=(Exception,), retry_kwargs={'max_retries': config['retry_config']['max_retries'], 'countdown': 5})
 def task_a(self):
     """Task A: Returns greeting message with retry mechanism."""
     start_time = time.time()
@@ -66,9 +191,8 @@ def task_a(self):
     # Simulate some work
     time.sleep(0.1)
     
-    # DEMO RETRY: Uncomment the lines below to demonstrate retry mechanism
-    # if retry_count < 2:
-    #     raise Exception(f"Simulated failure on attempt {retry_count + 1}")
+    # Fails here when fault injection is on (see the `fault_injection` section)
+    inject_fault('task_a', retry_count)
     
     result = "Hello from Task A"
     execution_time = time.time() - start_time
@@ -77,10 +201,11 @@ def task_a(self):
         "result": result, 
         "execution_time": execution_time, 
         "task": "A",
-        "retry_count": retry_count
+        "retry_count": retry_count,
+        "timeline": task_timeline(self.request, start_time)
     }
 
-@app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': config['retry_config']['max_retries'], 'countdown': 5})
+@app.task(bind=True, base=protection.ProtectedTask, autoretry_for=(Exception,), retry_kwargs={'max_retries': config['retry_config']['max_retries'], 'countdown': 5})
 def task_b(self):
     """Task B: Returns greeting message with retry mechanism."""
     start_time = time.time()
@@ -89,6 +214,8 @@ def task_b(self):
     # Simulate some work
     time.sleep(0.2)
     
+    inject_fault('task_b', retry_count)
+    
     result = "Hello from Task B"
     execution_time = time.time() - start_time
     
@@ -96,6 +223,104 @@ def task_b(self):
         "result": result, 
         "execution_time": execution_time, 
         "task": "B",
-        "retry_count": retry_count
+        "retry_count": retry_count,
+        "timeline": task_timeline(self.request, start_time)
+    }
+
+
+# Its result depends only on its arguments, so it may be memoized (see memo.py).
+# task_a and task_b return per-run data (execution time, retries, timeline) and may not.
+@app.task(idempotent=True)
+def simulated_work(duration: float, case: str = None):
+    """Benchmark task: waits `duration` seconds, like a test waiting on a device (`case` only names the call)."""
+    start_time = time.time()
+    time.sleep(duration)
+    return {"execution_time": time.time() - start_time}
+
+
+@app.task(bind=True)
+def run_batch(self, task_name, args_list):
+    """
+    Run many invocations of a task from a single broker message.
+    Returns one compact result array; failed invocations are reported by
+    index instead of failing (or retrying) the whole batch.
+    """
+    task = app.tasks[task_name]
+    results = []
+    errors = []
+    for index, args in enumerate(args_list):
+        try:
+            results.append(task(*args))
+        except Exception as e:
+            results.append(None)
+            errors.append([index, f"{type(e).__name__}: {e}"])
+    
+    return {"results": results, "errors": errors}
+
+
+# Large task inputs/outputs travel as claim checks on this store (see artifacts.py)
+artifact_store = artifacts.from_config(config)
+
+@app.task
+def flash_firmware(image, log_bytes: int = 0):
+    """
+    Large-payload task: hashes the firmware `image` (a claim check or an
+    inline payload from artifact_store.pack) through a memory map and returns
+    a `log_bytes` flashing log, claim-checked when it is large.
+    """
+    start_time = time.time()
+    with artifact_store.open(image) as data:
+        digest = hashlib.sha256(data).hexdigest()
+        size = len(data)
+    line = f"flashed {size} bytes, sha256 {digest}\n".encode()
+    log = (line * (log_bytes // len(line) + 1))[:log_bytes]
+    return {
+        "sha256": digest,
+        "size": size,
+        "log": artifact_store.pack(log),
+        "execution_time": time.time() - start_time,
     }
 
+suite_config = config.get('suites') or {}
+
+def suite_queue(task_name: str) -> str:
+    """Queue (lane/shard included) a chunk of `task_name` cases is sent to."""
+    return shard_router.queue_for(lane_router.queue_for(config['task_routing'][task_name.rsplit('.', 1)[-1]]))
+
+@app.task
+def run_cases(task_name, first_case, args_list):
+    """
+    Suite leaf: run a chunk of test cases of one task in this worker and
+    return their summary (counts, passed-case timing, failures) instead of
+    one result per case.
+    """
+    task = app.tasks[task_name]
+    outcomes = []
+    for args in args_list:
+        start_time = time.perf_counter()
+        try:
+            task(*args)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        outcomes.append((time.perf_counter() - start_time, error))
+    return suites.summarize(task_name, first_case, outcomes, suite_config.get('max_failures', 100))
+
+@app.task
+def run_suite(chunks, fanout):
+    """
+    Suite tree node: send the chunks to their task queues (or, if there are
+    more than `fanout`, split them between child run_suite nodes), wait for
+    the children and return their merged summary.
+    """
+    if len(chunks) <= fanout:
+        parts = [[chunk] for chunk in chunks]
+        children = group(run_cases.signature(chunk, queue=suite_queue(chunk[0])) for chunk in chunks)
+    else:
+        parts = suites.split(chunks, fanout)
+        children = group(run_suite.signature((part, fanout), queue=suite_config['reduce_queue']) for part in parts)
+    # rpc:// cannot run chords, so the node waits here, holding its reduce_queue slot
+    partials = children.apply_async().join_native(timeout=suite_config.get('timeout', 3600), propagate=False,
+                                                  disable_sync_subtasks=False)
+    return suites.merge((partial if suites.is_summary(partial) else suites.lost(part, partial)
+                         for partial, part in zip(partials, parts)), suite_config.get('max_failures', 100))
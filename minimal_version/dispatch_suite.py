@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Suite dispatcher: runs a large suite of test cases and receives only its
+aggregate and failures, reduced on the workers (see suites.py).
+
+  python dispatch_suite.py --cases task_a=5000,task_b=2000
+
+--flat runs the same suite the old way for comparison: one message per case,
+every result collected and aggregated here. Both report the dispatcher's
+CPU time and the number of result messages it had to receive.
+
+Needs a worker on the `suites.reduce_queue` queue (prefork, with a process
+for every reducer node of the tree) besides the queue_a / queue_b workers:
+
+  python worker.py suite_reduce
+
+The tree is checked against the concurrency the running reduce workers
+report (the `workers` section's, if none answer). That check holds for one
+suite at a time, so suites dispatched from this host wait for each other on
+a lock file; suites must not be started from several hosts at once.
+"""
+import argparse
+import fcntl
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import suites
+from celery_app import app, config, run_suite, suite_config, suite_queue
+from config_cache import CACHE_DIR
+from collector import ResultCollector
+from publisher import dispatch_many
+
+def parse_cases(value: str) -> list:
+    """'task_a=5000,task_b=2000' -> [(task name, count), ...]"""
+    counts = []
+    for item in value.split(','):
+        name, _, count = item.partition('=')
+        if name not in config['task_routing']:
+            raise argparse.ArgumentTypeError(f"unknown task '{name}' (choose from {', '.join(config['task_routing'])})")
+        counts.append((f'celery_app.{name}', int(count or 1)))
+    return counts
+
+def suite_cases(counts: list):
+    """The demo tasks take no arguments: one case is one call."""
+    for task_name, count in counts:
+        for _ in range(count):
+            yield task_name, ()
+
+def dispatcher_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def reduce_slots() -> int:
+    """Processes of the running workers consuming reduce_queue, or the configured concurrency if none answer."""
+    reduce_queue = suite_config['reduce_queue']
+    inspect = app.control.inspect(timeout=1.0)
+    consumers = {name for name, queues in (inspect.active_queues() or {}).items()
+                 if any(queue['name'] == reduce_queue for queue in queues)}
+    if consumers:
+        stats = inspect.stats() or {}
+        slots = sum(stats[name]['pool']['max-concurrency'] for name in consumers if name in stats)
+        if slots:
+            return slots
+    return suites.configured_slots(config.get('workers') or {}, reduce_queue)
+
+@contextmanager
+def suite_lock():
+    """Run one suite at a time on this host: concurrent trees could take every reducer slot between them."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, 'suite.lock'), 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("  Waiting for the suite already running on this host...")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def run_tree(counts: list, chunk_size: int, fanout: int, timeout: float) -> tuple:
+    """Send the suite as one run_suite task; returns (summary, result messages received)."""
+    chunks = suites.plan(suite_cases(counts), chunk_size)
+    suites.check_tree(len(chunks), fanout, reduce_slots())
+    print(f"  {len(chunks)} chunks of up to {chunk_size} cases, fanout {fanout}: "
+          f"{suites.tree_nodes(len(chunks), fanout)} reducer nodes, {suites.tree_depth(len(chunks), fanout)} levels")
+    with suite_lock():
+        result = run_suite.apply_async((chunks, fanout), queue=suite_config['reduce_queue'])
+        return result.get(timeout=timeout), 1
+
+def run_flat(counts: list, timeout: float) -> tuple:
+    """Send one message per case and aggregate every result here."""
+    collector = ResultCollector(app)
+    for task_name, count in counts:
+        dispatch_many(app.tasks[task_name], ((),) * count, queue=suite_queue(task_name),
+                      on_sent=lambda r, name=task_name: collector.add(r, label=name))
+    outcomes = {task_name: [] for task_name, _ in counts}
+    received = 0
+    for completed in collector.iter_completed(timeout=timeout):
+        received += 1
+        if completed.status == 'success':
+            outcomes[completed.label].append((completed.result['execution_time'], None))
+        else:
+            outcomes[completed.label].append((0.0, completed.error))
+    max_failures = suite_config.get('max_failures', 100)
+    return suites.merge((suites.summarize(name, 0, cases, max_failures) for name, cases in outcomes.items()),
+                        max_failures), received
+
+def display_summary(summary: dict):
+    for task_name, stats in summary['tasks'].items():
+        line = f"  {task_name.rsplit('.', 1)[-1]}: {stats['count']} cases, {stats['passed']} passed, {stats['failed']} failed"
+        if stats['passed']:
+            line += (f", execution avg {stats['total_time'] / stats['passed']:.3f}s"
+                     f" min {stats['min_time']:.3f}s max {stats['max_time']:.3f}s")
+        print(line)
+    if summary['failures']:
+        print("  Failures:")
+        for failure in summary['failures']:
+            cases = f"case {failure['case']}" if failure['count'] == 1 else \
+                f"cases {failure['case']}-{failure['case'] + failure['count'] - 1}"
+            print(f"    {failure['task'].rsplit('.', 1)[-1]} {cases}: {failure['error']}")
+    if summary['failures_dropped']:
+        print(f"    ... and {summary['failures_dropped']} more")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a test suite reduced on the workers')
+    parser.add_argument('--cases', type=parse_cases, default=parse_cases('task_a=1000,task_b=1000'),
+                        help='Cases per task, e.g. task_a=5000,task_b=2000 (default: task_a=1000,task_b=1000)')
+    parser.add_argument('--chunk-size', type=int, default=suite_config.get('chunk_size', 200),
+                        help='Cases per leaf task (default: suites.chunk_size)')
+    parser.add_argument('--fanout', type=int, default=suite_config.get('fanout', 8),
+                        help='Children per reducer node (default: suites.fanout)')
+    parser.add_argument('--flat', action='store_true',
+                        help='One message per case, aggregated by the dispatcher (for comparison)')
+    parser.add_argument('--timeout', type=float, default=suite_config.get('timeout', 3600),
+                        help='Seconds to wait for the suite (default: suites.timeout)')
+    args = parser.parse_args()
+
+    total = sum(count for _, count in args.cases)
+    mix = ', '.join(f"{name.rsplit('.', 1)[-1]} x {count}" for name, count in args.cases)
+    print(f"Suite: {total} cases ({mix}), {'flat' if args.flat else 'reduced on workers'}")
+    start_time = time.perf_counter()
+    cpu_start = dispatcher_cpu()
+    try:
+        if args.flat:
+            summary, received = run_flat(args.cases, args.timeout)
+        else:
+            summary, received = run_tree(args.cases, args.chunk_size, args.fanout, args.timeout)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    elapsed = time.perf_counter() - start_time
+    print("-" * 50)
+    display_summary(summary)
+    print("-" * 50)
+    print(f"  Suite time: {elapsed:.2f}s, dispatcher CPU {dispatcher_cpu() - cpu_start:.2f}s, "
+          f"result messages received: {received}")
+
+if __name__ == '__main__':
+    main()
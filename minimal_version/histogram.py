@@ -0,0 +1,98 @@
+"""
+HDR-style latency histogram used by the load test.
+Values are recorded as integer microseconds into log-linear buckets, so the
+memory footprint is fixed regardless of how many samples are recorded and
+every recorded value keeps 3 significant digits of precision.
+"""
+
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram (HdrHistogram bucket layout)."""
+
+    def __init__(self, highest_trackable_us: int = 3_600_000_000, significant_digits: int = 3):
+        # Smallest power of two that can hold 2 * 10^digits distinct values per bucket
+        largest_single_unit = 2 * 10 ** significant_digits
+        self.sub_bucket_count = 1 << (largest_single_unit - 1).bit_length()
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_half_count_magnitude = self.sub_bucket_half_count.bit_length() - 1
+        self.sub_bucket_mask = self.sub_bucket_count - 1
+
+        bucket_count = 1
+        smallest_untrackable = self.sub_bucket_count
+        while smallest_untrackable <= highest_trackable_us:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+
+        self.highest_trackable_us = highest_trackable_us
+        self.counts = [0] * ((bucket_count + 1) * self.sub_bucket_half_count)
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self._sum = 0
+
+    def _counts_index(self, value: int) -> int:
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - (self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket_index = value >> bucket_index
+        return ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + (sub_bucket_index - self.sub_bucket_half_count)
+
+    def _value_from_index(self, index: int) -> int:
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << bucket_index
+
+    def _highest_equivalent_value(self, index: int) -> int:
+        bucket_index = max((index >> self.sub_bucket_half_count_magnitude) - 1, 0)
+        return self._value_from_index(index) + (1 << bucket_index) - 1
+
+    def record(self, value_us: int, count: int = 1):
+        """Record a latency value (microseconds)."""
+        value_us = min(max(int(value_us), 0), self.highest_trackable_us)
+        self.counts[self._counts_index(value_us)] += count
+        self.total_count += count
+        self._sum += value_us * count
+        if self.min_value is None or value_us < self.min_value:
+            self.min_value = value_us
+        if value_us > self.max_value:
+            self.max_value = value_us
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add all samples from another histogram with the same layout."""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total_count += other.total_count
+        self._sum += other._sum
+        if other.min_value is not None and (self.min_value is None or other.min_value < self.min_value):
+            self.min_value = other.min_value
+        self.max_value = max(self.max_value, other.max_value)
+
+    def value_at_percentile(self, percentile: float) -> int:
+        """Return the value (microseconds) at or below which `percentile` % of samples fall."""
+        if self.total_count == 0:
+            return 0
+        target = max(1, int(round(self.total_count * min(percentile, 100.0) / 100.0 + 0.4999999)))
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return min(self._highest_equivalent_value(index), self.max_value)
+        return self.max_value
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.total_count if self.total_count else 0.0
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)) -> dict:
+        """Summarise the histogram in milliseconds."""
+        summary = {
+            'count': self.total_count,
+            'min_ms': (self.min_value or 0) / 1000.0,
+            'mean_ms': self.mean / 1000.0,
+            'max_ms': self.max_value / 1000.0,
+        }
+        for p in percentiles:
+            summary[f'p{p:g}_ms'] = self.value_at_percentile(p) / 1000.0
+        return summary
@@ -2,10 +2,28 @@
 """
 Load testing script to demonstrate horizontal scaling benefits.
 Sends multiple tasks to test worker capacity and scaling.
+
+Modes:
+  closed   - send N tasks of each type, then wait for all of them (default)
+  open     - send at a fixed rate for a fixed duration and report send->result
+             latency percentiles per queue, corrected for coordinated omission
+  publish  - compare enqueue throughput of per-call .delay() with dispatch_many()
+  batching - compare messages/sec and tasks/sec with micro-task batching off and on
+
+--lane sends the closed and open mode tasks to a priority lane of queues
+split into lanes in the `priorities` section of test-config.yml.
 """
+import resource
+import sys
 import time
 import subprocess
-from celery_app import task_a, task_b, config
+from itertools import repeat
+from celery_app import app, task_a, task_b, config
+from batching import BatchDispatcher
+from collector import ResultCollector
+from histogram import LatencyHistogram
+from publisher import dispatch_many, pooled_producer
+from timeline import PhaseHistograms, wall_clock
 
 def get_actual_worker_count():
     """Get the actual number of running worker containers."""
@@ -16,69 +34,283 @@ def get_actual_worker_count():
         # Count lines that contain worker containers (skip header)
         worker_containers = [line for line in lines if 'worker-' in line and 'Up' in line]
         return len(worker_containers)
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, FileNotFoundError):
         return 0
 
-def run_load_test(num_tasks: int = 20):
-    """Run load test by sending multiple tasks of each type."""
+def run_load_test(num_tasks: int = 20, window: int = None, timeout: float = 60.0, lane: str = None):
+    """
+    Run load test by sending multiple tasks of each type.
+
+    Without a window every task is sent up front. With `window` set, at most
+    that many tasks per queue are in flight at once: a new task is sent only
+    when a result for that queue comes back, and each result is folded into
+    running totals and released immediately, so dispatcher memory and broker
+    queue depth stay flat however many tasks a run sends.
+    """
     actual_workers = get_actual_worker_count()
     print(f"Starting load test with {num_tasks} tasks of each type...")
     print(f"Running workers: {actual_workers}")
+    if window:
+        print(f"In-flight window: {window} tasks per queue")
     print("-" * 50)
     
     start_time = time.time()
     
-    # Send all tasks concurrently (both types)
-    print(f"Sending {num_tasks} Task A tasks...")
-    tasks_a = [task_a.delay() for _ in range(num_tasks)]
-    
-    print(f"Sending {num_tasks} Task B tasks...")
-    tasks_b = [task_b.delay() for _ in range(num_tasks)]
+    collector = ResultCollector(app)
+    routed_tasks = {'A': task_a, 'B': task_b}
+    queues = {'A': config['task_routing']['task_a'], 'B': config['task_routing']['task_b']}
+    remaining = {label: num_tasks for label in routed_tasks}
+    in_flight = {label: 0 for label in routed_tasks}
+    completed_count = {label: 0 for label in routed_tasks}
+    execution_total = {label: 0.0 for label in routed_tasks}
+    latency = {queues[label]: LatencyHistogram() for label in routed_tasks}
+    phases = PhaseHistograms()
+    errors = 0
+    progress_step = max(10, num_tasks // 10)
     
-    # Wait for all Task A results
-    print("Waiting for Task A results...")
-    results_a = []
-    for i, task in enumerate(tasks_a):
-        try:
-            result = task.get()
-            results_a.append(result)
-            if (i + 1) % 10 == 0:
-                print(f"  Completed {i + 1}/{num_tasks} Task A tasks")
-        except Exception as e:
-            print(f"  Error in Task A {i + 1}: {e}")
-    
-    # Wait for all Task B results
-    print("Waiting for Task B results...")
-    results_b = []
-    for i, task in enumerate(tasks_b):
-        try:
-            result = task.get()
-            results_b.append(result)
-            if (i + 1) % 10 == 0:
-                print(f"  Completed {i + 1}/{num_tasks} Task B tasks")
-        except Exception as e:
-            print(f"  Error in Task B {i + 1}: {e}")
+    with pooled_producer(app) as (producer, _):
+        if not window:
+            # Send all tasks concurrently (both types)
+            for label, task in routed_tasks.items():
+                print(f"Sending {num_tasks} Task {label} tasks...")
+                for _ in range(num_tasks):
+                    collector.add(task.apply_async(producer=producer, lane=lane), label=label)
+                in_flight[label], remaining[label] = num_tasks, 0
+            print("Waiting for results (in completion order)...")
+        
+        last_progress = time.time()
+        while any(remaining.values()) or len(collector):
+            # Top up each queue's window
+            for label, task in routed_tasks.items():
+                while remaining[label] and in_flight[label] < window:
+                    collector.add(task.apply_async(producer=producer, lane=lane), label=label)
+                    in_flight[label] += 1
+                    remaining[label] -= 1
+            
+            finished = collector.drain(timeout=1.0)
+            if finished:
+                last_progress = time.time()
+            elif time.time() - last_progress > timeout:
+                print(f"  No results for {timeout}s, giving up on {len(collector)} in-flight tasks")
+                break
+            
+            # Aggregate and release each result as soon as it arrives
+            for completed in finished:
+                label = completed.label
+                in_flight[label] -= 1
+                if completed.status != 'success':
+                    errors += 1
+                    print(f"  Error in Task {label} ({completed.task_id}): {completed.error}")
+                    continue
+                completed_count[label] += 1
+                execution_total[label] += completed.result['execution_time']
+                latency[queues[label]].record((completed.received_at - completed.sent_at) * 1e6)
+                phases.record(queues[label], completed.result, wall_clock(completed.received_at))
+                if completed_count[label] % progress_step == 0:
+                    print(f"  Completed {completed_count[label]}/{num_tasks} Task {label} tasks")
     
     total_time = time.time() - start_time
+    completed_total = sum(completed_count.values())
     
     print("-" * 50)
     print("Load Test Summary:")
-    print(f"  Total tasks sent: {num_tasks * 2}")
+    print(f"  Total tasks sent: {num_tasks * 2 - sum(remaining.values())}")
+    print(f"  Completed: {completed_total} (errors: {errors}, unfinished: {len(collector)})")
     print(f"  Total time: {total_time:.3f}s")
-    print(f"  Overall throughput: {(num_tasks * 2) / total_time:.2f} tasks/sec")
-    print(f"  Task A average execution: {sum(r['execution_time'] for r in results_a) / len(results_a):.3f}s")
-    print(f"  Task B average execution: {sum(r['execution_time'] for r in results_b) / len(results_b):.3f}s")
+    print(f"  Overall throughput: {completed_total / total_time:.2f} tasks/sec")
+    for label in routed_tasks:
+        if completed_count[label]:
+            print(f"  Task {label} average execution: {execution_total[label] / completed_count[label]:.3f}s")
+    print(f"  Peak dispatcher RSS: {peak_rss_mb():.1f} MB")
+    print_latency_table("Send -> result latency:", latency)
+    phases.print_table()
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def print_latency_table(title: str, histograms: dict):
+    """Print a percentile table with one row per queue."""
+    print(f"  {title}")
+    print(f"    {'queue':<10} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}  (ms)")
+    for queue, histogram in histograms.items():
+        s = histogram.summary()
+        print(f"    {queue:<10} {s['count']:>7} {s['p50_ms']:>9.1f} {s['p90_ms']:>9.1f} "
+              f"{s['p99_ms']:>9.1f} {s['p99.9_ms']:>9.1f} {s['max_ms']:>9.1f}")
+
+def run_open_loop(rate: float, duration: float, timeout: float = 30.0, lane: str = None):
+    """
+    Open-loop load test: send at a fixed rate, regardless of how fast results return.
+
+    Sends alternate between task_a and task_b. Task i is scheduled at
+    start + i / rate; if the dispatcher falls behind it sends immediately to
+    catch up rather than skipping the slot. Latency is reported twice:
+      - service:   actual send -> result received (what a closed-loop client sees)
+      - corrected: scheduled send -> result received, so any time the sender
+                   itself was stalled is charged to the request (coordinated
+                   omission correction)
+    """
+    routed_tasks = [
+        (task_a, config['task_routing']['task_a']),
+        (task_b, config['task_routing']['task_b']),
+    ]
+    queues = [queue for _, queue in routed_tasks]
+    service = {queue: LatencyHistogram() for queue in queues}
+    corrected = {queue: LatencyHistogram() for queue in queues}
+    errors = {queue: 0 for queue in queues}
+    phases = PhaseHistograms()
+    collector = ResultCollector(app)
+    max_send_lag = 0.0
+
+    def record(completed):
+        queue, scheduled = completed.label
+        if completed.status == 'success':
+            service[queue].record((completed.received_at - completed.sent_at) * 1e6)
+            corrected[queue].record((completed.received_at - scheduled) * 1e6)
+            phases.record(queue, completed.result, wall_clock(completed.received_at))
+        else:
+            errors[queue] += 1
+
+    interval = 1.0 / rate
+    print(f"Starting open-loop load test at {rate:g} tasks/sec for {duration:g}s...")
+    print(f"Running workers: {get_actual_worker_count()}")
+    print("-" * 50)
+
+    start_time = time.perf_counter()
+    sent_count = 0
+    while True:
+        now = time.perf_counter()
+        if now - start_time >= duration:
+            break
+        scheduled = start_time + sent_count * interval
+        if now < scheduled:
+            for completed in collector.drain(scheduled - now):
+                record(completed)
+            continue
+
+        task, queue = routed_tasks[sent_count % len(routed_tasks)]
+        sent = time.perf_counter()
+        collector.add(task.apply_async(lane=lane), label=(queue, scheduled), sent_at=sent)
+        max_send_lag = max(max_send_lag, sent - scheduled)
+        sent_count += 1
+    send_time = time.perf_counter() - start_time
+
+    print(f"Sent {sent_count} tasks in {send_time:.3f}s, waiting for {len(collector)} outstanding results...")
+    timed_out = 0
+    for completed in collector.iter_completed(timeout=timeout):
+        if completed.status == 'timeout':
+            timed_out += 1
+        else:
+            record(completed)
+    total_time = time.perf_counter() - start_time
+
+    print("-" * 50)
+    print("Open-Loop Load Test Summary:")
+    print(f"  Target rate: {rate:g} tasks/sec")
+    print(f"  Achieved send rate: {sent_count / send_time:.2f} tasks/sec")
+    print(f"  Max send lag behind schedule: {max_send_lag * 1000:.1f}ms")
+    completed = sum(h.total_count for h in service.values())
+    print(f"  Completed: {completed}/{sent_count} (errors: {sum(errors.values())}, timed out: {timed_out})")
+    print(f"  Completion throughput: {completed / total_time:.2f} tasks/sec")
+    print_latency_table("Corrected latency (scheduled send -> result):", corrected)
+    print_latency_table("Service latency (actual send -> result):", service)
+    phases.print_table()
+
+def run_publish_benchmark(num_tasks: int, batch_size: int = 500, confirm: bool = False):
+    """
+    Measure how fast the dispatcher can enqueue task_a messages.
+
+    Publishes `num_tasks` messages with one .delay() per message, then the same
+    number through dispatch_many(). Results are not collected; the workers
+    will still execute everything that was enqueued.
+    """
+    print(f"Publish benchmark: {num_tasks} task_a messages per method"
+          f" (batch size {batch_size}, confirms {'on' if confirm else 'off'})")
+    print("-" * 50)
+
+    start_time = time.perf_counter()
+    for _ in range(num_tasks):
+        task_a.delay()
+    per_call_time = time.perf_counter() - start_time
+    print(f"  per-call .delay():  {per_call_time:.3f}s  {num_tasks / per_call_time:>10.1f} msgs/sec")
+
+    start_time = time.perf_counter()
+    dispatch_many(task_a, repeat((), num_tasks), batch_size=batch_size, confirm=confirm, on_sent=lambda r: None)
+    bulk_time = time.perf_counter() - start_time
+    print(f"  dispatch_many():    {bulk_time:.3f}s  {num_tasks / bulk_time:>10.1f} msgs/sec")
+
+    print("-" * 50)
+    print(f"  Speedup: {per_call_time / bulk_time:.2f}x")
+
+def run_batching_benchmark(num_tasks: int, timeout: float = 120.0):
+    """
+    Run the same task_a/task_b invocations with batching off, then on.
+
+    Batch sizes and linger times come from the `batching.routes` section of
+    test-config.yml. Reports broker messages/sec and logical tasks/sec,
+    measured from the first submit to the last result.
+    """
+    print(f"Batching benchmark: {num_tasks} invocations of each task type")
+    for task_name, route in config.get('batching', {}).get('routes', {}).items():
+        print(f"  {task_name}: batch_size={route.get('batch_size')} max_linger_ms={route.get('max_linger_ms')}")
+    print("-" * 50)
+
+    for enabled in (False, True):
+        dispatcher = BatchDispatcher(enabled=enabled)
+        start_time = time.perf_counter()
+        for _ in range(num_tasks):
+            dispatcher.submit(task_a)
+            dispatcher.submit(task_b)
+        completed = errors = 0
+        for invocation in dispatcher.iter_completed(timeout=timeout):
+            completed += 1
+            if invocation.status != 'success':
+                errors += 1
+        elapsed = time.perf_counter() - start_time
+
+        label = 'on' if enabled else 'off'
+        print(f"  batching {label:<3}  messages: {dispatcher.messages_sent:>6}  "
+              f"{dispatcher.messages_sent / elapsed:>9.1f} msgs/sec  "
+              f"{completed / elapsed:>9.1f} tasks/sec  ({elapsed:.3f}s, errors: {errors})")
 
 def main():
     import argparse
     parser = argparse.ArgumentParser(description='Load test the distributed system')
+    parser.add_argument('--mode', '-m', choices=['closed', 'open', 'publish', 'batching'], default='closed',
+                       help='closed: send N tasks then wait; open: fixed-rate sending; '
+                            'publish: enqueue throughput benchmark; '
+                            'batching: micro-task batching benchmark (default: closed)')
     parser.add_argument('--tasks', '-t', type=int, default=20, 
                        help='Number of tasks of each type to send (default: 20)')
+    parser.add_argument('--window', '-w', type=int, default=None,
+                       help='Closed mode: max in-flight tasks per queue (default: send everything up front)')
+    parser.add_argument('--rate', '-r', type=float, default=10.0,
+                       help='Open mode: total tasks/sec to send across both queues (default: 10)')
+    parser.add_argument('--duration', '-d', type=float, default=30.0,
+                       help='Open mode: seconds to keep sending (default: 30)')
+    parser.add_argument('--timeout', type=float, default=None,
+                       help='Closed mode: seconds without a result before giving up (default: 60); '
+                            'open mode: seconds to wait for outstanding results after sending (default: 30)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                       help='Publish mode: messages per dispatch_many() batch (default: 500)')
+    parser.add_argument('--confirm', action='store_true',
+                       help='Publish mode: wait for publisher confirms once per batch')
+    parser.add_argument('--lane', default=None,
+                       help='Closed/open mode: priority lane for laned queues (e.g. high; default: default_lane)')
     
     args = parser.parse_args()
     
     try:
-        run_load_test(args.tasks)
+        if args.mode == 'open':
+            run_open_loop(args.rate, args.duration, args.timeout or 30.0, args.lane)
+        elif args.mode == 'publish':
+            run_publish_benchmark(args.tasks, args.batch_size, args.confirm)
+        elif args.mode == 'batching':
+            run_batching_benchmark(args.tasks)
+        else:
+            run_load_test(args.tasks, args.window, args.timeout or 60.0, args.lane)
     except KeyboardInterrupt:
         print("\nLoad test interrupted by user")
     except Exception as e:
@@ -0,0 +1,55 @@
+"""
+Docker-free local broker.
+
+kombu's filesystem transport keeps every queue as message files in one
+directory, so a dispatcher and worker processes on the same host can talk
+without RabbitMQ (the rpc:// result backend works over it too). Its stock
+writer creates the message file before writing it, so a consumer listing the
+directory at that moment can pick up a partial message; the Channel here
+writes a `.part` file and renames it into place instead.
+
+celery_app uses it when LOCAL_BROKER_DIR is set, as bench_local.py does for
+itself and the workers it starts. The in-memory transport (memory://) is not
+an option for separate worker processes: its queues live in one process.
+"""
+import os
+import uuid
+from time import monotonic
+
+from kombu.transport import filesystem
+from kombu.utils.encoding import str_to_bytes
+from kombu.utils.json import dumps
+
+
+class Channel(filesystem.Channel):
+
+    def _put(self, queue, payload, **kwargs):
+        """Put `payload` onto `queue`: written under a temp name, then renamed to a .msg file."""
+        filename = '{}_{}.{}.msg'.format(int(round(monotonic() * 1000)), uuid.uuid4(), queue)
+        path = os.path.join(self.data_folder_out, filename)
+        temp_path = path[:-len('.msg')] + '.part'
+        with open(temp_path, 'wb') as f:
+            f.write(str_to_bytes(dumps(payload)))
+        os.replace(temp_path, path)
+
+
+class Transport(filesystem.Transport):
+    Channel = Channel
+
+
+def broker_settings(directory: str, polling_interval: float = 0.05) -> dict:
+    """Celery settings for a filesystem broker kept under `directory`."""
+    queues = os.path.join(directory, 'queues')
+    control = os.path.join(directory, 'control')
+    os.makedirs(queues, exist_ok=True)
+    os.makedirs(control, exist_ok=True)
+    return {
+        'broker_url': 'filesystem://',
+        'broker_transport': 'local_broker:Transport',
+        'broker_transport_options': {
+            'data_folder_in': queues,
+            'data_folder_out': queues,
+            'control_folder': control,
+            'polling_interval': polling_interval,
+        },
+    }
@@ -0,0 +1,311 @@
+"""
+Memoized dispatch of idempotent tasks.
+
+A CI rerun of the same job matrix sends the same test tasks again while
+their results are still fresh. MemoDispatcher serves calls of tasks declared
+with `idempotent=True` (see celery_app.py) from a cache keyed on the task
+name plus a SHA-256 of the canonical JSON of its arguments, instead of
+sending them:
+
+  LRUCache     this dispatcher's results: at most max_entries, least
+               recently used evicted first, each fresh for its task's ttl
+  ResultStore  a directory of result files shared by the dispatchers on
+               this host (reruns, parallel CI jobs), capped at
+               store_max_entries by least recent use
+
+Identical calls in flight at the same time run once (single flight). In one
+dispatcher the later calls join the first. Across dispatchers, the one that
+creates the key's lease file in the store sends the task, and the others poll
+the store for its result. They take over if the lease holder gives up (the
+task failed) or its lease expires. Only successful results are cached.
+
+Settings come from the `memoization` section of test-config.yml. The
+counters show how many broker messages and task runs the cache saved.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+
+from batching import Invocation
+from collector import ResultCollector
+from config_cache import CACHE_DIR
+
+DEFAULT_STORE_DIR = os.path.join(CACHE_DIR, 'results')
+COUNTERS = ('calls', 'hits', 'store_hits', 'misses', 'coalesced', 'evictions', 'store_evictions', 'expired')
+
+
+def cache_key(task_name: str, args=(), kwargs=None) -> str:
+    """Task name plus a SHA-256 of the canonical JSON of its arguments (usable as a file name)."""
+    canonical = json.dumps([list(args), kwargs or {}], sort_keys=True, separators=(',', ':'))
+    return f'{task_name}-{hashlib.sha256(canonical.encode()).hexdigest()}'
+
+
+class LRUCache:
+    """At most `max_entries` results, least recently used evicted first, each expiring after its ttl."""
+
+    def __init__(self, max_entries: int, counters: Counter, clock=time.time):
+        self.max_entries = max(int(max_entries), 1)
+        self.counters = counters
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """(True, result) while the key is fresh, otherwise (False, None)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= self.clock():
+            del self._entries[key]
+            self.counters['expired'] += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry[1]
+
+    def put(self, key: str, result, ttl: float):
+        self._entries[key] = (self.clock() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+
+class ResultStore:
+    """
+    Result files shared by the dispatchers on this host.
+
+    Each key is one JSON file written to a temp file and renamed, so readers
+    never see a partial result; a hit touches the file, so its mtime orders
+    the least recently used. The cap is enforced every max_entries / 10
+    writes of a dispatcher, so the store may briefly run over by that much.
+    """
+
+    def __init__(self, directory: str, max_entries: int, lease_seconds: float, counters: Counter):
+        self.directory = directory
+        self.max_entries = max(int(max_entries), 1)
+        self.lease_seconds = lease_seconds
+        self.counters = counters
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str = '.json') -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key: str):
+        """(True, result) while the key is fresh, otherwise (False, None)."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if entry['expires_at'] <= time.time():
+            self._remove(path)
+            self.counters['expired'] += 1
+            return False, None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return True, entry['result']
+
+    def put(self, key: str, result, ttl: float):
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'expires_at': time.time() + ttl, 'result': result}, f)
+        os.replace(temp_path, path)
+        self._writes += 1
+        if self._writes % max(self.max_entries // 10, 1) == 0:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used results beyond max_entries."""
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.json'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass  # removed by another dispatcher meanwhile
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            if self._remove(path):
+                self.counters['store_evictions'] += 1
+
+    def claim(self, key: str) -> bool:
+        """Take the lease to run `key`; False while another dispatcher holds a live one."""
+        path = self._path(key, '.lease')
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime < self.lease_seconds:
+                        return False
+                    # Expired: its holder died. Two dispatchers may both get here and run the
+                    # task twice, which is harmless for an idempotent task
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def release(self, key: str):
+        self._remove(self._path(key, '.lease'))
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class MemoDispatcher:
+    """Send tasks through the cache: hits complete at once, identical calls in flight run once."""
+
+    def __init__(self, app, memo_config: dict):
+        self.enabled = memo_config.get('enabled', False)
+        self.default_ttl = memo_config.get('default_ttl', 600)
+        self.task_settings = memo_config.get('tasks') or {}
+        self.poll_interval = memo_config.get('poll_interval', 0.2)
+        self.counters = Counter({name: 0 for name in COUNTERS})
+        self.cache = LRUCache(memo_config.get('max_entries', 10000), self.counters)
+        self.store = None
+        if self.enabled:
+            self.store = ResultStore(memo_config.get('store_dir') or DEFAULT_STORE_DIR,
+                                     memo_config.get('store_max_entries', 100000),
+                                     memo_config.get('lease_seconds', 300), self.counters)
+        self.collector = ResultCollector(app)
+        self.messages_sent = 0
+        self._in_flight = {}  # key -> [Invocation] waiting on a task this dispatcher sent
+        self._waiting = {}    # key -> (task, args, options, [Invocation]) waiting on another dispatcher
+        self._done = []
+
+    def cacheable(self, task) -> bool:
+        return self.enabled and getattr(task, 'idempotent', False)
+
+    def ttl(self, task) -> float:
+        return (self.task_settings.get(task.name.rsplit('.', 1)[-1]) or {}).get('ttl', self.default_ttl)
+
+    def submit(self, task, args: tuple = (), **options) -> Invocation:
+        """Call `task`: from the cache, by joining an identical call in flight, or by sending it."""
+        invocation = Invocation(task.name.rsplit('.', 1)[-1], tuple(args))
+        if not self.cacheable(task):
+            self._send(task, invocation.args, options, None, [invocation])
+            return invocation
+
+        self.counters['calls'] += 1
+        key = cache_key(task.name, invocation.args)
+        found, result = self.cache.get(key)
+        if found:
+            self.counters['hits'] += 1
+            self._complete([invocation], 'success', result)
+        elif key in self._in_flight:
+            self.counters['coalesced'] += 1
+            self._in_flight[key].append(invocation)
+        elif key in self._waiting:
+            self._waiting[key][3].append(invocation)
+        else:
+            found, result = self.store.get(key)
+            if found:
+                self.counters['store_hits'] += 1
+                self.cache.put(key, result, self.ttl(task))
+                self._complete([invocation], 'success', result)
+            elif self.store.claim(key):
+                self.counters['misses'] += 1
+                self._send(task, invocation.args, options, key, [invocation])
+            else:
+                self._waiting[key] = (task, invocation.args, options, [invocation])
+        return invocation
+
+    def _send(self, task, args: tuple, options: dict, key, invocations: list):
+        async_result = task.apply_async(args=args, **options)
+        self.collector.add(async_result, label=(key, self.ttl(task), invocations))
+        if key is not None:
+            self._in_flight[key] = invocations
+        self.messages_sent += 1
+
+    def _complete(self, invocations: list, status: str, result=None, error=None, received_at=None):
+        for invocation in invocations:
+            invocation.status, invocation.result, invocation.error = status, result, error
+            invocation.received_at = received_at or time.perf_counter()
+        self._done += invocations
+
+    def _on_completed(self, completed):
+        key, ttl, invocations = completed.label
+        if key is not None:
+            self._in_flight.pop(key, None)
+            if completed.status == 'success':
+                self.cache.put(key, completed.result, ttl)
+                self.store.put(key, completed.result, ttl)
+            self.store.release(key)
+        self._complete(invocations, completed.status, completed.result, completed.error, completed.received_at)
+
+    def _check_waiting(self):
+        """Pick up results other dispatchers stored, or take over calls whose lease was given up."""
+        for key, (task, args, options, invocations) in list(self._waiting.items()):
+            found, result = self.store.get(key)
+            if not found and self.store.claim(key):
+                # The holder may have stored the result just before releasing its lease
+                found, result = self.store.get(key)
+                if found:
+                    self.store.release(key)
+                else:
+                    del self._waiting[key]
+                    self.counters['misses'] += 1
+                    self.counters['coalesced'] += len(invocations) - 1
+                    self._send(task, args, options, key, invocations)
+                    continue
+            if found:
+                del self._waiting[key]
+                self.counters['coalesced'] += len(invocations)
+                self.cache.put(key, result, self.ttl(task))
+                self._complete(invocations, 'success', result)
+
+    def drain(self, timeout: float = 0.0) -> list:
+        """Wait up to `timeout` seconds; returns the invocations completed since the last call."""
+        if self._waiting:
+            self._check_waiting()
+            timeout = min(timeout, self.poll_interval)
+        if not self._done:
+            if len(self.collector):
+                for completed in self.collector.drain(timeout=timeout):
+                    self._on_completed(completed)
+            elif self._waiting:
+                time.sleep(timeout)
+        done, self._done = self._done, []
+        return done
+
+    def iter_completed(self, timeout: float = None):
+        """Yield invocations as they complete until none are outstanding; the rest time out."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self._done or len(self.collector) or self._waiting:
+            remaining = 1.0 if deadline is None else deadline - time.perf_counter()
+            if remaining <= 0:
+                for completed in self.collector.iter_completed(timeout=0):
+                    self._on_completed(completed)
+                for key, (_, _, _, invocations) in list(self._waiting.items()):
+                    self._complete(invocations, 'timeout', error=f'No result after {timeout}s')
+                self._waiting.clear()
+                yield from self.drain()
+                return
+            yield from self.drain(timeout=min(remaining, 1.0))
+
+    def summary(self) -> str:
+        """One line of cache counters and how many calls were served without a message."""
+        counters = self.counters
+        saved = counters['hits'] + counters['store_hits'] + counters['coalesced']
+        return (f"{counters['hits']} hits, {counters['store_hits']} store hits, {counters['misses']} misses, "
+                f"{counters['coalesced']} coalesced, {counters['evictions']} evictions, "
+                f"{counters['store_evictions']} store evictions, {counters['expired']} expired; "
+                f"{saved} of {counters['calls']} calls served without a message")
@@ -0,0 +1,180 @@
+"""
+Priority lanes with weighted fair scheduling.
+
+Each queue listed under `priorities.queues` in test-config.yml is split into
+one queue per lane (`queue_a.high`, `queue_a.normal`, `queue_a.low`), so a
+task sent to a higher lane never waits behind a bulk backlog in the broker.
+LaneRouter (installed in task_routes by celery_app) sends a task to the lane
+named by its `lane` apply_async option, or to `default_lane`:
+
+    task_a.apply_async(lane='high')
+
+Workers consume every lane of their queues. Lanes only separate the broker
+queues; inside the worker, prefetched tasks would still run in arrival
+order, so LaneScheduler holds reserved tasks per lane and starts them,
+whenever a pool slot frees up, by smooth weighted round robin over the lanes
+that have work. Each such lane gets a share of slots proportional to its
+weight: a busy high lane slows the low lanes down but never starves them.
+"""
+import threading
+from collections import deque
+
+from celery import bootsteps
+
+
+def lane_queues(queue: str, lanes) -> list:
+    """Queue names of every lane of `queue`, highest lane first."""
+    return [f'{queue}.{lane}' for lane in lanes]
+
+
+def lane_of(queue_name: str, lanes) -> str:
+    """'queue_a.high' -> 'high' (None for a queue without a lane suffix)."""
+    _, _, suffix = (queue_name or '').rpartition('.')
+    return suffix if suffix in lanes else None
+
+
+def expand_lanes(queues: list, priorities_config: dict) -> list:
+    """Replace each queue that has lanes with its lane queues."""
+    laned = set(priorities_config.get('queues') or [])
+    lanes = priorities_config.get('lanes') or {}
+    expanded = []
+    for queue in queues:
+        expanded += lane_queues(queue, lanes) if queue in laned else [queue]
+    return expanded
+
+
+class LaneRouter:
+    """Celery router sending tasks of laned queues to the lane in their `lane` option."""
+
+    def __init__(self, task_routing: dict, priorities_config: dict, sharding_config: dict = None):
+        priorities_config = priorities_config or {}
+        self.lanes = list(priorities_config.get('lanes') or {})
+        self.default_lane = priorities_config.get('default_lane') or (self.lanes[-1] if self.lanes else None)
+        self.queues = set(priorities_config.get('queues') or [])
+        if self.queues and self.default_lane not in self.lanes:
+            raise RuntimeError(f"priorities.default_lane '{self.default_lane}' is not one of {self.lanes}")
+        sharded = {queue for queue, settings in (sharding_config or {}).items()
+                   if (settings or {}).get('shards', 1) > 1}
+        if self.queues & sharded:
+            raise RuntimeError(f"Queues can't be both sharded and split into priority lanes: "
+                               f"{', '.join(sorted(self.queues & sharded))}")
+        self.task_queues = {f'celery_app.{task}': queue for task, queue in task_routing.items()}
+
+    def queue_for(self, queue: str, lane: str = None) -> str:
+        """Lane queue of `queue` for `lane` (`queue` itself if it has no lanes)."""
+        if queue not in self.queues:
+            return queue
+        lane = lane or self.default_lane
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown priority lane '{lane}' (choose from {', '.join(self.lanes)})")
+        return f'{queue}.{lane}'
+
+    def __call__(self, name, args, kwargs, options, task=None, **kw):
+        lane = options.pop('lane', None)  # routing-only option, not sent with the message
+        queue = self.task_queues.get(name)
+        if queue not in self.queues:
+            return None
+        return {'queue': self.queue_for(queue, lane)}
+
+
+class WeightedLanes:
+    """Per-lane FIFOs drained by smooth weighted round robin (as in nginx upstreams)."""
+
+    def __init__(self, weights: dict):
+        self.weights = weights
+        self.waiting = {lane: deque() for lane in weights}
+        self.current = dict.fromkeys(weights, 0)
+
+    def __len__(self):
+        return sum(len(items) for items in self.waiting.values())
+
+    def append(self, lane: str, item):
+        self.waiting[lane].append(item)
+
+    def pop(self):
+        """Next item by weighted share among lanes with work (None if all are empty)."""
+        ready = [lane for lane, items in self.waiting.items() if items]
+        if not ready:
+            return None
+        total = 0
+        for lane in ready:
+            self.current[lane] += self.weights[lane]
+            total += self.weights[lane]
+        lane = max(ready, key=self.current.__getitem__)
+        self.current[lane] -= total
+        return self.waiting[lane].popleft()
+
+
+class LaneScheduler:
+    """
+    Stands in for the worker consumer's on_task_request: starts at most
+    `slots` tasks at a time and holds the rest per lane until a slot frees.
+    """
+
+    def __init__(self, handle, slots: int, weights: dict, default_lane: str):
+        self.handle = handle
+        self.slots = slots
+        self.default_lane = default_lane
+        self.lanes = WeightedLanes(weights)
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        lane = lane_of(request.delivery_info.get('routing_key'), self.lanes.weights) or self.default_lane
+        with self.lock:
+            if self.running >= self.slots:
+                self.lanes.append(lane, request)
+                return
+            self.running += 1
+        self._start(request)
+
+    def _start(self, request):
+        finished = threading.Event()
+        on_success, on_failure = request.on_success, request.on_failure
+
+        def release_slot():
+            if not finished.is_set():
+                finished.set()
+                self._release()
+
+        def success(*args, **kwargs):
+            try:
+                return on_success(*args, **kwargs)
+            finally:
+                release_slot()
+
+        def failure(*args, **kwargs):
+            try:
+                return on_failure(*args, **kwargs)
+            finally:
+                release_slot()
+
+        # The pool reports completion through the request's callbacks
+        request.on_success, request.on_failure = success, failure
+        try:
+            self.handle(request)
+        finally:
+            if request.revoked():  # never reaches the pool
+                release_slot()
+
+    def _release(self):
+        with self.lock:
+            request = self.lanes.pop()
+            if request is None:
+                self.running -= 1
+                return
+        self._start(request)
+
+
+def install(app, priorities_config: dict):
+    """Add the lane scheduler to the worker consumer (called by celery_app when lanes are configured)."""
+    weights = {lane: float(weight) for lane, weight in (priorities_config.get('lanes') or {}).items()}
+    default_lane = priorities_config.get('default_lane') or list(weights)[-1]
+
+    class LaneScheduling(bootsteps.Step):
+        """Replace FIFO start order of reserved tasks with weighted fair share across lanes."""
+
+        def __init__(self, c, **kwargs):
+            c.on_task_request = LaneScheduler(c.on_task_request, c.controller.concurrency, weights, default_lane)
+
+    app.steps['consumer'].add(LaneScheduling)
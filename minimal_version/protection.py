@@ -0,0 +1,203 @@
+"""
+Retry-storm protection.
+
+When a dependency of a task fails, every task fails and retries through the
+broker, multiplying the load while the system is weakest. With the
+`protection` section of test-config.yml enabled, ProtectedTask (the base of
+task_a and task_b) guards each queue with:
+
+  CircuitBreaker  opens when the failure rate over a rolling window crosses
+                  a threshold; while open, tasks fail fast or are parked
+                  (re-queued without running and without using up a retry);
+                  after open_seconds a few trial tasks decide whether it
+                  closes again (trials undecided after another
+                  open_seconds are started over)
+  TokenBucket     caps how fast the queue's tasks start, with bursts
+
+Both keep their state in shared memory allocated when celery_app is
+imported, before the worker forks its pool, so every process (or thread) of
+one worker sees the same circuit and draws from the same bucket. Separate
+workers protect themselves independently.
+"""
+import multiprocessing
+import time
+
+from celery import Task
+
+from priorities import lane_of
+from sharding import base_queue
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+WHEN_OPEN = ('fail', 'park')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of running a task while its queue's circuit is open."""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over a rolling window of one-second buckets."""
+
+    def __init__(self, window: int = 30, min_calls: int = 10, failure_rate: float = 0.5,
+                 open_seconds: float = 10.0, half_open_calls: int = 3, clock=time.monotonic):
+        self.window = max(int(window), 1)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        # state, opened_at (half-open since, while half-open), trial calls started, trial calls succeeded
+        self.status = multiprocessing.RawArray('d', 4)
+        # (second, calls, failures) per bucket
+        self.buckets = multiprocessing.RawArray('d', self.window * 3)
+        self.lock = multiprocessing.Lock()
+
+    @property
+    def state(self) -> int:
+        return int(self.status[0])
+
+    def allow(self) -> bool:
+        """
+        Whether a task may run now (takes a trial slot while half-open).
+
+        Trial slots are freed only by record(). A trial that never reports
+        (a child killed by the hard time limit, a lost worker, a revoked
+        task) would hold its slot for good, so trials still undecided
+        `open_seconds` after the circuit went half-open are started over.
+        """
+        with self.lock:
+            now = self.clock()
+            if self.status[0] == OPEN:
+                if now - self.status[1] < self.open_seconds:
+                    return False
+                self.status[:] = [HALF_OPEN, now, 0, 0]
+            if self.status[0] == HALF_OPEN:
+                if self.status[2] >= self.half_open_calls:
+                    if now - self.status[1] < self.open_seconds:
+                        return False
+                    self.status[:] = [HALF_OPEN, now, 0, 0]
+                self.status[2] += 1
+            return True
+
+    def record(self, success: bool):
+        """Count the outcome of a task that allow() let through."""
+        with self.lock:
+            now = self.clock()
+            if self.status[0] == HALF_OPEN:
+                if not success:
+                    self._open(now)
+                else:
+                    self.status[3] += 1
+                    if self.status[3] >= self.half_open_calls:
+                        self.status[:] = [CLOSED, 0, 0, 0]
+                        self.buckets[:] = [0] * len(self.buckets)
+                return
+            if self.status[0] == OPEN:
+                return  # started before the circuit opened
+            second = int(now)
+            index = (second % self.window) * 3
+            if self.buckets[index] != second:
+                self.buckets[index:index + 3] = [second, 0, 0]
+            self.buckets[index + 1] += 1
+            self.buckets[index + 2] += 0 if success else 1
+
+            calls = failures = 0
+            for i in range(0, len(self.buckets), 3):
+                if self.buckets[i] > second - self.window:
+                    calls += self.buckets[i + 1]
+                    failures += self.buckets[i + 2]
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.status[:] = [OPEN, now, 0, 0]
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float = 1.0, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.clock = clock
+        self.state = multiprocessing.RawArray('d', [self.burst, clock()])  # tokens, refilled_at
+        self.lock = multiprocessing.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+                if tokens >= 1:
+                    self.state[:] = [tokens - 1, now]
+                    return waited
+                self.state[:] = [tokens, now]
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class QueueGuard:
+    """Circuit breaker, optional rate limiter and open-circuit policy of one queue."""
+
+    def __init__(self, queue: str, breaker_settings: dict, rate_limit: float = None, burst: float = None):
+        breaker_settings = dict(breaker_settings)
+        self.queue = queue
+        self.when_open = breaker_settings.pop('when_open', 'park')
+        self.park_seconds = breaker_settings.pop('park_seconds', 5)
+        if self.when_open not in WHEN_OPEN:
+            raise RuntimeError(f"Unknown when_open '{self.when_open}' for {queue} (choose from {', '.join(WHEN_OPEN)})")
+        self.breaker = CircuitBreaker(**breaker_settings)
+        self.limiter = TokenBucket(rate_limit, burst or 1) if rate_limit else None
+
+
+_guards = {}
+
+
+def install(protection_config: dict, lanes=()):
+    """Create the shared guards of every queue in `protection.queues` (called by celery_app before forking)."""
+    defaults = protection_config.get('circuit_breaker') or {}
+    for queue, settings in (protection_config.get('queues') or {}).items():
+        settings = settings or {}
+        _guards[queue] = QueueGuard(queue, {**defaults, **(settings.get('circuit_breaker') or {})},
+                                    settings.get('rate_limit'), settings.get('burst'))
+    ProtectedTask.lanes = tuple(lanes)
+
+
+class ProtectedTask(Task):
+    """Task base that runs each task through its queue's guard (a no-op unless installed)."""
+
+    lanes = ()
+
+    def _guard(self):
+        routing_key = (self.request.delivery_info or {}).get('routing_key')
+        if not routing_key or not _guards:
+            return None
+        if lane_of(routing_key, self.lanes):
+            routing_key = routing_key.rpartition('.')[0]
+        return _guards.get(base_queue(routing_key))
+
+    def __call__(self, *args, **kwargs):
+        guard = self._guard()
+        if guard is None:
+            return super().__call__(*args, **kwargs)
+
+        if not guard.breaker.allow():
+            exc = CircuitOpenError(f"Circuit for {guard.queue} is open")
+            if guard.when_open == 'fail':
+                raise exc
+            # Parking is not a failed attempt: re-queue with the retry count the task arrived with
+            self.request.retries -= 1
+            raise self.retry(exc=exc, countdown=guard.park_seconds)
+
+        if guard.limiter:
+            guard.limiter.acquire()
+        try:
+            result = super().__call__(*args, **kwargs)
+        except Exception:  # including the Retry raised by autoretry_for
+            guard.breaker.record(False)
+            raise
+        guard.breaker.record(True)
+        return result
@@ -0,0 +1,164 @@
+"""
+Sharded task queues.
+
+A RabbitMQ queue is served by a single Erlang process, so one hot queue caps
+throughput at what one broker core can push through. A queue listed under
+`sharding` in test-config.yml is split into `shards` queues named
+`<queue>.0` .. `<queue>.<N-1>`; ShardRouter (installed in task_routes by
+celery_app) sends each task to one shard, and worker.py consumes every shard
+of a queue or the subset given with --shards.
+
+Shard choice per queue (`strategy`):
+  round_robin  rotate through the shards
+  hash         consistent hashing of the `shard_key` apply_async option, so
+               one key always lands on the same shard (round robin without one)
+  depth        lowest depth seen by a passive queue.declare probe, refreshed
+               every `depth_refresh` seconds and advanced by this process's
+               own publishes in between
+
+A queue with `shards: 1` (or no entry) keeps its plain name.
+An explicit apply_async(queue=...) bypasses the router, as with any route.
+"""
+import bisect
+import hashlib
+import itertools
+import re
+import threading
+import time
+
+STRATEGIES = ('round_robin', 'hash', 'depth')
+SHARD_SUFFIX = re.compile(r'\.(\d+)$')
+
+
+def shard_names(queue: str, shards: int) -> list:
+    """Queue names for `shards` shards of `queue` (just `queue` if it is not sharded)."""
+    if shards <= 1:
+        return [queue]
+    return [f'{queue}.{index}' for index in range(shards)]
+
+
+def base_queue(name: str) -> str:
+    """'queue_a.3' -> 'queue_a'."""
+    return SHARD_SUFFIX.sub('', name)
+
+
+def parse_shard_spec(spec: str) -> set:
+    """Shard indices from '0,2' or '0-3' (or a mix: '0-1,5')."""
+    indices = set()
+    for part in spec.split(','):
+        start, _, end = part.partition('-')
+        indices.update(range(int(start), int(end or start) + 1))
+    return indices
+
+
+def expand_queues(queues: list, sharding_config: dict, shard_spec: str = None) -> list:
+    """
+    Replace each sharded queue with its shards (or the subset in `shard_spec`).
+    Queues given as explicit shards ('queue_a.1') and unsharded queues are kept.
+    """
+    selected = parse_shard_spec(shard_spec) if shard_spec else None
+    expanded = []
+    for queue in queues:
+        shards = (sharding_config.get(queue) or {}).get('shards', 1)
+        names = shard_names(queue, shards)
+        if selected is not None and shards > 1:
+            names = [name for index, name in enumerate(names) if index in selected]
+            if not names:
+                raise ValueError(f"--shards {shard_spec} selects no shard of {queue} ({shards} shards)")
+        expanded += names
+    return expanded
+
+
+class HashRing:
+    """Consistent hash ring: adding a shard moves only ~1/N of the keys."""
+
+    def __init__(self, shards: list, vnodes: int = 160):
+        self.ring = sorted(
+            (self._hash(f'{shard}#{vnode}'), shard) for shard in shards for vnode in range(vnodes)
+        )
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def shard_for(self, key) -> str:
+        index = bisect.bisect(self.points, self._hash(str(key))) % len(self.ring)
+        return self.ring[index][1]
+
+
+class DepthTracker:
+    """Estimated shard depths: periodic passive declares plus local publishes since."""
+
+    def __init__(self, app, shards: list, refresh: float = 1.0):
+        self.app = app
+        self.shards = shards
+        self.refresh = refresh
+        self.depths = dict.fromkeys(shards, 0)
+        self.probed_at = 0.0
+        self.lock = threading.Lock()
+        self.rotation = itertools.count()
+
+    def _probe(self):
+        with self.app.connection_for_read() as connection:
+            for shard in self.shards:
+                # One channel per shard: a passive declare of a missing queue closes its channel
+                with connection.channel() as channel:
+                    try:
+                        _, depth, _ = channel.queue_declare(queue=shard, passive=True)
+                    except connection.channel_errors:
+                        depth = 0  # not declared yet: nothing has been published to it
+                self.depths[shard] = depth
+        self.probed_at = time.monotonic()
+
+    def pick(self) -> str:
+        with self.lock:
+            if time.monotonic() - self.probed_at >= self.refresh:
+                self._probe()
+            lowest = min(self.depths.values())
+            candidates = [shard for shard in self.shards if self.depths[shard] == lowest]
+            # Rotate among equally shallow shards instead of always taking the first
+            shard = candidates[next(self.rotation) % len(candidates)]
+            self.depths[shard] += 1
+            return shard
+
+
+class ShardRouter:
+    """Celery router sending tasks of sharded queues to one of their shards."""
+
+    def __init__(self, app, task_routing: dict, sharding_config: dict):
+        self.task_queues = {f'celery_app.{task}': queue for task, queue in task_routing.items()}
+        self.choosers = {}
+        for queue, settings in (sharding_config or {}).items():
+            settings = settings or {}
+            shards = shard_names(queue, settings.get('shards', 1))
+            if len(shards) == 1:
+                continue
+            strategy = settings.get('strategy', 'round_robin')
+            if strategy not in STRATEGIES:
+                raise RuntimeError(f"Unknown sharding strategy '{strategy}' for {queue} "
+                                   f"(choose from {', '.join(STRATEGIES)})")
+            self.choosers[queue] = self._chooser(app, shards, strategy, settings)
+
+    @staticmethod
+    def _chooser(app, shards: list, strategy: str, settings: dict):
+        rotation = itertools.cycle(shards)
+        if strategy == 'hash':
+            ring = HashRing(shards)
+            return lambda key: ring.shard_for(key) if key is not None else next(rotation)
+        if strategy == 'depth':
+            tracker = DepthTracker(app, shards, settings.get('depth_refresh', 1.0))
+            return lambda key: tracker.pick()
+        return lambda key: next(rotation)
+
+    def queue_for(self, queue: str, key=None) -> str:
+        """Shard of `queue` for the next task (`queue` itself if it is not sharded)."""
+        chooser = self.choosers.get(queue)
+        return chooser(key) if chooser else queue
+
+    def __call__(self, name, args, kwargs, options, task=None, **kw):
+        key = options.pop('shard_key', None)  # routing-only option, not sent with the message
+        queue = self.task_queues.get(name)
+        if queue not in self.choosers:
+            return None
+        return {'queue': self.queue_for(queue, key)}
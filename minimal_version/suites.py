@@ -0,0 +1,130 @@
+"""
+Test suites reduced on the workers.
+
+Collecting every test case's result back to one dispatcher and aggregating
+there makes the dispatcher the bottleneck for large suites. A suite is
+instead split into chunks of `chunk_size` cases of one task; each chunk runs
+as one `run_cases` task on its task's queue and returns a summary instead of
+per-case results. `run_suite` tasks on `reduce_queue` form a tree with at
+most `fanout` children per node: each node sends its children as a group,
+waits for them and merges their summaries, so the dispatcher sends one
+message and receives the aggregate of the whole suite plus its failures.
+
+Celery's chord would do the fan-in in the result backend, but the rpc://
+backend used here cannot run chords (results go only to the process that
+sent the task), so a node waits on its children while holding a worker slot.
+The workers consuming reduce_queue therefore need a slot for every node of
+the tree at once, which check_tree() enforces before a suite is sent. The
+check covers one suite: suites running at the same time share those slots,
+so dispatch_suite.py runs one suite at a time per host.
+"""
+import os
+
+def plan(cases, chunk_size: int) -> list:
+    """Split (task name, args) cases into [task name, index of first case, [args, ...]] chunks."""
+    chunk_size = max(int(chunk_size), 1)
+    chunks = []
+    for index, (task_name, args) in enumerate(cases):
+        chunk = chunks[-1] if chunks else None
+        if chunk is None or chunk[0] != task_name or len(chunk[2]) >= chunk_size:
+            chunk = [task_name, index, []]
+            chunks.append(chunk)
+        chunk[2].append(list(args))
+    return chunks
+
+def tree_depth(chunk_count: int, fanout: int) -> int:
+    """Levels of run_suite nodes above the run_cases leaves."""
+    depth = 1
+    while chunk_count > fanout:
+        chunk_count = -(-chunk_count // fanout)
+        depth += 1
+    return depth
+
+def split(chunks: list, fanout: int) -> list:
+    """Split a node's chunks between its children, filling each child's subtree before the next."""
+    capacity = fanout ** (tree_depth(len(chunks), fanout) - 1)
+    return [chunks[start:start + capacity] for start in range(0, len(chunks), capacity)]
+
+def tree_nodes(chunk_count: int, fanout: int) -> int:
+    """Number of run_suite nodes for `chunk_count` chunks (all alive at once in the worst case)."""
+    if chunk_count <= fanout:
+        return 1
+    return 1 + sum(tree_nodes(len(part), fanout) for part in split(list(range(chunk_count)), fanout))
+
+def configured_slots(workers_config: dict, reduce_queue: str) -> int:
+    """Concurrency of a reduce_queue worker per the `workers` section (Celery's default, the CPU count, if unset)."""
+    settings = {**(workers_config.get('default') or {}), **(workers_config.get(reduce_queue) or {})}
+    return settings.get('concurrency') or os.cpu_count()
+
+def check_tree(chunk_count: int, fanout: int, slots: int):
+    """
+    Raise ValueError if the tree would need more reducer slots than `slots`.
+
+    Only one suite is accounted for: two trees that fit on their own can
+    together take every slot with nodes waiting on children queued behind
+    them, and stay stuck until suites.timeout.
+    """
+    if fanout < 2:
+        raise ValueError(f"suites.fanout must be at least 2, got {fanout}")
+    nodes = tree_nodes(chunk_count, fanout)
+    if nodes > slots:
+        raise ValueError(f"{chunk_count} chunks need {nodes} reducer slots with fanout {fanout}, "
+                         f"the reduce workers have {slots}: raise fanout, chunk_size or the reduce worker's concurrency")
+
+def empty_summary() -> dict:
+    return {'tasks': {}, 'failures': [], 'failures_dropped': 0}
+
+def _add_task(summary: dict, task_name: str, stats: dict):
+    totals = summary['tasks'].get(task_name)
+    if totals is None:
+        summary['tasks'][task_name] = dict(stats)
+        return
+    for key in ('count', 'passed', 'failed', 'total_time'):
+        totals[key] += stats[key]
+    for key, pick in (('min_time', min), ('max_time', max)):
+        if stats[key] is not None:
+            totals[key] = stats[key] if totals[key] is None else pick(totals[key], stats[key])
+
+def _add_failures(summary: dict, failures: list, dropped: int, max_failures: int):
+    room = max(max_failures - len(summary['failures']), 0)
+    summary['failures'] += failures[:room]
+    summary['failures_dropped'] += dropped + max(len(failures) - room, 0)
+
+def summarize(task_name: str, first_case: int, outcomes: list, max_failures: int) -> dict:
+    """Summary of one chunk from its (seconds, error or None) outcomes; times count passed cases only."""
+    passed = [seconds for seconds, error in outcomes if error is None]
+    summary = empty_summary()
+    _add_task(summary, task_name, {
+        'count': len(outcomes),
+        'passed': len(passed),
+        'failed': len(outcomes) - len(passed),
+        'total_time': sum(passed),
+        'min_time': min(passed) if passed else None,
+        'max_time': max(passed) if passed else None,
+    })
+    failures = [{'task': task_name, 'case': first_case + index, 'count': 1, 'error': error}
+                for index, (_, error) in enumerate(outcomes) if error is not None]
+    _add_failures(summary, failures, 0, max_failures)
+    return summary
+
+def lost(chunks: list, error) -> dict:
+    """Summary counting every case of `chunks` as failed, for a child task that failed as a whole."""
+    summary = empty_summary()
+    for task_name, first_case, args_list in chunks:
+        _add_task(summary, task_name, {'count': len(args_list), 'passed': 0, 'failed': len(args_list),
+                                       'total_time': 0.0, 'min_time': None, 'max_time': None})
+        summary['failures'].append({'task': task_name, 'case': first_case, 'count': len(args_list),
+                                    'error': f"{type(error).__name__}: {error}"})
+    return summary
+
+def is_summary(value) -> bool:
+    return isinstance(value, dict) and 'tasks' in value and 'failures' in value
+
+def merge(summaries, max_failures: int) -> dict:
+    """Merge partial summaries; keeps at most `max_failures` failures and counts the rest."""
+    merged = empty_summary()
+    for summary in summaries:
+        for task_name, stats in summary['tasks'].items():
+            _add_task(merged, task_name, stats)
+        _add_failures(merged, summary['failures'], summary['failures_dropped'], max_failures)
+    return merged
@@ -0,0 +1,71 @@
+"""
+Per-phase task latency.
+
+Every task message is stamped with its publish time, the worker records when
+it received the message and when the task started and finished, and the task
+returns those wall-clock timestamps as `timeline` in its result. Adding the
+time the result reached the dispatcher splits each task's latency into:
+
+  queue     published -> received by a worker (waiting in the broker)
+  reserved  received  -> started (waiting in the worker's prefetch buffer)
+  execute   started   -> finished
+  result    finished  -> result back at the dispatcher
+
+The timestamps come from different hosts' clocks, so the cross-host phases
+(queue, result) are only as accurate as the hosts' clock synchronisation.
+"""
+import time
+
+from histogram import LatencyHistogram
+
+# (phase, from, to)
+PHASES = [
+    ('queue', 'published_at', 'received_at'),
+    ('reserved', 'received_at', 'started_at'),
+    ('execute', 'started_at', 'finished_at'),
+    ('result', 'finished_at', 'returned_at'),
+]
+
+
+def wall_clock(perf_counter_time: float) -> float:
+    """Convert a time.perf_counter() reading into wall-clock (time.time()) seconds."""
+    return time.time() - (time.perf_counter() - perf_counter_time)
+
+
+class PhaseHistograms:
+    """Latency histograms per queue and phase, fed from task result timelines."""
+
+    def __init__(self):
+        self.histograms = {}  # queue -> {phase: LatencyHistogram}
+        self.missing = 0  # results without a timeline (e.g. from older workers)
+
+    def record(self, queue: str, result, returned_at: float):
+        """Record one result; `returned_at` is the wall-clock time it reached the dispatcher."""
+        timeline = result.get('timeline') if isinstance(result, dict) else None
+        if not timeline:
+            self.missing += 1
+            return
+        timeline = {**timeline, 'returned_at': returned_at}
+        phases = self.histograms.setdefault(queue, {phase: LatencyHistogram() for phase, _, _ in PHASES})
+        for phase, start, end in PHASES:
+            if timeline.get(start) is not None and timeline.get(end) is not None:
+                # Clock skew between hosts can make a cross-host phase slightly negative
+                phases[phase].record(max(0.0, timeline[end] - timeline[start]) * 1e6)
+
+    def summaries(self) -> dict:
+        """{queue: {phase: LatencyHistogram.summary()}}"""
+        return {
+            queue: {phase: histogram.summary() for phase, histogram in phases.items()}
+            for queue, phases in self.histograms.items()
+        }
+
+    def print_table(self, title: str = "Per-phase latency:", indent: str = "  "):
+        print(f"{indent}{title}")
+        print(f"{indent}  {'queue':<10} {'phase':<9} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+        for queue, phases in self.histograms.items():
+            for phase, histogram in phases.items():
+                s = histogram.summary()
+                print(f"{indent}  {queue:<10} {phase:<9} {s['count']:>7} {s['p50_ms']:>9.1f} {s['p90_ms']:>9.1f} "
+                      f"{s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+        if self.missing:
+            print(f"{indent}  ({self.missing} results had no timeline)")